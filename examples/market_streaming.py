@@ -0,0 +1,22 @@
+from pprint import pprint
+
+from ibwebapiclient import IBWebApiClient, init_logging
+
+# utility function to init colored logging
+init_logging()
+
+# connect to IB web API gateway
+use_ibeam = False  # set to true if using ibeam
+host = "localhost"
+ibc = IBWebApiClient(use_ibeam=use_ibeam, host=host)
+
+# search securities with this symbol
+sec = ibc.search_security("AAPL", "STK")
+# take first one and get contract
+conid = sec[0]["conid"]
+
+# subscribe to market data and iterate over ticks as soon as they arrive
+with ibc.stream_market_data(conid=conid) as stream:
+    for tick in stream:
+        print("")
+        pprint(tick)
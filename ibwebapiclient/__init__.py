@@ -1,8 +1,23 @@
+from .async_client import AsyncIBWebApiClient
 from .client import IBWebApiClient
+from .coalesce import RequestCoalescer
+from .contract_cache import ContractCache
+from .history import BackfillError, HistoryBackfill
+from .history_cache import HistoryCache
 from .models import MarketDataFields, OrderSide, OrderTIF, OrderType
+from .options import StrikeIndex
 from .orders import build_bracket_order, build_exit_strategy
+from .polling import SnapshotPoller
+from .ratelimit import RateLimiter
+from .retry import RetryPolicy
+from .streaming import TickBuffer
+from .symbol_index import SymbolIndex
+from .tickstore import TickStore
 from .utils import init_logging
 
-__all__ = ("IBWebApiClient", "init_logging", "MarketDataFields",
-           "build_bracket_order", "build_exit_strategy", "OrderSide",
-           "OrderType", "OrderTIF")
+__all__ = ("IBWebApiClient", "AsyncIBWebApiClient", "init_logging",
+           "MarketDataFields", "build_bracket_order", "build_exit_strategy",
+           "OrderSide", "OrderType", "OrderTIF", "TickBuffer", "SnapshotPoller",
+           "TickStore", "HistoryBackfill", "BackfillError", "HistoryCache",
+           "ContractCache", "SymbolIndex", "StrikeIndex", "RateLimiter",
+           "RequestCoalescer", "RetryPolicy")
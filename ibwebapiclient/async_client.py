@@ -0,0 +1,702 @@
+import asyncio
+import json
+import logging
+import socket
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple, Union
+
+import aiohttp
+import pandas as pd
+
+from .client import (IBWebApiClient, build_option_chain, expiration_to_month,
+                     group_expirations_by_month, split_option_chains)
+from .coalesce import RequestCoalescer
+from .contract_cache import ContractCache
+from .decoding import decode_market_data, decode_market_data_df
+from .greeks import compute_chain_greeks
+from .history import decode_market_history, format_history_time
+from .models import (ContractInfo, GatewayStatus, MarketHistory, OptionChain,
+                     OptionInfo, OptionStrikes, Order, Position, Trade,
+                     map_market_data_fields)
+from .options import select_strike_window
+from .quotes import QuoteBook
+from .ratelimit import RateLimiter
+from .retry import DeadlineExceeded, RetryPolicy
+from .streaming import MarketDataHandler
+from .subscriptions import SubscriptionManager
+from .symbol_index import SymbolIndex
+from .websocket_session import WebSocketSession
+
+
+class AsyncIBWebApiClient:
+    """Asyncio version of `IBWebApiClient`.
+
+    Same methods and return values as the blocking client, but every call is a
+    coroutine and all of them share a pooled `aiohttp` session, so that many
+    requests can be in flight at the same time on a single event loop.
+
+    The client must be connected before use, either with `await connect()` or
+    with `async with AsyncIBWebApiClient(...) as ibc:`.
+
+    Websocket commands go through the same persistent `WebSocketSession` as
+    the blocking client, and market data subscriptions are reference counted
+    by a `SubscriptionManager`. Realtime ticks update the quote book (see
+    `get_quote()`), but streaming and market data callbacks are only provided
+    by the blocking client.
+    """
+    _log: logging.Logger = logging.getLogger("AsyncIBWebApiClient")
+    _api_url: str = "https://{host}:5000/v1/api/"
+    _ws_url: str = "wss://{host}:5000/v1/api/ws"
+    _ready_url: str = "http://{host}:5001/readyz"
+    _live_url: str = "http://{host}:5001/livez"
+    _timeouts = (5.0, 30.0)  # connection and read timeouts
+    _session: Optional[aiohttp.ClientSession]
+    _max_connections: int
+    _keep_alive: bool
+    _ws_session: Optional[WebSocketSession]
+    _quotes: QuoteBook
+    _subscriptions: Optional[SubscriptionManager]
+    _max_market_data_lines: int
+    _contract_cache: ContractCache
+    _rate_limiter: RateLimiter
+    _coalescer: RequestCoalescer
+    _retry_policy: RetryPolicy
+    _symbol_index: SymbolIndex
+    _use_ibeam: bool
+    _user: dict
+    _accounts: dict
+    _account_id: str
+
+    def __init__(self,
+                 use_ibeam: bool = True,
+                 host: Optional[str] = None,
+                 max_connections: int = 100,
+                 contract_cache: Optional[ContractCache] = None,
+                 rate_limiter: Optional[RateLimiter] = None,
+                 coalescer: Optional[RequestCoalescer] = None,
+                 retry_policy: Optional[RetryPolicy] = None,
+                 keep_alive: bool = True,
+                 max_market_data_lines: int = 100):
+        self._session = None
+        self._use_ibeam = use_ibeam
+        self._max_connections = max_connections
+        self._keep_alive = keep_alive
+        self._ws_session = None
+        self._quotes = QuoteBook()
+        self._subscriptions = None
+        self._max_market_data_lines = max_market_data_lines
+        self._contract_cache = (contract_cache if contract_cache is not None
+                                else ContractCache())
+        self._symbol_index = SymbolIndex()
+        self._rate_limiter = (rate_limiter
+                              if rate_limiter is not None else RateLimiter())
+        self._coalescer = (coalescer
+                           if coalescer is not None else RequestCoalescer())
+        self._retry_policy = (retry_policy
+                              if retry_policy is not None else RetryPolicy())
+        self._index_contract_cache()
+
+        if use_ibeam:
+            if host is None:
+                host = "ibeam"
+            data = socket.gethostbyname_ex(host)
+            host = data[2][0]
+            self._log.debug(f"ibeam ip = {host}")
+        elif host is None:
+            host = "localhost"
+
+        self._api_url = self._api_url.format(host=host)
+        self._ws_url = self._ws_url.format(host=host)
+        self._ready_url = self._ready_url.format(host=host)
+        self._live_url = self._live_url.format(host=host)
+
+    async def __aenter__(self) -> "AsyncIBWebApiClient":
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def connect(self):
+        """Open the HTTP connection pool and initialize the gateway session."""
+        if self._session is None or self._session.closed:
+            # no SSL verification, the gateway uses a self-signed certificate
+            # aiohttp already disables Nagle's algorithm (TCP_NODELAY)
+            connector = aiohttp.TCPConnector(limit=self._max_connections,
+                                             force_close=not self._keep_alive,
+                                             ssl=False)
+            timeout = aiohttp.ClientTimeout(sock_connect=self._timeouts[0],
+                                            sock_read=self._timeouts[1])
+            self._session = aiohttp.ClientSession(connector=connector,
+                                                  timeout=timeout)
+
+        # test gateway
+        if self._use_ibeam:
+            self._log.debug("Testing gateway...")
+            if not await self.is_gateway_ready():
+                self._log.warning("Gateway not ready")
+                return
+            self._log.warning("Gateway ready")
+        # get user
+        try:
+            self._user = await self.get_user()
+            username = self._user["username"]
+            paper = self._user["ispaper"]
+            self._log.debug(f"Username = {username}, paper = {paper}")
+            # get accounts, necessary to initialize internal GW things I think
+            self._accounts = await self.get_accounts()
+            # get portfolio accounts
+            accounts = await self.get_portfolio_accounts()
+            # use the first one
+            self._account_id = accounts[0]["accountId"]
+        except aiohttp.ClientResponseError as exc:
+            # this can happen, if gateway is not connected yet
+            self._log.warning(str(exc))
+
+    async def close(self):
+        """Close the websocket session and the HTTP connection pool."""
+        await self.close_websocket()
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def log(self) -> logging.Logger:
+        """Get access to internal logger instance."""
+        return self._log
+
+    @staticmethod
+    def _build_params(params: Optional[dict]) -> Optional[dict]:
+        """Convert query parameters the same way `requests` would do.
+
+        `aiohttp` refuses None and bool values, `requests` drops the former and
+        converts the latter to string.
+        """
+        if params is None:
+            return None
+        return {
+            key: str(val) if isinstance(val, bool) else val
+            for key, val in params.items()
+            if val is not None
+        }
+
+    async def request_raw(self, method: str, url: str, **kwargs) -> bytes:
+        """Send a request to the gateway, returning the raw response content.
+        """
+        if "params" in kwargs:
+            kwargs["params"] = self._build_params(kwargs["params"])
+
+        async def send(timeout: Optional[float]) -> bytes:
+            return await self._send_request(method, url, timeout, **kwargs)
+
+        return await self._coalescer.do_async(
+            method, url, kwargs,
+            lambda: self._retry_policy.call_async(method, url, send))
+
+    async def _send_request(self, method: str, url: str,
+                            timeout: Optional[float], **kwargs) -> bytes:
+        waited = await self._rate_limiter.acquire_async(url, timeout=timeout)
+        if timeout is not None:
+            # do not exceed the deadline of the request
+            timeout -= waited
+            if timeout <= 0.0:
+                raise DeadlineExceeded(f"Deadline exceeded for {url}")
+            kwargs["timeout"] = aiohttp.ClientTimeout(
+                total=timeout,
+                sock_connect=self._timeouts[0],
+                sock_read=self._timeouts[1])
+        async with self._session.request(method, self._api_url + url,
+                                         **kwargs) as ret:
+            content = await ret.read()
+            try:
+                ret.raise_for_status()
+            except aiohttp.ClientResponseError:
+                self._log.warning(f"Returned content = '{content.decode()}'")
+                raise
+        return content
+
+    async def request(self, method: str, url: str,
+                      **kwargs) -> Union[list, dict]:
+        return json.loads(await self.request_raw(method, url, **kwargs))
+
+    async def _check_url(self, url: str) -> bool:
+        try:
+            timeout = aiohttp.ClientTimeout(total=2)
+            async with self._session.get(url, timeout=timeout) as ret:
+                return ret.status == 200
+        except (asyncio.TimeoutError, aiohttp.ClientConnectionError):
+            self._log.warning("Timeout")
+            return False
+
+    async def is_gateway_ready(self) -> bool:
+        """Is IB gateway running and authenticated?
+
+        Valid only if using ibeam.
+        """
+        if not self._use_ibeam:
+            # assume always ok
+            return True
+        return await self._check_url(self._ready_url)
+
+    async def is_gateway_live(self) -> bool:
+        """Is IB gateway alive?
+
+        Valid only if using ibeam.
+        """
+        if not self._use_ibeam:
+            # assume always ok
+            return True
+        return await self._check_url(self._live_url)
+
+    def set_account_id(self, account_id: str):
+        """Manually set the account ID to use internally."""
+        self._account_id = account_id
+
+    async def ping_gateway(self):
+        """Ping gateway to keep connection alive."""
+        ret = await self.request("get", "tickle")
+        status = GatewayStatus(**ret)
+        if not status.connected or not status.authenticated:
+            self._log.warning(status)
+        self._log.debug(f"Connected = {status.connected},"
+                        f" authenticated = {status.authenticated}")
+
+    def get_websocket_session(self) -> WebSocketSession:
+        """See `IBWebApiClient.get_websocket_session()`."""
+        if self._ws_session is None:
+            self._ws_session = WebSocketSession(self._ws_url)
+            # keep quote book updated with ticks
+            self._ws_session.add_handler(MarketDataHandler(self._quotes.update))
+            # move subscriptions of a closed session
+            if self._subscriptions is not None:
+                self._subscriptions.set_websocket_session(self._ws_session)
+        self._ws_session.start()
+        return self._ws_session
+
+    def get_subscription_manager(self) -> SubscriptionManager:
+        """Get the registry of market data subscriptions."""
+        if self._subscriptions is None:
+            self._subscriptions = SubscriptionManager(
+                self.get_websocket_session(),
+                max_lines=self._max_market_data_lines)
+        return self._subscriptions
+
+    async def close_websocket(self):
+        """See `IBWebApiClient.close_websocket()`."""
+        if self._ws_session is not None:
+            ws_session = self._ws_session
+            self._ws_session = None
+            # do not block the event loop while the reader thread stops
+            await asyncio.get_running_loop().run_in_executor(
+                None, ws_session.stop)
+
+    async def send_websocket(self, cmd: Union[List[str], str]):
+        """See `IBWebApiClient.send_websocket()`."""
+        self.get_websocket_session().send(cmd)
+
+    async def get_user(self) -> dict:
+        """See `IBWebApiClient.get_user()`."""
+        return await self.request("get", "one/user")
+
+    async def get_accounts(self):
+        """See `IBWebApiClient.get_accounts()`."""
+        return await self.request("get", "iserver/accounts")
+
+    async def get_portfolio_accounts(self):
+        """See `IBWebApiClient.get_portfolio_accounts()`."""
+        return await self.request("get", "portfolio/accounts")
+
+    async def get_pnl(self):
+        """See `IBWebApiClient.get_pnl()`."""
+        return await self.request("get", "iserver/account/pnl/partitioned")
+
+    async def get_trades(self) -> List[Trade]:
+        # empty responses are retried, see `RetryPolicy`
+        ret = await self.request("get", "iserver/account/trades")
+        return [Trade(**t) for t in ret]
+
+    async def get_positions(self,
+                            account_id: Optional[str] = None) -> List[Position]:
+        if account_id is None:
+            account_id = self._account_id
+        ret = await self.request("get", f"portfolio/{account_id}/positions")
+        return [Position(**pos) for pos in ret]
+
+    def get_rate_limiter(self) -> RateLimiter:
+        """Get the rate limiter of the requests, e.g. for its statistics."""
+        return self._rate_limiter
+
+    def get_coalescer(self) -> RequestCoalescer:
+        """Get the coalescer of identical requests, e.g. for its statistics."""
+        return self._coalescer
+
+    def get_retry_policy(self) -> RetryPolicy:
+        """Get the retry policy of the requests, e.g. for its statistics."""
+        return self._retry_policy
+
+    def get_contract_cache(self) -> ContractCache:
+        """Get the cache of contract definitions."""
+        return self._contract_cache
+
+    def get_symbol_index(self) -> SymbolIndex:
+        """Get the local index of contracts, see `lookup_security()`."""
+        return self._symbol_index
+
+    def _index_contract_cache(self):
+        """Add the contracts in the contract cache to the symbol index."""
+        for key, ret in self._contract_cache.items("search/"):
+            self._symbol_index.add_search_results(ret, key.split("/")[-1])
+        for _, ret in self._contract_cache.items("contract_info/"):
+            self._symbol_index.add_contract_info(ContractInfo(**ret))
+
+    async def _cached(self, key: str, fetch: Callable[[], Awaitable],
+                      use_cache: bool):
+        ret = self._contract_cache.get(key) if use_cache else None
+        if ret is None:
+            ret = await fetch()
+            self._contract_cache.put(key, ret)
+        return ret
+
+    async def search_futures(self,
+                             symbols: List[str],
+                             use_cache: bool = True) -> dict:
+        """See `IBWebApiClient.search_futures()`."""
+        ret = {}
+        missing = []
+        for symbol in symbols:
+            futures = (self._contract_cache.get(f"futures/{symbol}")
+                       if use_cache else None)
+            if futures is None:
+                missing.append(symbol)
+            else:
+                ret[symbol] = futures
+        if len(missing) > 0:
+            params = {"symbols": ",".join(missing)}
+            fetched = await self.request("get", "trsrv/futures", params=params)
+            for symbol, futures in fetched.items():
+                self._contract_cache.put(f"futures/{symbol}", futures)
+            ret.update(fetched)
+        return ret
+
+    async def search_security(self,
+                              symbol: str,
+                              sec_type: str,
+                              use_cache: bool = True) -> List[dict]:
+        """See `IBWebApiClient.search_security()`."""
+        params = {"symbol": symbol, "secType": sec_type}
+        ret = await self._cached(
+            f"search/{symbol}/{sec_type}",
+            lambda: self.request("get", "iserver/secdef/search", params=params),
+            use_cache)
+        self._symbol_index.add_search_results(ret, sec_type)
+        return ret
+
+    async def lookup_security(self,
+                              symbol: str,
+                              sec_type: str = "STK",
+                              prefix: bool = False) -> List[dict]:
+        """See `IBWebApiClient.lookup_security()`."""
+        if prefix:
+            return self._symbol_index.find_prefix(symbol, sec_type=sec_type)
+        ret = self._symbol_index.find(symbol, sec_type=sec_type)
+        if len(ret) == 0:
+            await self.search_security(symbol, sec_type)
+            ret = self._symbol_index.find(symbol, sec_type=sec_type)
+        return ret
+
+    async def get_contract_info(self,
+                                conid: int,
+                                use_cache: bool = True) -> ContractInfo:
+        """Get contract info from contract ID."""
+        ret = await self._cached(
+            f"contract_info/{conid}",
+            lambda: self.request("get", f"iserver/contract/{conid}/info"),
+            use_cache)
+        info = ContractInfo(**ret)
+        self._symbol_index.add_contract_info(info)
+        return info
+
+    async def get_options_info(self,
+                               conid: int,
+                               expiration: Optional[str],
+                               strike: Optional[float],
+                               month: Optional[str] = None,
+                               use_cache: bool = True) -> List[OptionInfo]:
+        """Get list of option info.
+
+        NOTE: set strike = None or 0.0 to get all options, and expiration =
+        None to get all the expirations of the month.
+        """
+        params = {"conid": conid, "secType": "OPT"}
+        if expiration is not None:
+            month = expiration_to_month(expiration)
+        params["month"] = month
+        params["strike"] = strike or 0.0
+        ret = await self._cached(
+            f"options_info/{conid}/{month}/{params['strike']}",
+            lambda: self.request("get", "iserver/secdef/info", params=params),
+            use_cache)
+
+        opts = [
+            OptionInfo(**r)
+            for r in ret
+            if expiration is None or r["maturityDate"] == expiration
+        ]
+        return opts
+
+    async def get_option_strikes(self,
+                                 conid: int,
+                                 expiration: str,
+                                 use_cache: bool = True) -> OptionStrikes:
+        month = expiration_to_month(expiration)
+        params = {"conid": conid, "secType": "OPT", "month": month}
+        strikes = await self._cached(
+            f"strikes/{conid}/{month}", lambda: self.request(
+                "get", "iserver/secdef/strikes", params=params), use_cache)
+        return OptionStrikes(**strikes)
+
+    get_closest_strike = staticmethod(IBWebApiClient.get_closest_strike)
+
+    async def get_option_chain(self, conid: int,
+                               expiration: str) -> OptionChain:
+        opts = await self.get_options_info(conid=conid,
+                                           expiration=expiration,
+                                           strike=0.0)
+        return build_option_chain(opts)
+
+    async def get_option_chains(
+            self, conid: int, expirations: List[str]) -> Dict[str, OptionChain]:
+        """See `IBWebApiClient.get_option_chains()`."""
+        months = group_expirations_by_month(expirations)
+        ret = await asyncio.gather(*[
+            self.get_options_info(
+                conid=conid, expiration=None, strike=0.0, month=month)
+            for month in months
+        ])
+        return split_option_chains(dict(zip(months, ret)), months)
+
+    async def get_option_chain_window(
+            self,
+            conid: int,
+            expiration: str,
+            price: float,
+            num_strikes: Optional[int] = None,
+            pct: Optional[float] = None) -> OptionChain:
+        """See `IBWebApiClient.get_option_chain_window()`."""
+        strikes = await self.get_option_strikes(conid, expiration)
+        selected = select_strike_window(strikes.call + strikes.put,
+                                        price,
+                                        num_strikes=num_strikes,
+                                        pct=pct)
+        ret = await asyncio.gather(*[
+            self.get_options_info(
+                conid=conid, expiration=expiration, strike=strike)
+            for strike in selected
+        ])
+        return build_option_chain(opt for opts in ret for opt in opts)
+
+    async def get_market_history(
+            self,
+            conid: int,
+            period: str = "30d",
+            bar: str = "5min",
+            exchange: Optional[str] = None,
+            outside_rth: bool = True,
+            start_time: Optional[datetime] = None) -> MarketHistory:
+        """See `IBWebApiClient.get_market_history()`."""
+        params = {
+            'conid': conid,
+            'period': period,
+            'bar': bar,
+            'exchange': exchange,
+            'outsideRth': outside_rth
+        }
+        if start_time is not None:
+            params['startTime'] = format_history_time(start_time)
+        ret = await self.request("get",
+                                 "iserver/marketdata/history",
+                                 params=params)
+
+        candles = ret["data"]
+        self._log.debug(f"{len(candles)} candles received")
+        return MarketHistory(**ret)
+
+    async def get_market_history_df(self, *args, **kwargs) -> pd.DataFrame:
+        """Get market data history, returning a pandas DataFrame with the
+        candles."""
+        ret = await self.get_market_history(*args, **kwargs)
+        candles = ret.data
+        df = pd.DataFrame(candles)
+        return df
+
+    async def get_market_history_fast(
+            self,
+            conid: int,
+            period: str = "30d",
+            bar: str = "5min",
+            exchange: Optional[str] = None,
+            outside_rth: bool = True,
+            start_time: Optional[datetime] = None,
+            tz: str = "UTC") -> Tuple[pd.DataFrame, dict]:
+        """See `IBWebApiClient.get_market_history_fast()`."""
+        params = {
+            'conid': conid,
+            'period': period,
+            'bar': bar,
+            'exchange': exchange,
+            'outsideRth': outside_rth
+        }
+        if start_time is not None:
+            params['startTime'] = format_history_time(start_time)
+        content = await self.request_raw("get",
+                                         "iserver/marketdata/history",
+                                         params=params)
+        df, meta = decode_market_history(content, tz=tz)
+        self._log.debug(f"{len(df)} candles received")
+        return df, meta
+
+    get_market_data_fields = staticmethod(IBWebApiClient.get_market_data_fields)
+
+    async def subscribe_market_data(self,
+                                    conid: Union[int, List[int]],
+                                    fields: Optional[List[str]] = None,
+                                    def_fields: str = "STK"):
+        """Subscribe for realtime market data of a contract ID.
+
+        See `IBWebApiClient.subscribe_market_data()`.
+        """
+        if fields is None:
+            fields = self.get_market_data_fields(def_fields=def_fields)
+
+        # make a list of conids
+        if isinstance(conid, int):
+            conid = [conid]
+        self.get_subscription_manager().subscribe(conid, fields)
+
+    async def unsubscribe_market_data(self,
+                                      conid: Union[int, List[int]],
+                                      fields: Optional[List[str]] = None,
+                                      def_fields: str = "STK"):
+        """See `IBWebApiClient.unsubscribe_market_data()`."""
+        if fields is None:
+            fields = self.get_market_data_fields(def_fields=def_fields)
+        if isinstance(conid, int):
+            conid = [conid]
+        self.get_subscription_manager().unsubscribe(conid, fields)
+
+    async def unsubscribe_all_market_data(self):
+        """
+        {'unsubscribed': True}
+        """
+        if self._subscriptions is not None:
+            self._subscriptions.clear()
+        return await self.request("get", "iserver/marketdata/unsubscribeall")
+
+    async def get_market_data_snapshot(
+            self,
+            conid: Union[int, List[int]],
+            merged: bool = False,
+            decode: bool = False,
+            fields: Optional[List[str]] = None) -> List[dict]:
+        """See `IBWebApiClient.get_market_data_snapshot()`."""
+        # make sure it's a list
+        if isinstance(conid, int):
+            conid = [conid]
+        if self._subscriptions is not None:
+            self._subscriptions.touch(conid)
+        conid = [str(c) for c in conid]
+        params = {"conids": ",".join(conid)}
+        if fields is not None:
+            params["fields"] = ",".join(fields)
+        ret = await self.request("get",
+                                 "iserver/marketdata/snapshot",
+                                 params=params)
+        # parse fields, to give meaningful names to field numbers
+        ret2 = [map_market_data_fields(r) for r in ret]
+        # update quote book
+        quotes = [self._quotes.update(r) for r in ret2]
+        if merged:
+            ret2 = [q for q in quotes if q is not None]
+        if decode:
+            ret2 = [decode_market_data(r) for r in ret2]
+        return ret2
+
+    async def get_market_data_snapshot_df(self,
+                                          conid: Union[int, List[int]],
+                                          merged: bool = True) -> pd.DataFrame:
+        """See `IBWebApiClient.get_market_data_snapshot_df()`."""
+        rows = await self.get_market_data_snapshot(conid, merged=merged)
+        return decode_market_data_df(rows)
+
+    def get_option_greeks(self,
+                          chain: OptionChain,
+                          underlying_price: float,
+                          r: float = 0.0,
+                          q: float = 0.0,
+                          model: str = "bs") -> pd.DataFrame:
+        """See `IBWebApiClient.get_option_greeks()`."""
+        quotes = {}
+        for opts in (chain.call, chain.put):
+            for opt in opts.values():
+                quote = self._quotes.get(opt.conid)
+                if quote is not None:
+                    quotes[opt.conid] = quote
+        return compute_chain_greeks(chain,
+                                    quotes,
+                                    underlying_price,
+                                    r=r,
+                                    q=q,
+                                    model=model)
+
+    def get_quote(self, conid: int) -> Optional[dict]:
+        """See `IBWebApiClient.get_quote()`."""
+        if self._subscriptions is not None:
+            self._subscriptions.touch((conid,))
+        return self._quotes.get(conid)
+
+    async def get_orders(self) -> List[Order]:
+        """See `IBWebApiClient.get_orders()`."""
+        ret = await self.request("get", "iserver/account/orders")
+        if isinstance(ret, list):
+            # still empty after the retries
+            return []
+        return [Order(**order) for order in ret.get("orders", [])]
+
+    async def submit_order(self,
+                           orders: List[dict],
+                           account_id: Optional[str] = None):
+        """See `IBWebApiClient.submit_order()`."""
+        if account_id is None:
+            account_id = self._account_id
+
+        # submit orders
+        data = {"orders": orders}
+        ret = await self.request("post",
+                                 f"iserver/account/{account_id}/orders",
+                                 json=data)
+
+        # need to check and eventually reply to all possible questions
+        order_ids = []
+        while len(ret) > 0:
+            # get first item to check
+            item = ret.pop(0)
+            # check if we have a question
+            if "message" in item:
+                message = " ".join(item["message"]).replace("\n", " ").replace(
+                    "  ", " ")
+                self._log.debug(f"Question submitting order: {message}")
+                reply_id = item["id"]
+                data = {"confirmed": True}
+                ret2 = await self.request("post",
+                                          f"iserver/reply/{reply_id}",
+                                          json=data)
+                # add new items to the list of items to check
+                ret += ret2
+            elif "order_id" in item:
+                order_id = item["order_id"]
+                order_status = item["order_status"]
+                text = item.get("text")
+                self._log.info(f"Order {order_id} {order_status}: {text}")
+                order_ids.append(order_id)
+            else:
+                self._log.error(f"Cannot parse item: '{item}'")
+        return order_ids
@@ -1,20 +1,38 @@
+import contextvars
 import json
 import logging
 import socket
-import ssl
+import threading
 import warnings
+from bisect import bisect_right
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
-from typing import List, Optional, Tuple, Union
+from typing import (Callable, Dict, Iterable, Iterator, List, Optional, Tuple,
+                    Union)
 
 import pandas as pd
 import requests
-from requests.exceptions import ConnectTimeout
 from urllib3.exceptions import InsecureRequestWarning
-from websocket import create_connection
 
+from .coalesce import RequestCoalescer
+from .contract_cache import ContractCache
+from .decoding import decode_market_data, decode_market_data_df
+from .greeks import compute_chain_greeks
+from .history import (HistoryBackfill, HistoryResult, decode_market_history,
+                      format_history_time, iter_history_results)
+from .history_cache import HistoryCache
 from .models import (ContractInfo, GatewayStatus, MarketDataFields,
                      MarketHistory, OptionChain, OptionInfo, OptionStrikes,
-                     Order, Position, Trade, market_data_fields_map)
+                     Order, Position, Trade, map_market_data_fields)
+from .options import select_strike_window
+from .pool import build_session
+from .quotes import QuoteBook
+from .ratelimit import RateLimiter
+from .retry import DeadlineExceeded, RetryPolicy
+from .streaming import MarketDataCallback, MarketDataHandler, MarketDataStream
+from .subscriptions import SubscriptionManager
+from .symbol_index import SymbolIndex
+from .websocket_session import WebSocketSession
 
 # ignore SSL verification warnings since we need to connect to the IB gateway,
 # which is using a self-signed certificate
@@ -32,7 +50,53 @@ def expiration_to_month(datestr: str) -> str:
     return month
 
 
+def group_expirations_by_month(
+        expirations: Iterable[str]) -> Dict[str, List[str]]:
+    """Group expirations by month, as returned by `expiration_to_month()`."""
+    months: Dict[str, List[str]] = {}
+    for expiration in expirations:
+        month = expiration_to_month(expiration)
+        months.setdefault(month, []).append(expiration)
+    return months
+
+
+def build_option_chain(opts: Iterable[OptionInfo]) -> OptionChain:
+    """Build option chain from the options of an expiration."""
+    opts = list(opts)
+    return OptionChain(
+        call={float(opt.strike): opt for opt in opts if opt.right == "C"},
+        put={float(opt.strike): opt for opt in opts if opt.right == "P"})
+
+
+def split_option_chains(month_opts: Dict[str, List[OptionInfo]],
+                        months: Dict[str, List[str]]) -> Dict[str, OptionChain]:
+    """Split the options of some months into a chain for each expiration.
+
+    Args:
+        month_opts: Options of each month.
+        months: Wanted expirations of each month.
+    """
+    chains = {}
+    for month, expirations in months.items():
+        by_expiration: Dict[str, List[OptionInfo]] = {
+            expiration: [] for expiration in expirations
+        }
+        for opt in month_opts[month]:
+            if opt.maturityDate in by_expiration:
+                by_expiration[opt.maturityDate].append(opt)
+        for expiration, opts in by_expiration.items():
+            chains[expiration] = build_option_chain(opts)
+    return chains
+
+
 class IBWebApiClient:
+    """Client of the IB Client Portal gateway.
+
+    The client is thread safe: a single instance can be shared by many
+    threads, whose requests are sent concurrently over a pool of up to
+    `max_connections` persistent connections. See `submit()` and `map()` to
+    fan out requests.
+    """
     _log: logging.Logger = logging.getLogger("IBWebApiClient")
     _api_url: str = "https://{host}:5000/v1/api/"
     _ws_url: str = "wss://{host}:5000/v1/api/ws"
@@ -40,13 +104,58 @@ class IBWebApiClient:
     _live_url: str = "http://{host}:5001/livez"
     _timeouts = (5.0, 30.0)  # requests connection and read timeouts
     _session: requests.Session
+    _lock: threading.RLock
+    _max_connections: int
+    _executor: Optional[ThreadPoolExecutor]
+    _ws_session: Optional[WebSocketSession]
+    _md_handlers: Dict[MarketDataCallback, MarketDataHandler]
+    _quotes: QuoteBook
+    _subscriptions: Optional[SubscriptionManager]
+    _max_market_data_lines: int
+    _history_cache: HistoryCache
+    _contract_cache: ContractCache
+    _rate_limiter: RateLimiter
+    _coalescer: RequestCoalescer
+    _retry_policy: RetryPolicy
+    _symbol_index: SymbolIndex
     _use_ibeam: bool
     _user: dict
     _accounts: dict
     _account_id: str
 
-    def __init__(self, use_ibeam: bool = True, host: Optional[str] = None):
-        self._session = requests.Session()
+    def __init__(self,
+                 use_ibeam: bool = True,
+                 host: Optional[str] = None,
+                 max_market_data_lines: int = 100,
+                 history_cache: Union[str, HistoryCache, None] = None,
+                 contract_cache: Optional[ContractCache] = None,
+                 rate_limiter: Optional[RateLimiter] = None,
+                 coalescer: Optional[RequestCoalescer] = None,
+                 retry_policy: Optional[RetryPolicy] = None,
+                 max_connections: int = 32,
+                 keep_alive: bool = True,
+                 tcp_nodelay: bool = True):
+        self._session = build_session(max_connections, keep_alive, tcp_nodelay)
+        self._lock = threading.RLock()
+        self._max_connections = max_connections
+        self._executor = None
+        self._ws_session = None
+        self._md_handlers = {}
+        self._quotes = QuoteBook()
+        self._subscriptions = None
+        self._max_market_data_lines = max_market_data_lines
+        self._history_cache = (history_cache if isinstance(
+            history_cache, HistoryCache) else HistoryCache(history_cache))
+        self._contract_cache = (contract_cache if contract_cache is not None
+                                else ContractCache())
+        self._symbol_index = SymbolIndex()
+        self._rate_limiter = (rate_limiter
+                              if rate_limiter is not None else RateLimiter())
+        self._coalescer = (coalescer
+                           if coalescer is not None else RequestCoalescer())
+        self._retry_policy = (retry_policy
+                              if retry_policy is not None else RetryPolicy())
+        self._index_contract_cache()
         self._use_ibeam = use_ibeam
 
         if use_ibeam:
@@ -90,18 +199,46 @@ class IBWebApiClient:
         """Get access to internal logger instance."""
         return self._log
 
-    def request(self, method: str, url: str, **kwargs) -> Union[list, dict]:
+    def request_raw(self, method: str, url: str, **kwargs) -> bytes:
+        """Send a request to the gateway, returning the raw response content.
+
+        Requests are delayed as needed to respect the pacing limits of the
+        gateway, see `RateLimiter`. Identical concurrent GET requests are sent
+        only once, see `RequestCoalescer`. Failed requests are retried, see
+        `RetryPolicy`.
+        """
+
+        def send(timeout: Optional[float]) -> bytes:
+            return self._send_request(method, url, timeout, **kwargs)
+
+        return self._coalescer.do(
+            method, url, kwargs,
+            lambda: self._retry_policy.call(method, url, send))
+
+    def _send_request(self, method: str, url: str, timeout: Optional[float],
+                      **kwargs) -> bytes:
+        waited = self._rate_limiter.acquire(url, timeout=timeout)
+        timeouts = self._timeouts
+        if timeout is not None:
+            # do not exceed the deadline of the request
+            timeout -= waited
+            if timeout <= 0.0:
+                raise DeadlineExceeded(f"Deadline exceeded for {url}")
+            timeouts = (min(timeouts[0], timeout), min(timeouts[1], timeout))
         ret = self._session.request(method,
                                     self._api_url + url,
                                     verify=False,
-                                    timeout=self._timeouts,
+                                    timeout=timeouts,
                                     **kwargs)
         try:
             ret.raise_for_status()
         except requests.exceptions.HTTPError:
             self._log.warning(f"Returned content = '{ret.text}'")
             raise
-        return json.loads(ret.text)
+        return ret.content
+
+    def request(self, method: str, url: str, **kwargs) -> Union[list, dict]:
+        return json.loads(self.request_raw(method, url, **kwargs))
 
     def is_gateway_ready(self) -> bool:
         """Is IB gateway running and authenticated?
@@ -114,7 +251,8 @@ class IBWebApiClient:
         try:
             ret = self._session.get(self._ready_url, timeout=2)
             return ret.status_code == 200
-        except ConnectTimeout:
+        except (requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout):
             self._log.warning("Timeout")
             return False
 
@@ -129,7 +267,8 @@ class IBWebApiClient:
         try:
             ret = self._session.get(self._live_url, timeout=2)
             return ret.status_code == 200
-        except ConnectTimeout:
+        except (requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout):
             self._log.warning("Timeout")
             return False
 
@@ -146,24 +285,98 @@ class IBWebApiClient:
         self._log.debug(f"Connected = {status.connected},"
                         f" authenticated = {status.authenticated}")
 
-    def send_websocket(self, cmd: Union[List[str], str]):
-        sslopt = {"cert_reqs": ssl.CERT_NONE}
-        ws = create_connection(self._ws_url, sslopt=sslopt)
+    def get_websocket_session(self) -> WebSocketSession:
+        """Get the persistent websocket session, connecting it if needed."""
+        with self._lock:
+            if self._ws_session is None:
+                self._ws_session = WebSocketSession(self._ws_url)
+                # keep quote book updated with ticks
+                self._ws_session.add_handler(
+                    MarketDataHandler(self._quotes.update))
+                # move callbacks and subscriptions of a closed session
+                for handler in self._md_handlers.values():
+                    self._ws_session.add_handler(handler)
+                if self._subscriptions is not None:
+                    self._subscriptions.set_websocket_session(self._ws_session)
+            self._ws_session.start()
+            return self._ws_session
 
-        ret = ws.recv()
-        self._log.debug(f"[ws] {ret}")
-        ret = ws.recv()
-        self._log.debug(f"[ws] {ret}")
+    def get_subscription_manager(self) -> SubscriptionManager:
+        """Get the registry of market data subscriptions."""
+        with self._lock:
+            if self._subscriptions is None:
+                self._subscriptions = SubscriptionManager(
+                    self.get_websocket_session(),
+                    max_lines=self._max_market_data_lines)
+            return self._subscriptions
 
-        if isinstance(cmd, str):
-            ws.send(cmd)
-            self._log.debug(f"[ws] {ret}")
-        else:
-            for c in cmd:
-                ws.send(c)
-                self._log.debug(f"[ws] {ret}")
+    def close_websocket(self):
+        """Close the persistent websocket session, if open.
+
+        Market data callbacks and subscriptions are kept, and they are moved to
+        the next session, see `get_websocket_session()`.
+        """
+        with self._lock:
+            if self._ws_session is not None:
+                self._ws_session.stop()
+                self._ws_session = None
+
+    def get_executor(self) -> ThreadPoolExecutor:
+        """Get the thread pool used by `submit()` and `map()`, with one
+        worker per connection."""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self._max_connections,
+                    thread_name_prefix="IBWebApiClient")
+            return self._executor
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """Call a function in the thread pool of the client.
+
+        The function runs with the deadline of the caller (see
+        `retry.deadline()`), and it must not wait for other functions submitted
+        to the same pool.
+
+        Example:
+            future = ibc.submit(ibc.get_contract_info, 265598)
+            info = future.result()
+        """
+        context = contextvars.copy_context()
+        return self.get_executor().submit(context.run, fn, *args, **kwargs)
 
-        ws.close()
+    def map(self, fn: Callable, *iterables: Iterable) -> list:
+        """Call a function on every item of the iterables concurrently, in the
+        thread pool of the client, returning the results in order.
+
+        The first exception raised by a call is raised again.
+
+        Example:
+            infos = ibc.map(ibc.get_contract_info, conids)
+        """
+        futures = [self.submit(fn, *args) for args in zip(*iterables)]
+        try:
+            return [future.result() for future in futures]
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def close(self):
+        """Close the websocket session, the thread pool and the connections."""
+        self.close_websocket()
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True, cancel_futures=True)
+                self._executor = None
+        self._session.close()
+
+    def send_websocket(self, cmd: Union[List[str], str]):
+        """Send commands through the persistent websocket session.
+
+        Commands are queued and sent as soon as the connection is ready, so this
+        does not block.
+        """
+        self.get_websocket_session().send(cmd)
 
     def get_user(self) -> dict:
         """
@@ -298,10 +511,8 @@ class IBWebApiClient:
         return ret
 
     def get_trades(self) -> List[Trade]:
+        # empty responses are retried, see `RetryPolicy`
         ret = self.request("get", "iserver/account/trades")
-        if len(ret) == 0:
-            # retry
-            ret = self.request("get", "iserver/account/trades")
         return [Trade(**t) for t in ret]
 
     def get_positions(self, account_id: Optional[str] = None) -> List[Position]:
@@ -310,13 +521,68 @@ class IBWebApiClient:
         ret = self.request("get", f"portfolio/{account_id}/positions")
         return [Position(**pos) for pos in ret]
 
-    def search_futures(self, symbols: List[str]) -> dict:
-        """Get list of futures from symbols with various maturity dates."""
-        params = {"symbols": ",".join(symbols)}
-        ret = self.request("get", "trsrv/futures", params=params)
+    def get_rate_limiter(self) -> RateLimiter:
+        """Get the rate limiter of the requests, e.g. for its statistics."""
+        return self._rate_limiter
+
+    def get_coalescer(self) -> RequestCoalescer:
+        """Get the coalescer of identical requests, e.g. for its statistics."""
+        return self._coalescer
+
+    def get_retry_policy(self) -> RetryPolicy:
+        """Get the retry policy of the requests, e.g. for its statistics."""
+        return self._retry_policy
+
+    def get_contract_cache(self) -> ContractCache:
+        """Get the cache of contract definitions."""
+        return self._contract_cache
+
+    def get_symbol_index(self) -> SymbolIndex:
+        """Get the local index of contracts, see `lookup_security()`."""
+        return self._symbol_index
+
+    def _index_contract_cache(self):
+        """Add the contracts in the contract cache to the symbol index."""
+        for key, ret in self._contract_cache.items("search/"):
+            self._symbol_index.add_search_results(ret, key.split("/")[-1])
+        for _, ret in self._contract_cache.items("contract_info/"):
+            self._symbol_index.add_contract_info(ContractInfo(**ret))
+
+    def _cached(self, key: str, fetch: Callable, use_cache: bool):
+        if not use_cache:
+            ret = fetch()
+            self._contract_cache.put(key, ret)
+            return ret
+        return self._contract_cache.get_or_fetch(key, fetch)
+
+    def search_futures(self,
+                       symbols: List[str],
+                       use_cache: bool = True) -> dict:
+        """Get list of futures from symbols with various maturity dates.
+
+        Only the symbols missing from the contract cache are requested.
+        """
+        ret = {}
+        missing = []
+        for symbol in symbols:
+            futures = (self._contract_cache.get(f"futures/{symbol}")
+                       if use_cache else None)
+            if futures is None:
+                missing.append(symbol)
+            else:
+                ret[symbol] = futures
+        if len(missing) > 0:
+            params = {"symbols": ",".join(missing)}
+            fetched = self.request("get", "trsrv/futures", params=params)
+            for symbol, futures in fetched.items():
+                self._contract_cache.put(f"futures/{symbol}", futures)
+            ret.update(fetched)
         return ret
 
-    def search_security(self, symbol: str, sec_type: str) -> List[dict]:
+    def search_security(self,
+                        symbol: str,
+                        sec_type: str,
+                        use_cache: bool = True) -> List[dict]:
         """
         {'conid': 416904,
         'companyHeader': 'S&P 500 Stock Index - CBOE',
@@ -338,64 +604,182 @@ class IBWebApiClient:
         {'secType': 'BAG'}]}
         """
         params = {"symbol": symbol, "secType": sec_type}
-        ret = self.request("get", "iserver/secdef/search", params=params)
+        ret = self._cached(
+            f"search/{symbol}/{sec_type}",
+            lambda: self.request("get", "iserver/secdef/search", params=params),
+            use_cache)
+        self._symbol_index.add_search_results(ret, sec_type)
         return ret
 
-    def get_contract_info(self, conid: int) -> ContractInfo:
+    def lookup_security(self,
+                        symbol: str,
+                        sec_type: str = "STK",
+                        prefix: bool = False) -> List[dict]:
+        """Find contracts by symbol in the local symbol index.
+
+        The gateway is requested (see `search_security()`) only if no contract
+        is found. See `SymbolIndex` for the format of the contracts.
+
+        Args:
+            symbol: Symbol, or prefix of the symbol if `prefix` is True.
+            sec_type: Security type.
+            prefix: Find all the symbols starting with `symbol`, without
+                requesting the gateway?
+        """
+        if prefix:
+            return self._symbol_index.find_prefix(symbol, sec_type=sec_type)
+        ret = self._symbol_index.find(symbol, sec_type=sec_type)
+        if len(ret) == 0:
+            self.search_security(symbol, sec_type)
+            ret = self._symbol_index.find(symbol, sec_type=sec_type)
+        return ret
+
+    def get_contract_info(self,
+                          conid: int,
+                          use_cache: bool = True) -> ContractInfo:
         """Get contract info from contract ID."""
-        ret = self.request("get", f"iserver/contract/{conid}/info")
-        return ContractInfo(**ret)
+        ret = self._cached(
+            f"contract_info/{conid}",
+            lambda: self.request("get", f"iserver/contract/{conid}/info"),
+            use_cache)
+        info = ContractInfo(**ret)
+        self._symbol_index.add_contract_info(info)
+        return info
 
     def get_options_info(self,
                          conid: int,
                          expiration: Optional[str],
                          strike: Optional[float],
-                         month: Optional[str] = None) -> List[OptionInfo]:
+                         month: Optional[str] = None,
+                         use_cache: bool = True) -> List[OptionInfo]:
         """Get list of option info.
 
-        NOTE: set strike = None or 0.0 to get all options.
+        NOTE: set strike = None or 0.0 to get all options, and expiration =
+        None to get all the expirations of the month.
         """
         params = {"conid": conid, "secType": "OPT"}
         if expiration is not None:
             month = expiration_to_month(expiration)
         params["month"] = month
         params["strike"] = strike or 0.0
-        ret = self.request("get", "iserver/secdef/info", params=params)
+        ret = self._cached(
+            f"options_info/{conid}/{month}/{params['strike']}",
+            lambda: self.request("get", "iserver/secdef/info", params=params),
+            use_cache)
 
-        opts = [OptionInfo(**r) for r in ret if r["maturityDate"] == expiration]
+        opts = [
+            OptionInfo(**r)
+            for r in ret
+            if expiration is None or r["maturityDate"] == expiration
+        ]
         return opts
 
-    def get_option_strikes(self, conid: int, expiration: str) -> OptionStrikes:
+    def get_option_strikes(self,
+                           conid: int,
+                           expiration: str,
+                           use_cache: bool = True) -> OptionStrikes:
         month = expiration_to_month(expiration)
         params = {"conid": conid, "secType": "OPT", "month": month}
-        strikes = self.request("get", "iserver/secdef/strikes", params=params)
+        strikes = self._cached(
+            f"strikes/{conid}/{month}", lambda: self.request(
+                "get", "iserver/secdef/strikes", params=params), use_cache)
         return OptionStrikes(**strikes)
 
     @staticmethod
     def get_closest_strike(strikes: OptionStrikes,
                            value: float) -> Tuple[int, float]:
-        strike_idx = 0
-        strike = 0.0
-        for strike_idx in range(len(strikes.call) - 1, -1, -1):
-            strike = strikes.call[strike_idx]
-            if strike <= value:
-                return strike_idx, strike
+        """Get index and value of the highest call strike <= `value`.
+
+        See `StrikeIndex` for faster repeated queries, on puts too.
+        """
+        strike_idx = bisect_right(strikes.call, value) - 1
+        if strike_idx >= 0:
+            return strike_idx, strikes.call[strike_idx]
         raise Exception(f"Strike close to {value} not found")
 
     def get_option_chain(self, conid: int, expiration: str) -> OptionChain:
         opts = self.get_options_info(conid=conid,
                                      expiration=expiration,
                                      strike=0.0)
-        return OptionChain(
-            call={float(opt.strike): opt for opt in opts if opt.right == "C"},
-            put={float(opt.strike): opt for opt in opts if opt.right == "P"})
+        return build_option_chain(opts)
 
-    def get_market_history(self,
-                           conid: int,
-                           period: str = "30d",
-                           bar: str = "5min",
-                           exchange: Optional[str] = None,
-                           outside_rth: bool = True) -> MarketHistory:
+    def get_option_chains(self,
+                          conid: int,
+                          expirations: List[str],
+                          max_workers: int = 5) -> Dict[str, OptionChain]:
+        """Get option chains of many expirations.
+
+        `iserver/secdef/info` returns all the options of a month, so
+        expirations are grouped by month and each month is requested only once,
+        concurrently, instead of once per expiration.
+
+        Returns:
+            Option chain of each expiration.
+        """
+        months = group_expirations_by_month(expirations)
+
+        def fetch(month: str) -> List[OptionInfo]:
+            return self.get_options_info(conid=conid,
+                                         expiration=None,
+                                         strike=0.0,
+                                         month=month)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            month_opts = dict(zip(months, executor.map(fetch, months)))
+        return split_option_chains(month_opts, months)
+
+    def get_option_chain_window(self,
+                                conid: int,
+                                expiration: str,
+                                price: float,
+                                num_strikes: Optional[int] = None,
+                                pct: Optional[float] = None,
+                                max_workers: int = 5) -> OptionChain:
+        """Get the option chain of an expiration, only around a price.
+
+        Strikes are selected with `get_option_strikes()` and
+        `select_strike_window()`, and only the selected strikes are requested,
+        concurrently, which is much faster than getting the whole chain.
+
+        Args:
+            conid: Contract ID of the underlying.
+            expiration: Expiration date (e.g. "20220822").
+            price: Price of the underlying.
+            num_strikes: Number of strikes below and above the price.
+            pct: Maximum distance of the strikes from the price, in percent.
+            max_workers: Maximum number of concurrent requests.
+
+        Returns:
+            Option chain with only the selected strikes.
+        """
+        strikes = self.get_option_strikes(conid, expiration)
+        selected = select_strike_window(strikes.call + strikes.put,
+                                        price,
+                                        num_strikes=num_strikes,
+                                        pct=pct)
+
+        def fetch(strike: float) -> List[OptionInfo]:
+            return self.get_options_info(conid=conid,
+                                         expiration=expiration,
+                                         strike=strike)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            opts = [opt for ret in executor.map(fetch, selected) for opt in ret]
+        return build_option_chain(opts)
+
+    def get_market_history(
+            self,
+            conid: int,
+            period: str = "30d",
+            bar: str = "5min",
+            exchange: Optional[str] = None,
+            outside_rth: bool = True,
+            start_time: Optional[datetime] = None) -> MarketHistory:
+        """Get market data history.
+
+        Set `start_time` to get the `period` ending at the given time, instead
+        of ending now.
+        """
         params = {
             'conid': conid,
             'period': period,
@@ -403,6 +787,8 @@ class IBWebApiClient:
             'exchange': exchange,
             'outsideRth': outside_rth
         }
+        if start_time is not None:
+            params['startTime'] = format_history_time(start_time)
         ret = self.request("get", "iserver/marketdata/history", params=params)
 
         # start_time = ret["startTime"]
@@ -418,6 +804,159 @@ class IBWebApiClient:
         df = pd.DataFrame(candles)
         return df
 
+    def get_market_history_fast(self,
+                                conid: int,
+                                period: str = "30d",
+                                bar: str = "5min",
+                                exchange: Optional[str] = None,
+                                outside_rth: bool = True,
+                                start_time: Optional[datetime] = None,
+                                tz: str = "UTC") -> Tuple[pd.DataFrame, dict]:
+        """Get market data history, decoded directly into typed columns.
+
+        Faster than `get_market_history_df()` for large responses, since the
+        candles are parsed by NumPy, see `decode_market_history()`.
+
+        Returns:
+            DataFrame with float columns `o`, `h`, `l`, `c`, `v` indexed by
+            timezone-aware candle time, and dict with the other fields of the
+            response (e.g. `priceFactor`, `startTime`, `symbol`).
+        """
+        params = {
+            'conid': conid,
+            'period': period,
+            'bar': bar,
+            'exchange': exchange,
+            'outsideRth': outside_rth
+        }
+        if start_time is not None:
+            params['startTime'] = format_history_time(start_time)
+        content = self.request_raw("get",
+                                   "iserver/marketdata/history",
+                                   params=params)
+        df, meta = decode_market_history(content, tz=tz)
+        self._log.debug(f"{len(df)} candles received")
+        return df, meta
+
+    def get_market_history_many(
+        self,
+        conids: List[int],
+        period: str = "30d",
+        bar: str = "5min",
+        exchange: Optional[str] = None,
+        outside_rth: bool = True,
+        start_time: Optional[datetime] = None,
+        as_df: bool = False,
+        max_workers: int = 5,
+        callback: Optional[Callable[[HistoryResult], None]] = None
+    ) -> Optional[Iterator[HistoryResult]]:
+        """Get market data history of many contracts, concurrently.
+
+        Requests run on a pool of `max_workers` threads, within the history
+        pacing limit of the gateway (at most 5 concurrent requests), and
+        results are returned as soon as each request completes. A failed
+        request returns a result with `error` set, without cancelling the
+        others.
+
+        Example:
+            for res in ibc.get_market_history_many(conids, as_df=True):
+                if res.error is None:
+                    print(res.conid, len(res.data))
+
+        Args:
+            conids: Contract IDs.
+            as_df: Return the candles as `get_market_history_df()`, instead of
+                `MarketHistory`.
+            max_workers: Maximum number of concurrent requests.
+            callback: If given, the method blocks until all the requests are
+                done, calling the callback with each result as soon as it is
+                available, and returns None.
+
+            Other arguments as in `get_market_history()`.
+
+        Returns:
+            Iterator of `HistoryResult` in order of completion, if `callback`
+            is None.
+        """
+        get = self.get_market_history_df if as_df else self.get_market_history
+
+        def fetch(conid: int):
+            return get(conid=conid,
+                       period=period,
+                       bar=bar,
+                       exchange=exchange,
+                       outside_rth=outside_rth,
+                       start_time=start_time)
+
+        results = iter_history_results(fetch, conids, max_workers=max_workers)
+        if callback is None:
+            return results
+        for res in results:
+            callback(res)
+        return None
+
+    def get_history_cache(self) -> HistoryCache:
+        """Get the cache of market history bars."""
+        return self._history_cache
+
+    def get_market_history_range(
+            self,
+            conid: Union[int, List[int]],
+            start: datetime,
+            end: Optional[datetime] = None,
+            bar: str = "1min",
+            exchange: Optional[str] = None,
+            outside_rth: bool = True,
+            tz: str = "UTC",
+            max_workers: int = 5,
+            use_cache: bool = True
+    ) -> Union[pd.DataFrame, Dict[int, pd.DataFrame]]:
+        """Get market data history in a time range of any length.
+
+        The range is split into windows fetched concurrently and stitched
+        together, see `HistoryBackfill`. Contracts are fetched concurrently, and
+        their windows share `max_workers` concurrent requests. If `use_cache`
+        is True, bars are kept in the client history cache (on disk if
+        `history_cache` is a path given in the constructor, otherwise in memory
+        up to a size), so that only the bars missing from the cache are
+        fetched, and coarser bars are derived locally from finer cached ones,
+        see `HistoryCache`.
+
+        Returns:
+            DataFrame as returned by `get_market_history_fast()`, or dict with
+            a DataFrame for each contract if `conid` is a list.
+        """
+        backfill = HistoryBackfill(self, max_workers=max_workers)
+        conids = [conid] if isinstance(conid, int) else conid
+        if use_cache:
+            cache = self._history_cache
+
+            def fetch(cid: int) -> pd.DataFrame:
+                return cache.fetch(backfill,
+                                   cid,
+                                   start,
+                                   end=end,
+                                   bar=bar,
+                                   exchange=exchange,
+                                   outside_rth=outside_rth,
+                                   tz=tz)
+
+            # contracts are fetched concurrently, their windows share the
+            # workers of the backfill
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                frames = dict(zip(conids, executor.map(fetch, conids)))
+        else:
+            frames = backfill.fetch_many(conids,
+                                         start,
+                                         end=end,
+                                         bar=bar,
+                                         exchange=exchange,
+                                         outside_rth=outside_rth,
+                                         tz=tz)
+        if isinstance(conid, int):
+            return frames[conid]
+        return frames
+
     @staticmethod
     def get_market_data_fields(def_fields: str = "STK") -> List[str]:
         """Helper function to get default market data default fields."""
@@ -446,57 +985,196 @@ class IBWebApiClient:
 
         Need to subscribe by sending a command through websocket. Then, the feed
         will be available even from the REST API snapshot endpoints.
+
+        Subscriptions are reference counted, see `SubscriptionManager`: each
+        call must be paired with an `unsubscribe_market_data()` call with the
+        same fields, when the data is not needed anymore.
         """
         if fields is None:
             fields = self.get_market_data_fields(def_fields=def_fields)
 
-        params = {"fields": fields}
-
         # make a list of conids
         if isinstance(conid, int):
             conid = [conid]
-        # build commands
-        cmds = [
-            "smd+" + str(c) + "+" + json.dumps(params).replace(" ", "")
-            for c in conid
-        ]
-        # send websocket commands
-        self.send_websocket(cmds)
+        self.get_subscription_manager().subscribe(conid, fields)
+
+    def unsubscribe_market_data(self,
+                                conid: Union[int, List[int]],
+                                fields: Optional[List[str]] = None,
+                                def_fields: str = "STK"):
+        """Release a subscription made with `subscribe_market_data()`.
+
+        The contract is unsubscribed from the gateway only when no other
+        subscription needs it.
+        """
+        if fields is None:
+            fields = self.get_market_data_fields(def_fields=def_fields)
+        if isinstance(conid, int):
+            conid = [conid]
+        self.get_subscription_manager().unsubscribe(conid, fields)
 
     def unsubscribe_all_market_data(self):
         """
         {'unsubscribed': True}
         """
+        if self._subscriptions is not None:
+            self._subscriptions.clear()
         return self.request("get", "iserver/marketdata/unsubscribeall")
 
-    def get_market_data_snapshot(self, conid: Union[int,
-                                                    List[int]]) -> List[dict]:
-        # NOTE: assuming to have all fields for which we already subscribed
-        # fields = self.get_market_data_fields(fields=fields,
-        #                                      def_fields=def_fields)
+    def stream_market_data(self,
+                           conid: Union[int, List[int], None] = None,
+                           fields: Optional[List[str]] = None,
+                           def_fields: str = "STK",
+                           history_size: int = 0) -> MarketDataStream:
+        """Get an iterator over realtime market data ticks.
+
+        Ticks are pushed by the gateway through websocket and yielded as soon
+        as they arrive, with the same format as `get_market_data_snapshot()`.
+        If `conid` is given, only ticks of these contracts are yielded and the
+        market data is subscribed, otherwise all ticks are yielded.
+
+        Ticks are conflated per contract while the consumer is busy, see
+        `TickBuffer`. Set `history_size` to also keep the most recent raw ticks
+        of each contract in `stream.buffer`.
+        """
+        if isinstance(conid, int):
+            conid = [conid]
+        if conid is not None and fields is None:
+            fields = self.get_market_data_fields(def_fields=def_fields)
+
+        def on_close():
+            self.remove_market_data_callback(stream.buffer.put)
+            # release the subscription
+            if conid is not None:
+                self.unsubscribe_market_data(conid=conid, fields=fields)
+
+        stream = MarketDataStream(history_size=history_size, on_close=on_close)
+        # registered as a callback, so that ticks keep flowing to the stream
+        # if the websocket is reopened
+        self.add_market_data_callback(stream.buffer.put, conid=conid)
+        if conid is not None:
+            self.subscribe_market_data(conid=conid, fields=fields)
+        return stream
+
+    def add_market_data_callback(self,
+                                 callback: MarketDataCallback,
+                                 conid: Union[int, List[int], None] = None):
+        """Call `callback` with every realtime market data tick received.
+
+        The callback is called from the websocket reader thread, so it should
+        return quickly. Optionally, only ticks of the given contract IDs are
+        passed to it. Note that market data must be subscribed separately.
+        """
+        if isinstance(conid, int):
+            conid = [conid]
+        handler = MarketDataHandler(callback, conids=conid)
+        with self._lock:
+            self.remove_market_data_callback(callback)
+            self._md_handlers[callback] = handler
+            self.get_websocket_session().add_handler(handler)
+
+    def remove_market_data_callback(self, callback: MarketDataCallback):
+        with self._lock:
+            handler = self._md_handlers.pop(callback, None)
+            if handler is not None and self._ws_session is not None:
+                self._ws_session.remove_handler(handler)
+
+    def get_market_data_snapshot(
+            self,
+            conid: Union[int, List[int]],
+            merged: bool = False,
+            decode: bool = False,
+            fields: Optional[List[str]] = None) -> List[dict]:
+        """Get snapshot of market data of one or more contracts.
+
+        By default, all the fields already subscribed are returned, otherwise
+        only the given `fields` (numbers, see `MarketDataFields`).
+        The gateway returns only the fields changed since the previous call.
+        Every response is merged into the internal quote book (see
+        `get_quote()`): set `merged` to get the merged quotes instead of the
+        changed fields only. Set `decode` to get typed values instead of
+        strings, see `decode_market_data()`.
+        """
         # make sure it's a list
         if isinstance(conid, int):
             conid = [conid]
+        if self._subscriptions is not None:
+            self._subscriptions.touch(conid)
         conid = [str(c) for c in conid]
-        params = {
-            "conids": ",".join(conid),
-            # "fields": ",".join(fields)
-        }
+        params = {"conids": ",".join(conid)}
+        if fields is not None:
+            params["fields"] = ",".join(fields)
         ret = self.request("get", "iserver/marketdata/snapshot", params=params)
         # parse fields, to give meaningful names to field numbers
-        ret2 = [{
-            market_data_fields_map.get(key, key): val for key, val in r.items()
-        } for r in ret]
+        ret2 = [map_market_data_fields(r) for r in ret]
+        # update quote book
+        quotes = [self._quotes.update(r) for r in ret2]
+        if merged:
+            ret2 = [q for q in quotes if q is not None]
+        if decode:
+            ret2 = [decode_market_data(r) for r in ret2]
         return ret2
 
+    def get_market_data_snapshot_df(self,
+                                    conid: Union[int, List[int]],
+                                    merged: bool = True) -> pd.DataFrame:
+        """Get snapshot of market data as a DataFrame with typed columns.
+
+        Values are decoded with vectorized operations, see
+        `decode_market_data_df()`. The DataFrame is indexed by contract ID.
+        """
+        rows = self.get_market_data_snapshot(conid, merged=merged)
+        return decode_market_data_df(rows)
+
+    def get_option_greeks(self,
+                          chain: OptionChain,
+                          underlying_price: float,
+                          r: float = 0.0,
+                          q: float = 0.0,
+                          model: str = "bs") -> pd.DataFrame:
+        """Compute implied volatility and greeks of an option chain locally.
+
+        Bid, ask and last prices of the options are taken from the quote book
+        (see `get_quote()`), so the options only need to be subscribed with
+        price fields, instead of the greek fields. See
+        `compute_chain_greeks()`.
+        """
+        quotes = {}
+        for opts in (chain.call, chain.put):
+            for opt in opts.values():
+                quote = self._quotes.get(opt.conid)
+                if quote is not None:
+                    quotes[opt.conid] = quote
+        return compute_chain_greeks(chain,
+                                    quotes,
+                                    underlying_price,
+                                    r=r,
+                                    q=q,
+                                    model=model)
+
+    def get_quote(self, conid: int) -> Optional[dict]:
+        """Get latest known quote of a contract, without any network call.
+
+        The quote merges all the fields received so far from snapshots and
+        websocket ticks. Returns None if nothing was received yet.
+        """
+        if self._subscriptions is not None:
+            self._subscriptions.touch((conid,))
+        return self._quotes.get(conid)
+
     def get_orders(self) -> List[Order]:
-        """Get open orders."""
+        """Get open orders.
+
+        The gateway sometimes returns an empty array even if there are orders:
+        empty responses are requested again (see `RetryPolicy`), which takes
+        about 5 seconds because of the pacing limit of the endpoint (one
+        request every 5 seconds).
+        """
         ret = self.request("get", "iserver/account/orders")
-        # sometimes it returns an empty array even if there are orders
-        if len(ret) == 0:
-            # retry once
-            ret = self.request("get", "iserver/account/orders")
-        return [Order(**order) for order in ret["orders"]]
+        if isinstance(ret, list):
+            # still empty after the retries
+            return []
+        return [Order(**order) for order in ret.get("orders", [])]
 
     def submit_order(self,
                      orders: List[dict],
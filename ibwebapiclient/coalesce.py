@@ -0,0 +1,205 @@
+import asyncio
+import re
+import threading
+import time
+from typing import (Awaitable, Callable, Dict, List, Optional, Pattern,
+                    Sequence, Tuple)
+
+from .retry import DeadlineExceeded, get_time_left
+
+RequestKey = Tuple[str, str, Tuple[Tuple[str, str], ...]]
+# number of cached responses above which the expired ones are purged
+_PURGE_SIZE = 1024
+
+
+class _Flight:
+    """Request in flight, whose result is shared by the waiting threads."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.content: Optional[bytes] = None
+        self.error: Optional[BaseException] = None
+
+
+class RequestCoalescer:
+    """Coalescing of identical GET requests, with an optional response cache.
+
+    Concurrent GET requests with the same URL and parameters are sent only
+    once: the first caller sends the request and the others wait for its
+    response (or its exception). Responses are shared as raw bytes, so every
+    caller decodes its own copy.
+
+    Optionally, responses of some endpoints can be cached for a short time,
+    so that requests repeated within the time-to-live are not sent again.
+
+    Example:
+        # cache positions for half a second, snapshots for 100 ms
+        coalescer = RequestCoalescer(ttls=[(r"portfolio/.*/positions", 500),
+                                           (r"iserver/marketdata/snapshot",
+                                            100)])
+        ibc = IBWebApiClient(coalescer=coalescer)
+    """
+
+    def __init__(self, ttls: Optional[Sequence[Tuple[str, float]]] = None):
+        """Init coalescer.
+
+        Args:
+            ttls: List of (URL regex, time-to-live in milliseconds) of the
+                responses to cache, matched against the beginning of the URL
+                path relative to the API root. No response is cached by
+                default.
+        """
+        self._ttls: List[Tuple[Pattern, float]] = [
+            (re.compile(pattern), ttl / 1000.0) for pattern, ttl in ttls or ()
+        ]
+        self._lock = threading.Lock()
+        self._flights: Dict[RequestKey, _Flight] = {}
+        self._futures: Dict[RequestKey, "asyncio.Future[bytes]"] = {}
+        # (expiration time, response content)
+        self._cache: Dict[RequestKey, Tuple[float, bytes]] = {}
+        self.num_requests = 0
+        self.num_coalesced = 0
+        self.num_cache_hits = 0
+
+    @staticmethod
+    def get_key(method: str, url: str, kwargs: dict) -> Optional[RequestKey]:
+        """Get the key identifying a request, None if it cannot be coalesced
+        (not a GET, or with arguments other than the query parameters)."""
+        if method.lower() != "get" or any(key != "params" for key in kwargs):
+            return None
+        params = kwargs.get("params") or {}
+        items = sorted((str(key), str(val))
+                       for key, val in params.items()
+                       if val is not None)
+        return method.lower(), url, tuple(items)
+
+    def _get_ttl(self, url: str) -> float:
+        for regex, ttl in self._ttls:
+            if regex.match(url):
+                return ttl
+        return 0.0
+
+    def _start(self, key: RequestKey) -> Optional[bytes]:
+        """Count a request, returning its cached response, if any."""
+        with self._lock:
+            self.num_requests += 1
+            entry = self._cache.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._cache[key]
+                return None
+            self.num_cache_hits += 1
+            return entry[1]
+
+    def _put(self, key: RequestKey, content: bytes):
+        ttl = self._get_ttl(key[1])
+        if ttl <= 0.0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if len(self._cache) >= _PURGE_SIZE:
+                self._cache = {
+                    k: entry
+                    for k, entry in self._cache.items()
+                    if entry[0] > now
+                }
+            self._cache[key] = (now + ttl, content)
+
+    def do(self, method: str, url: str, kwargs: dict,
+           fetch: Callable[[], bytes]) -> bytes:
+        """Get the response of a request, calling `fetch()` only if no
+        identical request is in flight or cached.
+
+        Waiting for an identical request in flight is limited by the deadline
+        of the context, see `retry.deadline()`.
+
+        Raises:
+            DeadlineExceeded: if the deadline expires while waiting for the
+                identical request.
+        """
+        key = self.get_key(method, url, kwargs)
+        if key is None:
+            return fetch()
+        content = self._start(key)
+        if content is not None:
+            return content
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._flights[key] = flight
+            else:
+                self.num_coalesced += 1
+        if not leader:
+            if not flight.done.wait(get_time_left()):
+                raise DeadlineExceeded(f"Deadline exceeded for {url}")
+            if flight.error is not None:
+                raise flight.error
+            return flight.content
+        try:
+            flight.content = fetch()
+            self._put(key, flight.content)
+            return flight.content
+        except BaseException as exc:
+            flight.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    async def do_async(self, method: str, url: str, kwargs: dict,
+                       fetch: Callable[[], Awaitable[bytes]]) -> bytes:
+        """Asyncio version of `do()`."""
+        key = self.get_key(method, url, kwargs)
+        if key is None:
+            return await fetch()
+        content = self._start(key)
+        if content is not None:
+            return content
+        future = self._futures.get(key)
+        while future is not None:
+            self.num_coalesced += 1
+            # unlike wait_for(), the shared request is not cancelled if this
+            # waiter is cancelled or times out
+            await asyncio.wait((future,), timeout=get_time_left())
+            if not future.done():
+                raise DeadlineExceeded(f"Deadline exceeded for {url}")
+            if not future.cancelled():
+                return future.result()
+            # the sender was cancelled, send the request again
+            future = self._futures.get(key)
+        future = asyncio.get_running_loop().create_future()
+        self._futures[key] = future
+        try:
+            content = await fetch()
+            self._put(key, content)
+            future.set_result(content)
+            return content
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as exc:
+            future.set_exception(exc)
+            # mark the exception as retrieved, even if nobody was waiting
+            future.exception()
+            raise
+        finally:
+            del self._futures[key]
+
+    def invalidate(self):
+        """Remove all the cached responses."""
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self) -> dict:
+        """Get counters of requests, coalesced requests and cache hits."""
+        with self._lock:
+            return {
+                "requests": self.num_requests,
+                "coalesced": self.num_coalesced,
+                "cache_hits": self.num_cache_hits,
+                "cache_size": len(self._cache)
+            }
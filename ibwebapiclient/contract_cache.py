@@ -0,0 +1,146 @@
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, List, Optional, Tuple
+
+CacheEntry = Tuple[float, Any]
+
+
+class ContractCache:
+    """Cache of contract definitions, with time-to-live and LRU eviction.
+
+    Contract definitions (contract info, security search, futures, option
+    strikes) change at most daily, so gateway responses are cached for `ttl`
+    seconds. When the cache is full, the least recently used entries are
+    evicted.
+
+    If a path is given, entries are saved to a JSON file at exit (or calling
+    `save()`) and loaded again at startup, so that a restarted application can
+    resolve its contracts without requesting them again to the gateway.
+    """
+    _log: logging.Logger = logging.getLogger("ContractCache")
+
+    def __init__(self,
+                 ttl: float = 86400.0,
+                 max_size: int = 100000,
+                 path: Optional[str] = None):
+        """Init cache, loading the entries saved in `path`, if any.
+
+        Args:
+            ttl: Time-to-live of the entries, in seconds.
+            max_size: Maximum number of entries kept in memory.
+            path: Optional JSON file where entries are saved.
+        """
+        self._ttl = ttl
+        self._max_size = max_size
+        self._path = path
+        self._lock = threading.Lock()
+        # (expiration time, gateway response), least recently used first
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self.num_hits = 0
+        self.num_misses = 0
+        self.num_evictions = 0
+        self.num_expirations = 0
+        if path is not None:
+            self.load()
+            atexit.register(self.save)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[Any]:
+        """Get a cached response, None if missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.time():
+                del self._entries[key]
+                self.num_expirations += 1
+                entry = None
+            if entry is None:
+                self.num_misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.num_hits += 1
+            return entry[1]
+
+    def put(self, key: str, value: Any):
+        """Cache a response (which must be JSON serializable)."""
+        if value is None:
+            return
+        with self._lock:
+            self._entries[key] = (time.time() + self._ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+                self.num_evictions += 1
+
+    def get_or_fetch(self, key: str, fetch: Callable[[], Any]) -> Any:
+        """Get a cached response, or fetch and cache it if missing."""
+        value = self.get(key)
+        if value is None:
+            value = fetch()
+            self.put(key, value)
+        return value
+
+    def items(self, prefix: str = "") -> List[Tuple[str, Any]]:
+        """Get the cached entries whose key starts with `prefix`, without
+        updating their recency or the statistics."""
+        now = time.time()
+        with self._lock:
+            return [(key, entry[1])
+                    for key, entry in self._entries.items()
+                    if key.startswith(prefix) and entry[0] > now]
+
+    def invalidate(self, key: Optional[str] = None):
+        """Remove an entry, or all of them if None."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self) -> dict:
+        """Get counters of hits, misses, evictions and expirations."""
+        with self._lock:
+            return {
+                "hits": self.num_hits,
+                "misses": self.num_misses,
+                "evictions": self.num_evictions,
+                "expirations": self.num_expirations,
+                "size": len(self._entries)
+            }
+
+    def load(self):
+        """Load the entries saved to disk, skipping the expired ones."""
+        if self._path is None or not os.path.exists(self._path):
+            return
+        try:
+            with open(self._path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as exc:
+            self._log.warning(f"Cannot load {self._path}: {exc}")
+            return
+        now = time.time()
+        with self._lock:
+            for key, (expiration, value) in data.items():
+                if expiration > now:
+                    self._entries[key] = (expiration, value)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+        self._log.debug(f"{len(self._entries)} entries loaded")
+
+    def save(self):
+        """Save the entries to disk."""
+        if self._path is None:
+            return
+        with self._lock:
+            data = {key: list(entry) for key, entry in self._entries.items()}
+        # write and rename, so that the file is never partially written
+        tmp_path = self._path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self._path)
@@ -0,0 +1,173 @@
+import math
+import re
+from typing import Callable, Dict, Iterable, List, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from .models import MarketDataFields, market_data_fields_map
+
+F = MarketDataFields
+
+# prices, possibly prefixed by "C" (previous close) or "H" (halted)
+_PRICE_FIELDS = (F.LastPrice, F.High, F.Low, F.BidPrice, F.AskPrice, F.Open,
+                 F.Close, F.PriorClose, F.Mark, F.Change, F.ChangeSinceOpen,
+                 F.AvgPrice, F.MarketValue, F.UnrealizedPnl, F.DailyPnl,
+                 F.CostBasis, F.FiftyTwoWeekLow, F.FiftyTwoWeekHigh,
+                 F.EMATwoHundred, F.EMAOneHundred, F.EMAFiftyDay,
+                 F.EMATwentyDay, F.DividendAmount, F.Dividends, F.DividendsTtm,
+                 F.EarningsPerShare, F.PriceEarningsRatio, F.BreakEven, F.Delta,
+                 F.Gamma, F.Theta, F.Vega, F.SpxDelta, F.Beta, F.PutCallRatio)
+# quantities, possibly with thousands separators or K/M/B/T suffixes
+_QUANTITY_FIELDS = (F.Volume, F.VolumeLong, F.AskSize, F.BidSize, F.LastSize,
+                    F.AverageVolume, F.HistoricVolume, F.OptionVolume,
+                    F.OptionOpenInterest, F.FuturesOpenInterest,
+                    F.ShortableShares, F.MarketCap, F.PutCallInterest,
+                    F.PutCallVolume, F.Position)
+# percentages, with "%" suffix (value is kept in percent units)
+_PERCENT_FIELDS = (F.ChangePercent, F.OptionImpliedVolatilityPercent,
+                   F.ImpliedVolatilityPercent, F.HistoricVolumePercent,
+                   F.HistoricVolumeClosePercent, F.DividentYield,
+                   F.OptionVolumeChangePercent, F.PercentOfMarketValue,
+                   F.PriceEMATwoHundredDay, F.PriceEMAOneHundredDay,
+                   F.PriceEMAFiftyDay, F.PriceEMATwentyDay, F.FeeRate,
+                   F.LastYield, F.BidYield, F.AskYield)
+_INT_FIELDS = (F.Conid, F.UnderlyingContract)
+
+_MULTIPLIERS = {"": 1.0, "K": 1e3, "M": 1e6, "B": 1e9, "T": 1e12}
+_QUANTITY_RE = re.compile(r"^\s*([-+]?[\d.,]+)\s*([KMBT]?)\s*$")
+
+
+def _field_names(fields: Iterable[MarketDataFields]) -> List[str]:
+    return [market_data_fields_map[f.value] for f in fields]
+
+
+PRICE_FIELDS = _field_names(_PRICE_FIELDS)
+QUANTITY_FIELDS = _field_names(_QUANTITY_FIELDS) + ["volume_raw"]
+PERCENT_FIELDS = _field_names(_PERCENT_FIELDS)
+INT_FIELDS = _field_names(_INT_FIELDS) + ["_updated"]
+
+
+def decode_price(val) -> Tuple[float, str]:
+    """Decode a price, returning value and prefix flag ("C", "H" or "")."""
+    if isinstance(val, (int, float)):
+        return float(val), ""
+    flag = ""
+    if val[:1] in ("C", "H"):
+        flag = val[0]
+        val = val[1:]
+    try:
+        return float(val.replace(",", "")), flag
+    except ValueError:
+        return math.nan, flag
+
+
+def decode_quantity(val) -> float:
+    """Decode a quantity like "1,200", "1.2K" or "3.4M"."""
+    if isinstance(val, (int, float)):
+        return float(val)
+    match = _QUANTITY_RE.match(val)
+    if match is None:
+        return math.nan
+    try:
+        num = float(match.group(1).replace(",", ""))
+    except ValueError:
+        return math.nan
+    return num * _MULTIPLIERS[match.group(2)]
+
+
+def decode_percent(val) -> float:
+    """Decode a percentage like "1.23%", keeping it in percent units."""
+    if isinstance(val, (int, float)):
+        return float(val)
+    try:
+        return float(val.replace("%", "").replace(",", ""))
+    except ValueError:
+        return math.nan
+
+
+def decode_int(val) -> Union[int, float]:
+    try:
+        return int(val)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+# decoder of each field name, built once
+_decoders: Dict[str, Callable] = {}
+_decoders.update({name: decode_quantity for name in QUANTITY_FIELDS})
+_decoders.update({name: decode_percent for name in PERCENT_FIELDS})
+_decoders.update({name: decode_int for name in INT_FIELDS})
+_price_fields = frozenset(PRICE_FIELDS)
+
+
+def decode_market_data(row: dict) -> dict:
+    """Decode the string values of a market data row into typed values.
+
+    The row is as returned by `IBWebApiClient.get_market_data_snapshot()`.
+    Prices, quantities and percentages become floats (NaN if invalid),
+    contract IDs become ints, while other fields are left unchanged. The
+    flags `closed` and `halted` are set if the last price has the "C"
+    (previous close) or "H" (halted) prefix.
+    """
+    ret = {"closed": False, "halted": False}
+    for key, val in row.items():
+        if val is None:
+            ret[key] = val
+        elif key in _price_fields:
+            ret[key], flag = decode_price(val)
+            if key == "last_price":
+                ret["closed"] = flag == "C"
+                ret["halted"] = flag == "H"
+        else:
+            decoder = _decoders.get(key)
+            ret[key] = decoder(val) if decoder is not None else val
+    return ret
+
+
+def _decode_price_column(col: pd.Series) -> Tuple[pd.Series, pd.Series]:
+    col = col.astype(str)
+    flags = col.str[:1].where(col.str[:1].isin(("C", "H")), "")
+    values = pd.to_numeric(col.str.lstrip("CH").str.replace(",", ""),
+                           errors="coerce")
+    return values.astype(np.float64), flags
+
+
+def _decode_quantity_column(col: pd.Series) -> pd.Series:
+    parts = col.astype(str).str.extract(_QUANTITY_RE)
+    num = pd.to_numeric(parts[0].str.replace(",", ""), errors="coerce")
+    mult = parts[1].map(_MULTIPLIERS)
+    return (num * mult).astype(np.float64)
+
+
+def _decode_percent_column(col: pd.Series) -> pd.Series:
+    col = col.astype(str).str.replace("%", "").str.replace(",", "")
+    return pd.to_numeric(col, errors="coerce").astype(np.float64)
+
+
+def decode_market_data_df(rows: List[dict]) -> pd.DataFrame:
+    """Build a DataFrame with typed columns from many market data rows.
+
+    Same decoding as `decode_market_data()`, but done column by column with
+    vectorized operations. The DataFrame is indexed by contract ID.
+    """
+    df = pd.DataFrame(rows)
+    closed = pd.Series(False, index=df.index)
+    halted = pd.Series(False, index=df.index)
+    for name in df.columns:
+        if name in _price_fields:
+            df[name], flags = _decode_price_column(df[name])
+            if name == "last_price":
+                closed |= flags == "C"
+                halted |= flags == "H"
+        elif name in QUANTITY_FIELDS:
+            df[name] = _decode_quantity_column(df[name])
+        elif name in PERCENT_FIELDS:
+            df[name] = _decode_percent_column(df[name])
+        elif name in INT_FIELDS:
+            df[name] = pd.to_numeric(df[name], errors="coerce").astype("Int64")
+    df["closed"] = closed
+    df["halted"] = halted
+    if "conid" in df.columns:
+        df = df.set_index("conid")
+    return df
@@ -0,0 +1,239 @@
+import math
+from datetime import datetime, timezone
+from typing import Dict, List, Mapping, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from .decoding import decode_market_data
+from .models import OptionChain
+
+ArrayLike = Union[float, np.ndarray]
+
+# options are assumed to expire at 16:00 New York time (20:00 or 21:00 UTC)
+_EXPIRATION_TIME = "16:00"
+_EXPIRATION_TZ = "America/New_York"
+_SECONDS_PER_YEAR = 365.0 * 86400.0
+# coefficients of the normal CDF approximation, highest degree first
+_CDF_COEFFS = (1.330274429, -1.821255978, 1.781477937, -0.356563782,
+               0.319381530)
+
+
+def _as_arrays(*values: ArrayLike) -> List[np.ndarray]:
+    """Convert values to float arrays with the same shape."""
+    return np.broadcast_arrays(
+        *[np.asarray(val, dtype=np.float64) for val in values])
+
+
+def norm_pdf(x: ArrayLike) -> ArrayLike:
+    """Standard normal probability density."""
+    return np.exp(-0.5 * np.square(x)) / math.sqrt(2.0 * math.pi)
+
+
+def norm_cdf(x: ArrayLike) -> ArrayLike:
+    """Standard normal cumulative distribution.
+
+    Uses the approximation 26.2.17 of Abramowitz and Stegun (absolute error
+    below 7.5e-8), to avoid depending on SciPy.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    t = 1.0 / (1.0 + 0.2316419 * np.abs(x))
+    poly = np.zeros_like(t)
+    for coeff in _CDF_COEFFS:
+        poly = (poly + coeff) * t
+    tail = norm_pdf(x) * poly
+    return np.where(x >= 0.0, 1.0 - tail, tail)
+
+
+def black_scholes(spot: ArrayLike,
+                  strike: ArrayLike,
+                  t: ArrayLike,
+                  r: ArrayLike,
+                  sigma: ArrayLike,
+                  is_call: ArrayLike,
+                  q: ArrayLike = 0.0,
+                  model: str = "bs") -> Dict[str, np.ndarray]:
+    """Price and greeks of European options, vectorized over all arguments.
+
+    Args:
+        spot: Price of the underlying (forward price for Black-76).
+        strike: Strike prices.
+        t: Time to expiration, in years.
+        r: Risk-free rate (continuously compounded).
+        sigma: Volatility.
+        is_call: True for calls, False for puts.
+        q: Dividend yield (ignored for Black-76).
+        model: "bs" for Black-Scholes (stocks and indices), "black76" for
+            options on futures.
+
+    Returns:
+        Dict with arrays `price`, `delta`, `gamma`, `vega` (per 1% of
+        volatility) and `theta` (per calendar day).
+    """
+    spot, strike, t, r, sigma, q, is_call = _as_arrays(spot, strike, t, r,
+                                                       sigma, q, is_call)
+    is_call = is_call != 0.0
+    if model == "black76":
+        # futures have no cost of carry
+        carry = np.zeros_like(r)
+    elif model == "bs":
+        carry = r - q
+    else:
+        raise ValueError(f"Unknown model '{model}'")
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sqrt_t = np.sqrt(t)
+        vol_t = sigma * sqrt_t
+        d1 = (np.log(spot / strike) + (carry + 0.5 * sigma**2) * t) / vol_t
+        d2 = d1 - vol_t
+    disc_spot = spot * np.exp((carry - r) * t)
+    disc_strike = strike * np.exp(-r * t)
+    sign = np.where(is_call, 1.0, -1.0)
+    nd1 = norm_cdf(sign * d1)
+    nd2 = norm_cdf(sign * d2)
+    pdf_d1 = norm_pdf(d1)
+
+    price = sign * (disc_spot * nd1 - disc_strike * nd2)
+    delta = sign * np.exp((carry - r) * t) * nd1
+    gamma = np.exp((carry - r) * t) * pdf_d1 / (spot * vol_t)
+    vega = disc_spot * pdf_d1 * sqrt_t
+    theta = (-disc_spot * pdf_d1 * sigma / (2.0 * sqrt_t) - sign *
+             (carry - r) * disc_spot * nd1 - sign * r * disc_strike * nd2)
+    return {
+        "price": price,
+        "delta": delta,
+        "gamma": gamma,
+        "vega": vega / 100.0,
+        "theta": theta / 365.0
+    }
+
+
+def implied_volatility(price: ArrayLike,
+                       spot: ArrayLike,
+                       strike: ArrayLike,
+                       t: ArrayLike,
+                       r: ArrayLike,
+                       is_call: ArrayLike,
+                       q: ArrayLike = 0.0,
+                       model: str = "bs",
+                       tol: float = 1e-6,
+                       max_iter: int = 50) -> np.ndarray:
+    """Implied volatility of European options, vectorized.
+
+    Newton iterations, safeguarded by bisection within [1e-4, 5.0], are run on
+    all the options at once. Options whose price is outside the no-arbitrage
+    bounds (or not converged) get NaN.
+
+    Arguments are as in `black_scholes()`.
+    """
+    price, spot, strike, t, r, q, is_call = _as_arrays(price, spot, strike, t,
+                                                       r, q, is_call)
+    low = np.full(price.shape, 1e-4)
+    high = np.full(price.shape, 5.0)
+    sigma = np.full(price.shape, 0.3)
+    done = ~np.isfinite(price) | (t <= 0.0)
+    converged = np.zeros(price.shape, dtype=bool)
+
+    for _ in range(max_iter):
+        res = black_scholes(spot, strike, t, r, sigma, is_call, q, model)
+        diff = res["price"] - price
+        converged |= ~done & (np.abs(diff) < tol)
+        done |= converged
+        if done.all():
+            break
+        # keep the root bracketed, price is increasing with volatility
+        high = np.where(diff > 0.0, sigma, high)
+        low = np.where(diff <= 0.0, sigma, low)
+        vega = res["vega"] * 100.0
+        with np.errstate(divide="ignore", invalid="ignore"):
+            newton = sigma - diff / vega
+        bisect = 0.5 * (low + high)
+        step = np.where((newton > low) & (newton < high), newton, bisect)
+        sigma = np.where(done, sigma, step)
+
+    return np.where(converged, sigma, np.nan)
+
+
+def get_time_to_expiration(expiration: Union[str, np.ndarray],
+                           now: Optional[datetime] = None) -> np.ndarray:
+    """Get time to expiration in years, from expiration dates like "20220822".
+
+    Options are assumed to expire at 16:00 New York time.
+    """
+    if now is None:
+        now = datetime.now(timezone.utc)
+    expiry = pd.to_datetime(np.atleast_1d(expiration), format="%Y%m%d")
+    expiry += pd.Timedelta(_EXPIRATION_TIME + ":00")
+    expiry = expiry.tz_localize(_EXPIRATION_TZ).tz_convert("UTC")
+    seconds = (expiry - pd.Timestamp(now).tz_convert("UTC")).total_seconds()
+    return np.maximum(seconds.to_numpy(), 0.0) / _SECONDS_PER_YEAR
+
+
+def compute_chain_greeks(chain: OptionChain,
+                         quotes: Mapping[int, dict],
+                         underlying_price: float,
+                         r: float = 0.0,
+                         q: float = 0.0,
+                         model: str = "bs",
+                         now: Optional[datetime] = None) -> pd.DataFrame:
+    """Compute implied volatility and greeks of a whole option chain.
+
+    Args:
+        chain: Option chain.
+        quotes: Latest market data row of each option, by conid (e.g. from
+            `IBWebApiClient.get_quote()`), with bid and ask prices. The mid
+            price is used, or the last price if bid or ask are missing.
+        underlying_price: Price of the underlying (futures price for Black-76).
+        r: Risk-free rate.
+        q: Dividend yield.
+        model: "bs" or "black76", see `black_scholes()`.
+        now: Current time, to compute the time to expiration.
+
+    Returns:
+        DataFrame indexed by conid with columns `right`, `strike`,
+        `expiration`, `bid`, `ask`, `mid`, `iv`, `delta`, `gamma`, `vega` and
+        `theta`.
+    """
+    opts = list(chain.call.values()) + list(chain.put.values())
+    prices: Dict[str, List[float]] = {"bid": [], "ask": [], "last": []}
+    for opt in opts:
+        quote = quotes.get(opt.conid)
+        quote = decode_market_data(quote) if quote is not None else {}
+        for col in prices:
+            prices[col].append(quote.get(f"{col}_price", np.nan))
+    df = pd.DataFrame(
+        {
+            "right": [opt.right for opt in opts],
+            "strike": [float(opt.strike) for opt in opts],
+            "expiration": [opt.maturityDate for opt in opts]
+        },
+        index=pd.Index([opt.conid for opt in opts], name="conid"))
+    for col, values in prices.items():
+        df[col] = np.array(values, dtype=np.float64)
+
+    mid = 0.5 * (df["bid"] + df["ask"])
+    df["mid"] = mid.where(mid.notna(), df["last"])
+    df = df.drop(columns="last")
+    is_call = (df["right"] == "C").to_numpy()
+    strike = df["strike"].to_numpy()
+    t = (get_time_to_expiration(df["expiration"].to_numpy(), now)
+         if len(df) > 0 else np.zeros(0))
+    df["iv"] = implied_volatility(df["mid"].to_numpy(),
+                                  underlying_price,
+                                  strike,
+                                  t,
+                                  r,
+                                  is_call,
+                                  q=q,
+                                  model=model)
+    greeks = black_scholes(underlying_price,
+                           strike,
+                           t,
+                           r,
+                           df["iv"].to_numpy(),
+                           is_call,
+                           q=q,
+                           model=model)
+    for name in ("delta", "gamma", "vega", "theta"):
+        df[name] = greeks[name]
+    return df
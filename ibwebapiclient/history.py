@@ -0,0 +1,462 @@
+import json
+import logging
+import re
+import threading
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from typing import (TYPE_CHECKING, Any, Callable, Dict, Iterable, Iterator,
+                    List, NamedTuple, Optional, Tuple, Union)
+
+import numpy as np
+import pandas as pd
+
+from .utils import parse_duration
+
+if TYPE_CHECKING:
+    from .client import IBWebApiClient
+
+HISTORY_COLUMNS = ["o", "h", "l", "c", "v"]
+# time format of the history endpoint
+HISTORY_TIME_FORMAT = "%Y%m%d-%H:%M:%S"
+
+_data_re = re.compile(rb'"data"\s*:\s*\[')
+_key_re = re.compile(rb'"(\w+)"\s*:')
+# characters that can be part of a number
+_number_chars = frozenset(b"0123456789.eE+-")
+_whitespace = b" \t\r\n"
+# characters removed from candles to get their skeleton, i.e. just the keys
+_skeleton_delete = bytes(sorted(_number_chars)) + _whitespace
+
+
+def format_history_time(dt: datetime) -> str:
+    """Format a time for the history endpoint, in UTC.
+
+    Naive times are assumed to be already in UTC.
+    """
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc)
+    return dt.strftime(HISTORY_TIME_FORMAT)
+
+
+def _to_utc(dt: datetime) -> datetime:
+    """Convert a time to UTC, naive times are assumed to be already in UTC."""
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
+
+
+def _decode_candles_slow(data_text: bytes) -> dict:
+    candles = json.loads(b"[" + data_text + b"]")
+    return {
+        key: np.array([c.get(key, np.nan) for c in candles], dtype=np.float64)
+        for key in HISTORY_COLUMNS + ["t"]
+    }
+
+
+def _decode_candles_fast(data_text: bytes) -> Optional[dict]:
+    """Parse candles in one go, assuming they have the same keys in the same
+    order.
+
+    Returns None if the candles are irregular.
+    """
+    num_candles = data_text.count(b"{")
+    first = data_text[:data_text.find(b"}") + 1]
+    keys = _key_re.findall(first)
+    if num_candles == 0 or len(keys) == 0:
+        return None
+    # strip everything except numbers and separators
+    delete = b'{}":' + bytes(set(b"".join(keys))) + _whitespace
+    if not _number_chars.isdisjoint(delete):
+        return None
+    # every candle must have the keys of the first one in the same order,
+    # otherwise values would end up in the wrong columns: without the numbers,
+    # candles must be identical
+    skeleton = first.translate(None, _skeleton_delete) + b","
+    skeletons = data_text.translate(None, _skeleton_delete) + b","
+    if skeletons != skeleton * num_candles:
+        return None
+    with warnings.catch_warnings():
+        # unparsable values are a warning in older NumPy versions
+        warnings.simplefilter("error", DeprecationWarning)
+        try:
+            values = np.fromstring(data_text.translate(None, delete),
+                                   dtype=np.float64,
+                                   sep=",")
+        except (ValueError, DeprecationWarning):
+            return None
+    if len(values) != num_candles * len(keys):
+        return None
+    values = values.reshape(num_candles, len(keys))
+    columns = {key.decode(): values[:, idx] for idx, key in enumerate(keys)}
+    for key in HISTORY_COLUMNS + ["t"]:
+        if key not in columns:
+            columns[key] = np.full(num_candles, np.nan)
+    return columns
+
+
+def decode_market_history(content: Union[bytes, str],
+                          tz: str = "UTC") -> Tuple[pd.DataFrame, dict]:
+    """Decode a market history response directly into typed columns.
+
+    The candles are parsed by NumPy from the raw response, without creating
+    a dict for each candle and without validating the whole response through
+    `MarketHistory`.
+
+    Args:
+        content: Raw JSON response of the `iserver/marketdata/history`
+            endpoint.
+        tz: Timezone of the index.
+
+    Returns:
+        DataFrame with float columns `o`, `h`, `l`, `c`, `v` and a
+        timezone-aware DatetimeIndex, and dict with all the other fields of the
+        response (e.g. `priceFactor`, `startTime`, `symbol`).
+    """
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+
+    match = _data_re.search(content)
+    if match is None:
+        meta = json.loads(content)
+        data_text = b""
+    else:
+        end = content.index(b"]", match.end())
+        data_text = content[match.end():end]
+        # parse everything else, which is small
+        meta = json.loads(content[:match.start()] + b'"data":[]' +
+                          content[end + 1:])
+    meta.pop("data", None)
+
+    columns = _decode_candles_fast(data_text)
+    if columns is None:
+        # irregular candles, use the standard parser
+        columns = _decode_candles_slow(data_text)
+
+    index = pd.to_datetime(columns["t"].astype(np.int64), unit="ms", utc=True)
+    index = index.tz_convert(tz).rename("t")
+    df = pd.DataFrame({key: columns[key] for key in HISTORY_COLUMNS},
+                      index=index)
+    return df, meta
+
+
+# units of the history period, with their maximum count allowed by the gateway
+_period_units = [("y", 15), ("m", 182), ("w", 792), ("d", 1000), ("h", 8),
+                 ("min", 30)]
+
+
+def get_history_window(bar: str, max_bars: int = 1000) -> Tuple[str, int]:
+    """Get the longest valid history period with at most `max_bars` bars.
+
+    Returns:
+        Period (e.g. "3d") and its length in seconds.
+    """
+    budget = parse_duration(bar) * max_bars
+    best = None
+    for unit, max_count in _period_units:
+        unit_seconds = parse_duration("1" + unit)
+        count = min(max_count, budget // unit_seconds)
+        if count > 0 and (best is None or count * unit_seconds > best[1]):
+            best = (f"{count}{unit}", count * unit_seconds)
+    if best is None:
+        raise ValueError(f"Bar '{bar}' too long for {max_bars} bars")
+    return best
+
+
+class HistoryResult(NamedTuple):
+    """Result of a history request of a batch, see `iter_history_results()`.
+    """
+    conid: int
+    data: Any = None
+    error: Optional[Exception] = None
+
+
+def iter_history_results(fetch: Callable[[int], Any],
+                         conids: Iterable[int],
+                         max_workers: int = 5) -> Iterator[HistoryResult]:
+    """Run history requests of many contracts on a bounded pool of workers.
+
+    Results are yielded as soon as each request completes, so in any order. A
+    failed request yields a result with the exception as `error`, without
+    stopping the others. If the iterator is closed early, the requests not
+    started yet are cancelled.
+
+    Args:
+        fetch: Function requesting the history of a contract.
+        conids: Contract IDs.
+        max_workers: Maximum number of concurrent requests (the gateway allows
+            at most 5 concurrent history requests).
+    """
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    futures = {executor.submit(fetch, conid): conid for conid in conids}
+    try:
+        for future in as_completed(futures):
+            conid = futures[future]
+            try:
+                yield HistoryResult(conid, data=future.result())
+            except Exception as exc:
+                yield HistoryResult(conid, error=exc)
+    finally:
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+
+class BackfillError(Exception):
+    """Some history windows could not be fetched, even after retrying."""
+
+    def __init__(self, message: str, partial: Dict[int, pd.DataFrame],
+                 failed: Dict[int, List[datetime]]):
+        super().__init__(message)
+        self.partial = partial
+        self.failed = failed
+
+
+class HistoryBackfill:
+    """Fetch long ranges of market history, in parallel windows.
+
+    The gateway returns a limited number of bars per request, so the range is
+    split into windows with a valid period, which are fetched concurrently
+    within the history pacing limit (at most 5 concurrent requests). Results
+    are stitched into a single frame per contract, dropping the bars repeated
+    at the edges of the windows. Failed windows are retried, without fetching
+    again the ones that succeeded.
+
+    Concurrent calls of the same instance share the limit of `max_workers`
+    concurrent requests.
+    """
+    _log: logging.Logger = logging.getLogger("HistoryBackfill")
+
+    def __init__(self,
+                 client: "IBWebApiClient",
+                 max_workers: int = 5,
+                 max_bars: int = 1000,
+                 max_retries: int = 3,
+                 retry_delay: float = 1.0):
+        """Init backfill engine.
+
+        Args:
+            client: Client used to request history.
+            max_workers: Maximum number of concurrent history requests.
+            max_bars: Maximum number of bars returned by a request.
+            max_retries: Maximum number of retries of a failed window.
+            retry_delay: Delay before retrying failed windows, doubled at
+                every retry.
+        """
+        self._client = client
+        self._max_workers = max_workers
+        self._semaphore = threading.BoundedSemaphore(max_workers)
+        self._max_bars = max_bars
+        self._max_retries = max_retries
+        self._retry_delay = retry_delay
+
+    def get_windows(self, start: datetime, end: datetime,
+                    bar: str) -> Tuple[str, List[datetime]]:
+        """Split a time range into history windows.
+
+        Returns:
+            Period of the windows and end time of each window.
+        """
+        period, seconds = get_history_window(bar, self._max_bars)
+        step = timedelta(seconds=seconds)
+        ends = []
+        window_end = end
+        while window_end > start:
+            ends.append(window_end)
+            window_end -= step
+        return period, ends
+
+    def fetch(self,
+              conid: int,
+              start: datetime,
+              end: Optional[datetime] = None,
+              bar: str = "1min",
+              exchange: Optional[str] = None,
+              outside_rth: bool = True,
+              tz: str = "UTC") -> pd.DataFrame:
+        """Fetch market history of a contract in the range [start, end].
+
+        See `fetch_many()`.
+        """
+        return self.fetch_many([conid],
+                               start,
+                               end=end,
+                               bar=bar,
+                               exchange=exchange,
+                               outside_rth=outside_rth,
+                               tz=tz)[conid]
+
+    def fetch_many(self,
+                   conids: Iterable[int],
+                   start: datetime,
+                   end: Optional[datetime] = None,
+                   bar: str = "1min",
+                   exchange: Optional[str] = None,
+                   outside_rth: bool = True,
+                   tz: str = "UTC") -> Dict[int, pd.DataFrame]:
+        """Fetch market history of many contracts in the range [start, end].
+
+        Windows of all contracts share the same pool of workers.
+
+        Args:
+            conids: Contract IDs.
+            start: Start of the range (naive times are assumed in UTC).
+            end: End of the range, now if None.
+            bar: Bar size.
+            exchange: Optional exchange.
+            outside_rth: Include data outside regular trading hours?
+            tz: Timezone of the index of the frames.
+
+        Returns:
+            Frame with the bars of each contract, as returned by
+            `IBWebApiClient.get_market_history_fast()`.
+
+        Raises:
+            BackfillError: if some windows failed after all retries.
+        """
+        start = _to_utc(start)
+        end = _to_utc(end) if end is not None else datetime.now(timezone.utc)
+        conids = list(conids)
+        period, ends = self.get_windows(start, end, bar)
+        pending = [
+            (conid, window_end) for conid in conids for window_end in ends
+        ]
+        results: Dict[Tuple[int, datetime], pd.DataFrame] = {}
+
+        def fetch_window(conid: int, window_end: datetime) -> pd.DataFrame:
+            with self._semaphore:
+                df, _ = self._client.get_market_history_fast(
+                    conid=conid,
+                    period=period,
+                    bar=bar,
+                    exchange=exchange,
+                    outside_rth=outside_rth,
+                    start_time=window_end,
+                    tz=tz)
+            return df
+
+        delay = self._retry_delay
+        with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            for attempt in range(self._max_retries + 1):
+                if attempt > 0:
+                    self._log.warning(f"Retrying {len(pending)} windows in "
+                                      f"{delay:.1f}s")
+                    time.sleep(delay)
+                    delay *= 2
+                futures = {
+                    executor.submit(fetch_window, *key): key for key in pending
+                }
+                failed = []
+                for future in as_completed(futures):
+                    key = futures[future]
+                    try:
+                        results[key] = future.result()
+                    except Exception as exc:
+                        self._log.warning(f"Window {key} failed: {exc}")
+                        failed.append(key)
+                pending = failed
+                if len(pending) == 0:
+                    break
+
+        start_ts = pd.Timestamp(start)
+        end_ts = pd.Timestamp(end)
+        frames = {}
+        for conid in conids:
+            parts = [
+                results[(conid, window_end)]
+                for window_end in reversed(ends)
+                if (conid, window_end) in results
+            ]
+            # frames without bars are in UTC
+            frames[conid] = stitch_history(parts, start_ts,
+                                           end_ts).tz_convert(tz)
+
+        if len(pending) > 0:
+            failed_windows: Dict[int, List[datetime]] = {}
+            for conid, window_end in pending:
+                failed_windows.setdefault(conid, []).append(window_end)
+            raise BackfillError(f"{len(pending)} history windows failed",
+                                partial=frames,
+                                failed=failed_windows)
+        return frames
+
+
+def stitch_history(parts: List[pd.DataFrame],
+                   start: Optional[pd.Timestamp] = None,
+                   end: Optional[pd.Timestamp] = None) -> pd.DataFrame:
+    """Concatenate history frames, dropping duplicated bars.
+
+    Bars are sorted by time and, if repeated, the last occurrence is kept.
+    Optionally, bars are limited to the range [start, end].
+    """
+    if len(parts) == 0:
+        df = pd.DataFrame({col: [] for col in HISTORY_COLUMNS},
+                          dtype=np.float64,
+                          index=pd.DatetimeIndex([], tz="UTC", name="t"))
+    else:
+        df = pd.concat(parts)
+        df = df[~df.index.duplicated(keep="last")].sort_index()
+    if start is not None:
+        df = df[df.index >= start]
+    if end is not None:
+        df = df[df.index <= end]
+    return df
+
+
+def can_resample_history(fine_bar: str, bar: str) -> bool:
+    """Can bars of size `bar` be derived from bars of size `fine_bar`?
+
+    Only intraday bars can be derived, since they are aligned to multiples of
+    their size since the epoch: each fine bar must fall entirely within one
+    derived bar. Daily and longer bars of the gateway follow the sessions of
+    the exchange, which are not known locally.
+    """
+    fine_seconds = parse_duration(fine_bar)
+    seconds = parse_duration(bar)
+    if fine_seconds >= seconds or seconds >= 86400:
+        return False
+    return seconds % fine_seconds == 0
+
+
+def resample_history(df: pd.DataFrame,
+                     bar: str,
+                     tz: str = "UTC") -> pd.DataFrame:
+    """Aggregate history bars into coarser OHLCV bars.
+
+    Args:
+        df: Bars as returned by `decode_market_history()`, sorted by time.
+        bar: Size of the aggregated bars, at most one day. Daily bars start at
+            midnight in timezone `tz`.
+        tz: Timezone of the index of the result.
+
+    Returns:
+        DataFrame with the same columns, indexed by the start of each bar.
+    """
+    seconds = parse_duration(bar)
+    index = df.index.tz_convert(tz)
+    if seconds < 86400:
+        keys = index.to_numpy("datetime64[ns]").view(np.int64)
+        keys = keys - keys % (seconds * 10**9)
+    elif seconds == 86400:
+        keys = index.normalize().to_numpy("datetime64[ns]").view(np.int64)
+    else:
+        raise ValueError(f"Cannot resample history to bar '{bar}'")
+    if len(keys) == 0:
+        return stitch_history([]).tz_convert(tz)
+
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(keys)) + 1))
+    ends = np.append(starts[1:], len(keys)) - 1
+    o, h, l, c, v = [
+        df[col].to_numpy(dtype=np.float64) for col in HISTORY_COLUMNS
+    ]
+    t = pd.to_datetime(keys[starts], utc=True).tz_convert(tz).rename("t")
+    return pd.DataFrame(
+        {
+            "o": o[starts],
+            "h": np.maximum.reduceat(h, starts),
+            "l": np.minimum.reduceat(l, starts),
+            "c": c[ends],
+            "v": np.add.reduceat(v, starts)
+        },
+        index=t)
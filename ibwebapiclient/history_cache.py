@@ -0,0 +1,323 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from .history import (can_resample_history, get_history_window,
+                      resample_history, stitch_history)
+from .utils import parse_duration
+
+if TYPE_CHECKING:
+    from .history import HistoryBackfill
+
+# (conid, bar, outside_rth, exchange)
+CacheKey = Tuple[int, str, bool, Optional[str]]
+CacheEntry = Tuple[pd.DataFrame, pd.Timestamp, pd.Timestamp]
+
+
+class HistoryCache:
+    """On-disk cache of market history bars, updated incrementally.
+
+    Bars are stored in a Feather (Arrow IPC) file for each (conid, bar,
+    outsideRth, exchange), which is memory-mapped when loaded, so that years
+    of bars of many contracts can be loaded from disk instead of the gateway.
+    The file also records the time range covered. When bars are requested,
+    only the ranges not covered by the cache are fetched: usually just the
+    tail since the last cached bar, which is fetched again since it may have
+    been incomplete.
+
+    Bars coarser than the cached ones (e.g. 1h from 5min bars) are derived
+    locally, instead of being fetched, if the cached bars cover the requested
+    range, except at most a tail which can be fetched with a single request.
+    Daily bars are always fetched, see `can_resample_history()`.
+
+    Without a path, bars are only kept in memory, for the current session, up
+    to `max_memory_bars` bars: when the cache is full, the least recently used
+    contracts are evicted. Otherwise, requires `pyarrow`.
+    """
+    _log: logging.Logger = logging.getLogger("HistoryCache")
+
+    def __init__(self,
+                 path: Optional[str] = None,
+                 max_memory_bars: int = 1000000):
+        """Init cache.
+
+        Args:
+            path: Directory of the cache files, created if needed, or None to
+                keep bars in memory.
+            max_memory_bars: Maximum number of bars kept in memory, if `path`
+                is None.
+        """
+        self._path = path
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+        self._max_memory_bars = max_memory_bars
+        # least recently used first
+        self._memory: "OrderedDict[CacheKey, CacheEntry]" = OrderedDict()
+        self._memory_bars = 0
+        self._memory_lock = threading.Lock()
+        self._locks: Dict[CacheKey, threading.Lock] = {}
+        self._locks_lock = threading.Lock()
+
+    def _lock(self, key: CacheKey) -> threading.Lock:
+        with self._locks_lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    @staticmethod
+    def _get_file_suffix(outside_rth: bool, exchange: Optional[str]) -> str:
+        suffix = "_ext" if outside_rth else "_rth"
+        if exchange is not None:
+            suffix += f"_{exchange}"
+        return suffix + ".feather"
+
+    def get_file(self,
+                 conid: int,
+                 bar: str,
+                 outside_rth: bool,
+                 exchange: Optional[str] = None) -> str:
+        """Get path of the cache file of a contract."""
+        suffix = self._get_file_suffix(outside_rth, exchange)
+        return os.path.join(self._path, f"{conid}_{bar}{suffix}")
+
+    def get_bars(self,
+                 conid: int,
+                 outside_rth: bool,
+                 exchange: Optional[str] = None) -> List[str]:
+        """Get bar sizes cached for a contract."""
+        if self._path is None:
+            with self._memory_lock:
+                return [
+                    key[1]
+                    for key in self._memory
+                    if key[0] == conid and key[2:] == (outside_rth, exchange)
+                ]
+        prefix = f"{conid}_"
+        suffix = self._get_file_suffix(outside_rth, exchange)
+        return [
+            filename[len(prefix):-len(suffix)]
+            for filename in os.listdir(self._path)
+            if filename.startswith(prefix) and filename.endswith(suffix)
+        ]
+
+    def load(self,
+             conid: int,
+             bar: str,
+             outside_rth: bool,
+             exchange: Optional[str] = None) -> Optional[pd.DataFrame]:
+        """Load cached bars of a contract, None if not cached."""
+        ret = self._load(conid, bar, outside_rth, exchange)
+        return ret[0] if ret is not None else None
+
+    def _load(self,
+              conid: int,
+              bar: str,
+              outside_rth: bool,
+              exchange: Optional[str] = None) -> Optional[CacheEntry]:
+        """Load cached bars of a contract and the range they cover."""
+        if self._path is None:
+            key = (conid, bar, outside_rth, exchange)
+            with self._memory_lock:
+                entry = self._memory.get(key)
+                if entry is not None:
+                    self._memory.move_to_end(key)
+                return entry
+
+        import pyarrow.feather as feather
+
+        filename = self.get_file(conid, bar, outside_rth, exchange)
+        if not os.path.exists(filename):
+            return None
+        table = feather.read_table(filename, memory_map=True)
+        meta = table.schema.metadata or {}
+        df = table.to_pandas().set_index("t")
+        if b"covered_start" in meta:
+            covered_start = pd.Timestamp(meta[b"covered_start"].decode())
+            covered_end = pd.Timestamp(meta[b"covered_end"].decode())
+        elif len(df) > 0:
+            covered_start, covered_end = df.index[0], df.index[-1]
+        else:
+            return None
+        return df, covered_start, covered_end
+
+    def save(self,
+             conid: int,
+             bar: str,
+             outside_rth: bool,
+             df: pd.DataFrame,
+             covered_start: Optional[pd.Timestamp] = None,
+             covered_end: Optional[pd.Timestamp] = None,
+             exchange: Optional[str] = None):
+        """Replace cached bars of a contract.
+
+        The covered range defaults to the range of the bars, but it can be
+        wider (e.g. if there are no bars at the beginning of the range).
+        """
+        if covered_start is None:
+            covered_start = df.index[0]
+        if covered_end is None:
+            covered_end = df.index[-1]
+        if self._path is None:
+            key = (conid, bar, outside_rth, exchange)
+            with self._memory_lock:
+                old = self._memory.pop(key, None)
+                if old is not None:
+                    self._memory_bars -= len(old[0])
+                self._memory[key] = (df, covered_start, covered_end)
+                self._memory_bars += len(df)
+                # bars larger than the whole cache are not kept either
+                while self._memory_bars > self._max_memory_bars:
+                    _, entry = self._memory.popitem(last=False)
+                    self._memory_bars -= len(entry[0])
+            return
+
+        import pyarrow as pa
+        import pyarrow.feather as feather
+
+        table = pa.Table.from_pandas(df.reset_index(), preserve_index=False)
+        meta = dict(table.schema.metadata or {})
+        meta[b"covered_start"] = covered_start.isoformat().encode()
+        meta[b"covered_end"] = covered_end.isoformat().encode()
+        table = table.replace_schema_metadata(meta)
+        filename = self.get_file(conid, bar, outside_rth, exchange)
+        # write and rename, so that readers never see a partial file
+        tmp_filename = filename + ".tmp"
+        feather.write_feather(table, tmp_filename, compression="uncompressed")
+        os.replace(tmp_filename, filename)
+
+    def clear(self,
+              conid: int,
+              bar: str,
+              outside_rth: bool,
+              exchange: Optional[str] = None):
+        """Remove cached bars of a contract."""
+        if self._path is None:
+            with self._memory_lock:
+                entry = self._memory.pop((conid, bar, outside_rth, exchange),
+                                         None)
+                if entry is not None:
+                    self._memory_bars -= len(entry[0])
+            return
+        filename = self.get_file(conid, bar, outside_rth, exchange)
+        if os.path.exists(filename):
+            os.remove(filename)
+
+    def fetch(self,
+              backfill: "HistoryBackfill",
+              conid: int,
+              start: datetime,
+              end: Optional[datetime] = None,
+              bar: str = "1min",
+              exchange: Optional[str] = None,
+              outside_rth: bool = True,
+              tz: str = "UTC",
+              derive: bool = True) -> pd.DataFrame:
+        """Get bars of a contract in the range [start, end].
+
+        Cached bars are used where available, and only the missing ranges are
+        fetched through `backfill` and added to the cache. Bars of each
+        exchange are cached separately. If `derive` is True, bars can be
+        derived from finer cached bars, see `HistoryCache`.
+        """
+        if end is None:
+            end = datetime.now(timezone.utc)
+        start_ts = _to_timestamp(start)
+        end_ts = _to_timestamp(end)
+
+        if derive:
+            fine_bar = self._get_source_bar(conid, bar, outside_rth, exchange,
+                                            start_ts, end_ts)
+            if fine_bar is not None:
+                self._log.debug(f"{conid} {bar}: deriving from {fine_bar}")
+                df = self.fetch(backfill,
+                                conid,
+                                start_ts,
+                                end=end_ts,
+                                bar=fine_bar,
+                                exchange=exchange,
+                                outside_rth=outside_rth,
+                                derive=False)
+                df = resample_history(df, bar, tz=tz)
+                # the first bar is partial if it starts before the range
+                return df[df.index >= start_ts]
+
+        def fetch_range(range_start: pd.Timestamp,
+                        range_end: pd.Timestamp) -> pd.DataFrame:
+            return backfill.fetch(conid,
+                                  range_start.to_pydatetime(),
+                                  end=range_end.to_pydatetime(),
+                                  bar=bar,
+                                  exchange=exchange,
+                                  outside_rth=outside_rth)
+
+        with self._lock((conid, bar, outside_rth, exchange)):
+            cached = self._load(conid, bar, outside_rth, exchange)
+            if cached is None:
+                self._log.debug(f"{conid} {bar}: cache miss")
+                parts = [fetch_range(start_ts, end_ts)]
+                covered_start, covered_end = start_ts, end_ts
+            else:
+                df, covered_start, covered_end = cached
+                parts = []
+                if start_ts < covered_start:
+                    self._log.debug(f"{conid} {bar}: fetching head")
+                    parts.append(fetch_range(start_ts, covered_start))
+                    covered_start = start_ts
+                parts.append(df)
+                if end_ts > covered_end:
+                    # last cached bar may have been incomplete
+                    tail_start = df.index[-1] if len(df) > 0 else covered_end
+                    self._log.debug(f"{conid} {bar}: fetching tail")
+                    parts.append(fetch_range(tail_start, end_ts))
+                    covered_end = end_ts
+            df = stitch_history(parts)
+            if len(parts) > 1 or cached is None:
+                self.save(conid,
+                          bar,
+                          outside_rth,
+                          df,
+                          covered_start,
+                          covered_end,
+                          exchange=exchange)
+
+        df = df[(df.index >= start_ts) & (df.index <= end_ts)]
+        return df.tz_convert(tz)
+
+    def _get_source_bar(self, conid: int, bar: str, outside_rth: bool,
+                        exchange: Optional[str], start: pd.Timestamp,
+                        end: pd.Timestamp) -> Optional[str]:
+        """Get the coarsest cached bar size, covering [start, end], from which
+        bars of size `bar` can be derived, or None if bars must be fetched.
+
+        The cached bars may end before `end`, if the missing tail can be
+        fetched with a single request.
+        """
+        cached = self._load(conid, bar, outside_rth, exchange)
+        if cached is not None and cached[1] <= start:
+            # bars of this size are already cached
+            return None
+        best = None
+        for fine_bar in self.get_bars(conid, outside_rth, exchange):
+            if not can_resample_history(fine_bar, bar):
+                continue
+            fine_cached = self._load(conid, fine_bar, outside_rth, exchange)
+            if fine_cached is None or not (fine_cached[1] <= start <=
+                                           fine_cached[2]):
+                continue
+            _, window = get_history_window(fine_bar)
+            if (end - fine_cached[2]).total_seconds() > window:
+                # fetching the fine bars would take more requests
+                continue
+            if best is None or parse_duration(fine_bar) > parse_duration(best):
+                best = fine_bar
+        return best
+
+
+def _to_timestamp(dt: datetime) -> pd.Timestamp:
+    ts = pd.Timestamp(dt)
+    if ts.tzinfo is None:
+        ts = ts.tz_localize("UTC")
+    return ts.tz_convert("UTC")
@@ -305,6 +305,13 @@ market_data_fields_map = {
 }
 
 
+def map_market_data_fields(row: dict) -> dict:
+    """Give meaningful names to the field numbers of a market data row."""
+    return {
+        market_data_fields_map.get(key, key): val for key, val in row.items()
+    }
+
+
 class GatewayStatus(BaseModel):
     session: str  # '11fbe1474b90e950ff099f5b2ff07f91'
     ssoExpires: int  # 542578
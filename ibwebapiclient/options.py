@@ -0,0 +1,158 @@
+from bisect import bisect_left, bisect_right
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .models import OptionChain, OptionStrikes
+
+
+def select_strike_window(strikes: Iterable[float],
+                         price: float,
+                         num_strikes: Optional[int] = None,
+                         pct: Optional[float] = None) -> List[float]:
+    """Select the strikes around a price.
+
+    Args:
+        strikes: Available strikes.
+        price: Price of the underlying.
+        num_strikes: Number of strikes to select below and above the price
+            (a strike equal to the price counts as above).
+        pct: Select the strikes within +/- `pct` percent of the price.
+
+    If both `num_strikes` and `pct` are given, strikes must satisfy both.
+
+    Returns:
+        Selected strikes, sorted.
+    """
+    if num_strikes is None and pct is None:
+        raise ValueError("Either num_strikes or pct must be given")
+    strikes = sorted(set(strikes))
+    lo = 0
+    hi = len(strikes)
+    if num_strikes is not None:
+        idx = bisect_left(strikes, price)
+        lo = max(lo, idx - num_strikes)
+        hi = min(hi, idx + num_strikes)
+    if pct is not None:
+        lo = max(lo, bisect_left(strikes, price * (1.0 - pct / 100.0)))
+        hi = min(hi, bisect_right(strikes, price * (1.0 + pct / 100.0)))
+    return strikes[lo:hi]
+
+
+class StrikeIndex:
+    """Compact index of the strikes of an option expiration.
+
+    Call and put strikes are kept in sorted NumPy arrays (with the conids of
+    the options, if built from a chain), so that the strikes around a price
+    can be found by bisection and ranges of strikes are array slices.
+
+    Example:
+        index = StrikeIndex.from_strikes(ibc.get_option_strikes(conid, exp))
+        idx, strike = index.nearest(price)
+        strikes = index.select_moneyness(price, 0.95, 1.05, right="P")
+    """
+
+    def __init__(self,
+                 call: Sequence[float],
+                 put: Sequence[float],
+                 call_conids: Optional[Sequence[int]] = None,
+                 put_conids: Optional[Sequence[int]] = None):
+        """Init index from the strikes (and optionally the conids) of the
+        calls and puts, in any order."""
+        self._strikes: Dict[str, np.ndarray] = {}
+        self._conids: Dict[str, Optional[np.ndarray]] = {}
+        self._lists: Dict[str, List[float]] = {}
+        rights = [("C", call, call_conids), ("P", put, put_conids)]
+        for right, strikes, conids in rights:
+            strikes = np.asarray(strikes, dtype=np.float64)
+            order = np.argsort(strikes, kind="stable")
+            self._strikes[right] = strikes[order]
+            self._conids[right] = (np.asarray(conids, dtype=np.int64)[order]
+                                   if conids is not None else None)
+            # bisect on a list is faster than NumPy for scalar queries
+            self._lists[right] = self._strikes[right].tolist()
+
+    @classmethod
+    def from_strikes(cls, strikes: OptionStrikes) -> "StrikeIndex":
+        """Build index from the result of `get_option_strikes()`."""
+        return cls(strikes.call, strikes.put)
+
+    @classmethod
+    def from_chain(cls, chain: OptionChain) -> "StrikeIndex":
+        """Build index from an option chain, with the conids."""
+        return cls(list(chain.call.keys()),
+                   list(chain.put.keys()),
+                   call_conids=[opt.conid for opt in chain.call.values()],
+                   put_conids=[opt.conid for opt in chain.put.values()])
+
+    def get_strikes(self, right: str = "C") -> np.ndarray:
+        """Get the sorted strikes of calls ("C") or puts ("P")."""
+        return self._strikes[right]
+
+    def get_conids(self, right: str = "C") -> Optional[np.ndarray]:
+        """Get the conids of calls or puts, in the order of the strikes."""
+        return self._conids[right]
+
+    def floor(self,
+              value: float,
+              right: str = "C") -> Optional[Tuple[int, float]]:
+        """Get index and value of the highest strike <= `value`, if any."""
+        strikes = self._lists[right]
+        idx = bisect_right(strikes, value) - 1
+        if idx < 0:
+            return None
+        return idx, strikes[idx]
+
+    def ceil(self,
+             value: float,
+             right: str = "C") -> Optional[Tuple[int, float]]:
+        """Get index and value of the lowest strike >= `value`, if any."""
+        strikes = self._lists[right]
+        idx = bisect_left(strikes, value)
+        if idx == len(strikes):
+            return None
+        return idx, strikes[idx]
+
+    def nearest(self,
+                value: float,
+                right: str = "C") -> Optional[Tuple[int, float]]:
+        """Get index and value of the strike nearest to `value` (the lower one
+        if in the middle of two strikes), if any."""
+        strikes = self._lists[right]
+        if len(strikes) == 0:
+            return None
+        idx = bisect_left(strikes, value)
+        if idx == len(strikes):
+            idx -= 1
+        elif idx > 0 and value - strikes[idx - 1] <= strikes[idx] - value:
+            idx -= 1
+        return idx, strikes[idx]
+
+    def nearest_many(self,
+                     values: Sequence[float],
+                     right: str = "C") -> np.ndarray:
+        """Get the indices of the strikes nearest to many values at once (-1
+        if there are no strikes)."""
+        strikes = self._strikes[right]
+        values = np.asarray(values, dtype=np.float64)
+        if len(strikes) == 0:
+            return np.full(values.shape, -1, dtype=np.int64)
+        idx = np.searchsorted(strikes, values)
+        lower = np.clip(idx - 1, 0, len(strikes) - 1)
+        upper = np.clip(idx, 0, len(strikes) - 1)
+        use_lower = (values - strikes[lower]) <= (strikes[upper] - values)
+        return np.where(use_lower, lower, upper)
+
+    def select_range(self, low: float, high: float, right: str = "C") -> slice:
+        """Get the slice of the strikes in [low, high]."""
+        strikes = self._lists[right]
+        return slice(bisect_left(strikes, low), bisect_right(strikes, high))
+
+    def select_moneyness(self,
+                         price: float,
+                         low: float,
+                         high: float,
+                         right: str = "C") -> np.ndarray:
+        """Get the strikes with moneyness (strike / price) in [low, high]."""
+        selected = self.select_range(price * low, price * high, right=right)
+        return self._strikes[right][selected]
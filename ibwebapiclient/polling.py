@@ -0,0 +1,183 @@
+import logging
+import threading
+import time
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, List, Optional, Set
+
+if TYPE_CHECKING:
+    from .client import IBWebApiClient
+
+# fields always returned by the gateway, which do not mean that the quote
+# changed
+_META_FIELDS = frozenset(("conid", "conidEx", "_updated", "server_id", "marker",
+                          "market_data_availability"))
+
+
+class SnapshotPoller:
+    """Poll market data snapshots of many contracts at a bounded rate.
+
+    Contracts are split into batches, so that each request stays within the
+    gateway URL and size limits, and requests are spaced to respect the given
+    aggregate rate. Each contract has its own polling interval: it is shortened
+    when the last poll returned changed fields and lengthened when it did not,
+    so that actively traded contracts are polled more often than idle ones.
+    Contracts due for polling are served in order of due time, so all of them
+    are polled round-robin even when the rate budget is saturated.
+
+    Received rows are merged into the client quote book (see
+    `IBWebApiClient.get_quote()`) and optionally passed to a callback.
+    """
+    _log: logging.Logger = logging.getLogger("SnapshotPoller")
+
+    def __init__(self,
+                 client: "IBWebApiClient",
+                 conids: Iterable[int],
+                 fields: Optional[List[str]] = None,
+                 callback: Optional[Callable[[List[dict]], None]] = None,
+                 rate: float = 5.0,
+                 batch_size: int = 100,
+                 max_url_length: int = 1800,
+                 min_interval: float = 0.5,
+                 max_interval: float = 10.0):
+        """Init poller, without starting it.
+
+        Args:
+            client: Client used to request snapshots.
+            conids: Contract IDs to poll.
+            fields: Fields to request (numbers, see `MarketDataFields`), or
+                None for all the subscribed ones.
+            callback: Optional callback called with the rows of every poll.
+            rate: Maximum number of snapshot requests per second.
+            batch_size: Maximum number of contracts per request.
+            max_url_length: Maximum length of the query string of a request.
+            min_interval: Minimum polling interval of a contract, in seconds.
+            max_interval: Maximum polling interval of a contract, in seconds.
+        """
+        self._client = client
+        self._fields = fields
+        self._callback = callback
+        self._request_interval = 1.0 / rate
+        self._batch_size = batch_size
+        self._max_url_length = max_url_length
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+        self._lock = threading.Lock()
+        self._intervals: Dict[int, float] = {}
+        self._due: Dict[int, float] = {}
+        self._last_request = 0.0
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.num_requests = 0
+        self.add_conids(conids)
+
+    def add_conids(self, conids: Iterable[int]):
+        """Start polling more contracts, immediately."""
+        now = time.monotonic()
+        with self._lock:
+            for conid in conids:
+                if conid not in self._due:
+                    self._intervals[conid] = self._min_interval
+                    self._due[conid] = now
+
+    def remove_conids(self, conids: Iterable[int]):
+        """Stop polling some contracts."""
+        with self._lock:
+            for conid in conids:
+                self._intervals.pop(conid, None)
+                self._due.pop(conid, None)
+
+    def get_interval(self, conid: int) -> Optional[float]:
+        """Get current polling interval of a contract, in seconds."""
+        return self._intervals.get(conid)
+
+    def _next_batch(self, now: float) -> List[int]:
+        """Get the contracts due for polling, most overdue first."""
+        with self._lock:
+            due = [conid for conid, t in self._due.items() if t <= now]
+            due.sort(key=self._due.__getitem__)
+        batch = []
+        # length of "conids=" and "&fields=..."
+        length = 7
+        if self._fields is not None:
+            length += 8 + len(",".join(self._fields))
+        for conid in due[:self._batch_size]:
+            # conid plus comma (URL encoded as %2C)
+            length += len(str(conid)) + 3
+            if length > self._max_url_length and len(batch) > 0:
+                break
+            batch.append(conid)
+        return batch
+
+    def _update(self, batch: List[int], rows: List[dict], now: float):
+        changed: Set[int] = set()
+        for row in rows:
+            if any(key not in _META_FIELDS for key in row):
+                changed.add(int(row["conid"]))
+        with self._lock:
+            for conid in batch:
+                interval = self._intervals.get(conid)
+                if interval is None:
+                    # removed in the meanwhile
+                    continue
+                if conid in changed:
+                    interval = max(self._min_interval, interval * 0.5)
+                else:
+                    interval = min(self._max_interval, interval * 1.5)
+                self._intervals[conid] = interval
+                self._due[conid] = now + interval
+
+    def poll_once(self) -> Optional[List[dict]]:
+        """Poll the next batch of due contracts, if any, waiting for the rate
+        limit.
+
+        Returns the received rows, or None if no contract is due.
+        """
+        wait = self._last_request + self._request_interval - time.monotonic()
+        if wait > 0.0:
+            time.sleep(wait)
+        now = time.monotonic()
+        batch = self._next_batch(now)
+        if len(batch) == 0:
+            return None
+        self._last_request = now
+        self.num_requests += 1
+        rows = self._client.get_market_data_snapshot(batch, fields=self._fields)
+        self._update(batch, rows, time.monotonic())
+        if self._callback is not None:
+            self._callback(rows)
+        return rows
+
+    def time_to_next(self) -> float:
+        """Get time until the next contract is due, in seconds."""
+        with self._lock:
+            if len(self._due) == 0:
+                return self._max_interval
+            return max(0.0, min(self._due.values()) - time.monotonic())
+
+    def run(self):
+        """Poll until stopped."""
+        while not self._stop.is_set():
+            try:
+                rows = self.poll_once()
+            except Exception as exc:
+                self._log.warning(f"Error polling snapshots: {exc}")
+                rows = None
+            if rows is None:
+                self._stop.wait(max(self.time_to_next(),
+                                    self._request_interval))
+
+    def start(self):
+        """Start polling in a background thread."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run,
+                                        name="SnapshotPoller",
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        """Stop the background thread."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
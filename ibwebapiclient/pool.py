@@ -0,0 +1,71 @@
+import socket
+from typing import List, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+SocketOption = Tuple[int, int, int]
+
+
+def get_socket_options(keep_alive: bool = True,
+                       tcp_nodelay: bool = True) -> List[SocketOption]:
+    """Get the options of the sockets connected to the gateway.
+
+    Args:
+        keep_alive: Enable TCP keep-alive probes, so that idle connections of
+            the pool are not silently dropped.
+        tcp_nodelay: Disable Nagle's algorithm, so that small requests are
+            sent immediately.
+    """
+    options = []
+    if tcp_nodelay:
+        options.append((socket.IPPROTO_TCP, socket.TCP_NODELAY, 1))
+    if keep_alive:
+        options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+    return options
+
+
+class PoolAdapter(HTTPAdapter):
+    """HTTP adapter with a configurable connection pool and socket options.
+
+    The pool blocks when all its connections are in use, so that threads
+    beyond `max_connections` wait for a connection to be released instead of
+    opening new ones which would be discarded afterwards.
+    """
+
+    def __init__(self,
+                 max_connections: int = 32,
+                 keep_alive: bool = True,
+                 tcp_nodelay: bool = True):
+        self._socket_options = get_socket_options(keep_alive, tcp_nodelay)
+        # one pool for the gateway API and one for the health checks of
+        # ibeam, on another port, so that they do not evict each other
+        super().__init__(pool_connections=2,
+                         pool_maxsize=max_connections,
+                         pool_block=True)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs["socket_options"] = self._socket_options
+        super().init_poolmanager(*args, **kwargs)
+
+
+def build_session(max_connections: int = 32,
+                  keep_alive: bool = True,
+                  tcp_nodelay: bool = True) -> requests.Session:
+    """Build a session whose connections to the gateway are pooled.
+
+    Args:
+        max_connections: Maximum number of connections kept open to the
+            gateway, i.e. of concurrent requests.
+        keep_alive: Reuse connections between requests (HTTP keep-alive) and
+            enable TCP keep-alive probes. If False, every request opens a new
+            connection.
+        tcp_nodelay: Disable Nagle's algorithm.
+    """
+    session = requests.Session()
+    adapter = PoolAdapter(max_connections, keep_alive, tcp_nodelay)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    if not keep_alive:
+        session.headers["Connection"] = "close"
+    return session
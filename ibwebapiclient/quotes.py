@@ -0,0 +1,57 @@
+import threading
+from typing import Dict, List, Optional
+
+
+class QuoteBook:
+    """In-memory book of the latest merged market data state of each contract.
+
+    Both the snapshot endpoint and the websocket return only the fields changed
+    since the previous update, so they are merged here into a complete quote
+    per contract, which can be read without any network call.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._quotes: Dict[int, dict] = {}
+
+    def __len__(self) -> int:
+        return len(self._quotes)
+
+    def __contains__(self, conid: int) -> bool:
+        return conid in self._quotes
+
+    def update(self, row: dict) -> Optional[dict]:
+        """Merge a market data row (snapshot row or tick) into the book.
+
+        Returns a copy of the merged quote, or None if the row has no conid.
+        """
+        conid = row.get("conid")
+        if conid is None:
+            return None
+        conid = int(conid)
+        with self._lock:
+            quote = self._quotes.get(conid)
+            if quote is None:
+                quote = {}
+                self._quotes[conid] = quote
+            quote.update(row)
+            return dict(quote)
+
+    def get(self, conid: int) -> Optional[dict]:
+        """Get a copy of the merged quote of a contract, if any."""
+        with self._lock:
+            quote = self._quotes.get(conid)
+            return dict(quote) if quote is not None else None
+
+    def conids(self) -> List[int]:
+        """Get the list of contract IDs in the book."""
+        with self._lock:
+            return list(self._quotes.keys())
+
+    def clear(self, conid: Optional[int] = None):
+        """Remove the quote of a contract, or all of them if None."""
+        with self._lock:
+            if conid is None:
+                self._quotes.clear()
+            else:
+                self._quotes.pop(conid, None)
@@ -0,0 +1,418 @@
+import asyncio
+import heapq
+import itertools
+import re
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Pattern, Sequence, Tuple
+
+from .retry import DeadlineExceeded
+
+# pacing limits of the gateway, as (URL regex, requests per second, burst)
+DEFAULT_RATE_LIMITS: List[Tuple[str, float, int]] = [
+    (r"iserver/marketdata/snapshot", 10.0, 10),
+    (r"iserver/marketdata/history", 5.0, 5),
+    (r"iserver/account/orders", 0.2, 1),
+    (r"iserver/account/trades", 0.2, 1),
+    (r"iserver/account/pnl/partitioned", 0.2, 1),
+    (r"iserver/scanner/params", 1.0 / 900.0, 1),
+    (r"iserver/scanner/run", 1.0, 1),
+    (r"portfolio/accounts", 0.2, 1),
+    (r"portfolio/subaccounts", 0.2, 1),
+    (r"sso/validate", 1.0 / 60.0, 1),
+    (r"tickle", 1.0, 1),
+]
+# global pacing limit of the gateway
+DEFAULT_GLOBAL_RATE = 10.0
+# lanes of requests, highest priority first
+LANES = ("orders", "account", "market_data", "bulk")
+# lane of each request, as (URL regex, lane), the default lane otherwise
+DEFAULT_LANE_RULES: List[Tuple[str, str]] = [
+    (r"iserver/account/[^/]+/orders?(/|$)", "orders"),
+    (r"iserver/reply/", "orders"),
+    (r"iserver/marketdata/history", "bulk"),
+    (r"iserver/scanner/", "bulk"),
+    (r"iserver/marketdata/", "market_data"),
+    (r"iserver/secdef/", "market_data"),
+    (r"iserver/contract/", "market_data"),
+    (r"trsrv/", "market_data"),
+    (r"iserver/account", "account"),
+    (r"portfolio/", "account"),
+]
+DEFAULT_LANE = "market_data"
+# tokens of the global bucket that each lane must leave to higher lanes
+DEFAULT_LANE_RESERVES: Dict[str, float] = {
+    "orders": 0.0,
+    "account": 0.0,
+    "market_data": 1.0,
+    "bulk": 3.0
+}
+
+
+class TokenBucket:
+    """Token bucket allowing `rate` requests per second, with bursts of
+    `burst` requests.
+
+    Requests exceeding the rate are not rejected but delayed: each request
+    reserves a token, possibly in the future, so that concurrent requests are
+    served in order of arrival.
+    """
+
+    def __init__(self,
+                 rate: float,
+                 burst: int = 1,
+                 clock: Callable[[], float] = time.monotonic):
+        """Init bucket.
+
+        Args:
+            rate: Requests per second.
+            burst: Size of the bucket.
+            clock: Function returning the current time, in seconds.
+        """
+        self._rate = rate
+        self._burst = burst
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._tokens = float(burst)
+        self._last = clock()
+        self.num_requests = 0
+        self.num_waits = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def reserve(self, max_wait: Optional[float] = None) -> Optional[float]:
+        """Reserve a token, returning how long to wait before using it.
+
+        If the wait would be longer than `max_wait`, no token is reserved and
+        None is returned.
+        """
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(float(self._burst),
+                               self._tokens + (now - self._last) * self._rate)
+            self._last = now
+            wait = max(0.0, (1.0 - self._tokens) / self._rate)
+            if max_wait is not None and wait > max_wait:
+                return None
+            self._tokens -= 1.0
+            self.num_requests += 1
+            if wait > 0.0:
+                self.num_waits += 1
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+            return wait
+
+    def stats(self) -> dict:
+        """Get counters of requests and waits (in seconds)."""
+        with self._lock:
+            avg_wait = (self.total_wait /
+                        self.num_requests if self.num_requests > 0 else 0.0)
+            return {
+                "rate": self._rate,
+                "burst": self._burst,
+                "requests": self.num_requests,
+                "waits": self.num_waits,
+                "total_wait": self.total_wait,
+                "max_wait": self.max_wait,
+                "avg_wait": avg_wait
+            }
+
+
+class PriorityScheduler:
+    """Token bucket shared by lanes of requests with different priorities.
+
+    Unlike `TokenBucket`, tokens are not reserved in advance: waiting requests
+    are queued by lane (see `LANES`) and order of arrival, and the first one
+    is dispatched as soon as a token is available. A request of a higher lane
+    thus overtakes all the queued requests of lower lanes. Moreover, each lane
+    can only use the tokens exceeding its reserve, so that lower lanes are
+    throttled to the capacity left by the higher ones, and a burst of bulk
+    requests never drains the bucket.
+    """
+
+    def __init__(self,
+                 rate: float,
+                 burst: int = 10,
+                 reserves: Optional[Dict[str, float]] = None,
+                 clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        """Init scheduler.
+
+        Args:
+            rate: Requests per second.
+            burst: Size of the bucket.
+            reserves: Tokens that each lane must leave in the bucket, defaults
+                to `DEFAULT_LANE_RESERVES`. Reserves are capped to `burst - 1`,
+                since the bucket never holds more than `burst` tokens.
+            clock: Function returning the current time, in seconds.
+            sleep: Function blocking the current thread for some seconds
+                (`acquire_async()` always uses `asyncio.sleep()`).
+        """
+        if burst < 1:
+            raise ValueError("burst must be at least 1")
+        if reserves is None:
+            reserves = DEFAULT_LANE_RESERVES
+        self._rate = rate
+        self._burst = burst
+        self._reserves = {
+            lane: min(reserve, burst - 1.0)
+            for lane, reserve in reserves.items()
+        }
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._tokens = float(burst)
+        self._last = clock()
+        # queued requests as (priority, arrival), first is next
+        self._queue: List[Tuple[int, int]] = []
+        self._counter = itertools.count()
+        self._stats = {
+            lane: {
+                "requests": 0,
+                "waits": 0,
+                "total_wait": 0.0,
+                "max_wait": 0.0
+            } for lane in LANES
+        }
+
+    def _enqueue(self, lane: str) -> Tuple[int, int]:
+        ticket = (LANES.index(lane), next(self._counter))
+        with self._lock:
+            heapq.heappush(self._queue, ticket)
+        return ticket
+
+    def _dequeue(self, ticket: Tuple[int, int]):
+        with self._lock:
+            if ticket in self._queue:
+                self._queue.remove(ticket)
+                heapq.heapify(self._queue)
+
+    def _try_dispatch(self, ticket: Tuple[int, int]) -> float:
+        """Dispatch a queued request if it is its turn, returning 0, otherwise
+        return how long to wait before trying again."""
+        lane = LANES[ticket[0]]
+        reserve = self._reserves.get(lane, 0.0)
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(float(self._burst),
+                               self._tokens + (now - self._last) * self._rate)
+            self._last = now
+            missing = 1.0 + reserve - self._tokens
+            if self._queue[0] != ticket:
+                # wait at least for the token of the request before
+                return max(missing, 1.0) / self._rate
+            if missing > 0.0:
+                return missing / self._rate
+            heapq.heappop(self._queue)
+            self._tokens -= 1.0
+            return 0.0
+
+    @staticmethod
+    def _check_timeout(lane: str, wait: float, timeout: Optional[float]):
+        if timeout is not None and wait > timeout:
+            raise DeadlineExceeded(
+                f"Deadline exceeded waiting for the {lane} lane")
+
+    def _update_stats(self, lane: str, wait: float):
+        with self._lock:
+            stats = self._stats[lane]
+            stats["requests"] += 1
+            if wait > 0.0:
+                stats["waits"] += 1
+                stats["total_wait"] += wait
+                stats["max_wait"] = max(stats["max_wait"], wait)
+
+    def acquire(self, lane: str, timeout: Optional[float] = None) -> float:
+        """Wait until a request of a lane can be sent.
+
+        Returns the time waited, in seconds.
+
+        Raises:
+            DeadlineExceeded: if the request cannot be sent within `timeout`
+                seconds. The request gives up its turn without waiting.
+        """
+        waited = 0.0
+        ticket = self._enqueue(lane)
+        try:
+            wait = self._try_dispatch(ticket)
+            while wait > 0.0:
+                self._check_timeout(lane, waited + wait, timeout)
+                self._sleep(wait)
+                waited += wait
+                wait = self._try_dispatch(ticket)
+        except BaseException:
+            self._dequeue(ticket)
+            raise
+        self._update_stats(lane, waited)
+        return waited
+
+    async def acquire_async(self,
+                            lane: str,
+                            timeout: Optional[float] = None) -> float:
+        """Asyncio version of `acquire()`."""
+        waited = 0.0
+        ticket = self._enqueue(lane)
+        try:
+            wait = self._try_dispatch(ticket)
+            while wait > 0.0:
+                self._check_timeout(lane, waited + wait, timeout)
+                await asyncio.sleep(wait)
+                waited += wait
+                wait = self._try_dispatch(ticket)
+        except BaseException:
+            self._dequeue(ticket)
+            raise
+        self._update_stats(lane, waited)
+        return waited
+
+    def stats(self) -> Dict[str, dict]:
+        """Get counters of requests and waits (in seconds) of each lane."""
+        with self._lock:
+            ret = {}
+            for lane, stats in self._stats.items():
+                ret[lane] = dict(stats)
+                ret[lane]["avg_wait"] = (stats["total_wait"] / stats["requests"]
+                                         if stats["requests"] > 0 else 0.0)
+            return ret
+
+
+class RateLimiter:
+    """Rate limiter of gateway requests, with a token bucket per endpoint and
+    priority lanes for the global limit.
+
+    Each request is matched against the URL patterns of the rules (the first
+    matching rule is used) and it is delayed until its bucket allows it.
+    Requests not matching any rule are only subject to the global limit.
+
+    Then, the request is assigned to a lane (orders, account, market data or
+    bulk) and it waits for the global limit in a `PriorityScheduler`, so that
+    order submissions and replies are sent before any queued market data or
+    history request.
+
+    Example:
+        limiter = RateLimiter(rules=DEFAULT_RATE_LIMITS +
+                              [(r"iserver/secdef/search", 2.0, 2)])
+        ibc = IBWebApiClient(rate_limiter=limiter)
+        ...
+        print(limiter.stats())
+    """
+
+    def __init__(self,
+                 rules: Optional[Sequence[Tuple[str, float, int]]] = None,
+                 global_rate: Optional[float] = DEFAULT_GLOBAL_RATE,
+                 global_burst: int = 10,
+                 lane_rules: Optional[Sequence[Tuple[str, str]]] = None,
+                 lane_reserves: Optional[Dict[str, float]] = None,
+                 clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        """Init rate limiter.
+
+        Args:
+            rules: List of (URL regex, requests per second, burst), matched
+                against the beginning of the URL path relative to the API root
+                (e.g. "iserver/marketdata/snapshot"). Defaults to
+                `DEFAULT_RATE_LIMITS`.
+            global_rate: Limit of all the requests, in requests per second,
+                None for no limit.
+            global_burst: Burst of the global limit.
+            lane_rules: List of (URL regex, lane) assigning requests to the
+                lanes in `LANES`, otherwise they go to `DEFAULT_LANE`.
+                Defaults to `DEFAULT_LANE_RULES`.
+            lane_reserves: Tokens of the global limit that each lane leaves to
+                higher lanes, defaults to `DEFAULT_LANE_RESERVES`.
+            clock: Function returning the current time, in seconds, e.g. to
+                drive the limiter with a simulated clock in tests.
+            sleep: Function blocking the current thread for some seconds
+                (`acquire_async()` always uses `asyncio.sleep()`).
+        """
+        if rules is None:
+            rules = DEFAULT_RATE_LIMITS
+        if lane_rules is None:
+            lane_rules = DEFAULT_LANE_RULES
+        self._rules: List[Tuple[Pattern, str, TokenBucket]] = [
+            (re.compile(pattern), pattern, TokenBucket(rate, burst, clock))
+            for pattern, rate, burst in rules
+        ]
+        self._lane_rules: List[Tuple[Pattern, str]] = []
+        for pattern, lane in lane_rules:
+            if lane not in LANES:
+                raise ValueError(f"Unknown lane '{lane}'")
+            self._lane_rules.append((re.compile(pattern), lane))
+        self._sleep = sleep
+        self._global = (PriorityScheduler(global_rate, global_burst,
+                                          lane_reserves, clock, sleep)
+                        if global_rate is not None else None)
+
+    def _get_bucket(self, url: str) -> Optional[TokenBucket]:
+        for regex, _, bucket in self._rules:
+            if regex.match(url):
+                return bucket
+        return None
+
+    def get_lane(self, url: str) -> str:
+        """Get the lane of a request to an URL."""
+        for regex, lane in self._lane_rules:
+            if regex.match(url):
+                return lane
+        return DEFAULT_LANE
+
+    def _reserve(self, url: str, timeout: Optional[float]) -> float:
+        """Reserve a token of the bucket of an URL, returning how long to
+        wait before using it."""
+        bucket = self._get_bucket(url)
+        if bucket is None:
+            return 0.0
+        wait = bucket.reserve(timeout)
+        if wait is None:
+            raise DeadlineExceeded(
+                f"Deadline exceeded waiting for the pacing limit of {url}")
+        return wait
+
+    def acquire(self,
+                url: str,
+                lane: Optional[str] = None,
+                timeout: Optional[float] = None) -> float:
+        """Wait until a request to an URL can be sent.
+
+        Args:
+            url: URL path relative to the API root.
+            lane: Lane of the request, to override the lane rules.
+            timeout: Maximum time to wait, in seconds, None if unlimited.
+
+        Returns:
+            The time waited, in seconds.
+
+        Raises:
+            DeadlineExceeded: if the request cannot be sent within `timeout`,
+                without waiting for it.
+        """
+        wait = self._reserve(url, timeout)
+        if wait > 0.0:
+            self._sleep(wait)
+        if self._global is not None:
+            wait += self._global.acquire(
+                lane or self.get_lane(url),
+                timeout - wait if timeout is not None else None)
+        return wait
+
+    async def acquire_async(self,
+                            url: str,
+                            lane: Optional[str] = None,
+                            timeout: Optional[float] = None) -> float:
+        """Asyncio version of `acquire()`."""
+        wait = self._reserve(url, timeout)
+        if wait > 0.0:
+            await asyncio.sleep(wait)
+        if self._global is not None:
+            wait += await self._global.acquire_async(
+                lane or self.get_lane(url),
+                timeout - wait if timeout is not None else None)
+        return wait
+
+    def stats(self) -> Dict[str, dict]:
+        """Get counters of requests and waits of each rule, and of the global
+        limit by lane (key "*")."""
+        ret = {pattern: bucket.stats() for _, pattern, bucket in self._rules}
+        if self._global is not None:
+            ret["*"] = self._global.stats()
+        return ret
@@ -0,0 +1,337 @@
+import asyncio
+import contextlib
+import contextvars
+import logging
+import random
+import re
+import threading
+import time
+from typing import (Awaitable, Callable, Iterator, List, Optional, Pattern,
+                    Sequence, Tuple)
+
+import aiohttp
+import requests
+import urllib3
+
+# function sending a request, given its timeout, returning the response content
+SendFunc = Callable[[Optional[float]], bytes]
+AsyncSendFunc = Callable[[Optional[float]], Awaitable[bytes]]
+
+# HTTP statuses of transient errors (429 when exceeding the pacing limits)
+DEFAULT_RETRY_STATUSES = (429, 500, 502, 503, 504)
+# endpoints returning empty responses until the gateway has loaded them, as
+# (URL regex, number of retries); note that retries are paced by the rate
+# limiter, e.g. one request every 5 seconds for orders and trades
+DEFAULT_EMPTY_RULES: List[Tuple[str, int]] = [
+    (r"iserver/account/orders", 1),
+    (r"iserver/account/trades", 1),
+]
+# POST endpoints that can be sent again without side effects
+DEFAULT_IDEMPOTENT_POSTS = [r"tickle", r"iserver/auth/status"]
+# errors of requests which were not even sent
+_NOT_SENT_ERRORS = (requests.exceptions.ConnectTimeout,
+                    aiohttp.ClientConnectorError)
+# causes of `requests.exceptions.ConnectionError` when the connection could
+# not be opened (e.g. refused)
+_NOT_SENT_CAUSES = (urllib3.exceptions.NewConnectionError,
+                    urllib3.exceptions.ConnectTimeoutError)
+# errors of requests which may have been processed
+_TRANSIENT_ERRORS = (requests.exceptions.ConnectionError,
+                     requests.exceptions.Timeout, aiohttp.ClientConnectionError,
+                     asyncio.TimeoutError)
+
+# absolute deadline (time.monotonic()) of the requests of the current context
+_deadline: "contextvars.ContextVar[Optional[float]]" = contextvars.ContextVar(
+    "deadline", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when the deadline expires before a request could be sent."""
+
+
+@contextlib.contextmanager
+def deadline(seconds: float) -> Iterator[None]:
+    """Limit the time of all the requests sent within the context, including
+    their retries.
+
+    The deadline applies to the current thread or asyncio task (and the tasks
+    it creates). Nested deadlines can only shorten it.
+
+    Example:
+        with deadline(2.0):
+            positions = ibc.get_positions()
+            orders = ibc.get_orders()
+    """
+    expiration = time.monotonic() + seconds
+    current = _deadline.get()
+    if current is not None:
+        expiration = min(expiration, current)
+    token = _deadline.set(expiration)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def get_time_left() -> Optional[float]:
+    """Get the time left before the deadline of the current context, in
+    seconds (negative if expired), None if there is no deadline."""
+    expiration = _deadline.get()
+    if expiration is None:
+        return None
+    return expiration - time.monotonic()
+
+
+class RetryPolicy:
+    """Retry policy of the gateway requests.
+
+    Failed requests are sent again after an exponential backoff with jitter,
+    if the error is transient (connection errors, timeouts and HTTP statuses
+    in `retry_statuses`) and the request is idempotent. Requests which are
+    not idempotent, like order submissions, are sent again only if they
+    surely were not processed: connection refused or rejected by the pacing
+    limits (HTTP 429).
+
+    Moreover, the gateway returns empty results from some endpoints until it
+    has loaded them: empty responses of the endpoints in `empty_rules` are
+    requested again.
+
+    Retries never exceed the deadline set with `deadline()`, and the timeout
+    of each attempt, including its wait for the pacing limits, is shortened to
+    the time left.
+    """
+    _log: logging.Logger = logging.getLogger("RetryPolicy")
+
+    def __init__(self,
+                 max_retries: int = 3,
+                 base_delay: float = 0.05,
+                 max_delay: float = 2.0,
+                 jitter: float = 0.5,
+                 retry_statuses: Sequence[int] = DEFAULT_RETRY_STATUSES,
+                 empty_rules: Optional[Sequence[Tuple[str, int]]] = None,
+                 idempotent_posts: Optional[Sequence[str]] = None,
+                 timeout: Optional[float] = None):
+        """Init retry policy.
+
+        Args:
+            max_retries: Maximum number of retries after an error.
+            base_delay: Delay before the first retry, in seconds, doubled at
+                every retry.
+            max_delay: Maximum delay between retries, in seconds.
+            jitter: Fraction of the delay which is randomized, so that
+                concurrent clients do not retry at the same time.
+            retry_statuses: HTTP statuses to retry.
+            empty_rules: List of (URL regex, number of retries) of the
+                endpoints whose empty responses are requested again. Defaults
+                to `DEFAULT_EMPTY_RULES`.
+            idempotent_posts: URL regexes of the POST requests that can be
+                retried. Defaults to `DEFAULT_IDEMPOTENT_POSTS`.
+            timeout: Default time limit of each request including retries,
+                in seconds, in addition to the deadline of the context.
+        """
+        if empty_rules is None:
+            empty_rules = DEFAULT_EMPTY_RULES
+        if idempotent_posts is None:
+            idempotent_posts = DEFAULT_IDEMPOTENT_POSTS
+        self._max_retries = max_retries
+        self._base_delay = base_delay
+        self._max_delay = max_delay
+        self._jitter = jitter
+        self._retry_statuses = frozenset(retry_statuses)
+        self._empty_rules: List[Tuple[Pattern, int]] = [
+            (re.compile(pattern), retries) for pattern, retries in empty_rules
+        ]
+        self._idempotent_posts: List[Pattern] = [
+            re.compile(pattern) for pattern in idempotent_posts
+        ]
+        self._timeout = timeout
+        self._lock = threading.Lock()
+        self.num_retries = 0
+        self.num_empty_retries = 0
+        self.num_deadlines = 0
+
+    def is_idempotent(self, method: str, url: str) -> bool:
+        """Can a request be sent again without side effects?"""
+        method = method.upper()
+        if method in ("GET", "HEAD", "OPTIONS"):
+            return True
+        return method == "POST" and any(
+            regex.match(url) for regex in self._idempotent_posts)
+
+    def get_delay(self, retry: int) -> float:
+        """Get the delay before a retry (0 for the first one), in seconds."""
+        delay = min(self._max_delay, self._base_delay * 2.0**retry)
+        return delay * (1.0 - self._jitter * random.random())
+
+    def _get_empty_retries(self, url: str) -> int:
+        for regex, retries in self._empty_rules:
+            if regex.match(url):
+                return retries
+        return 0
+
+    @staticmethod
+    def _get_status(exc: Exception) -> Optional[int]:
+        if isinstance(exc, requests.exceptions.HTTPError):
+            if exc.response is not None:
+                return exc.response.status_code
+        elif isinstance(exc, aiohttp.ClientResponseError):
+            return exc.status
+        return None
+
+    @staticmethod
+    def _is_not_sent(exc: Exception) -> bool:
+        """Was the request surely not sent, since the connection could not be
+        opened?"""
+        if isinstance(exc, _NOT_SENT_ERRORS):
+            return True
+        if isinstance(exc, requests.exceptions.ConnectionError):
+            # requests wraps the urllib3 error in a MaxRetryError
+            cause = exc.args[0] if len(exc.args) > 0 else None
+            cause = getattr(cause, "reason", cause)
+            return isinstance(cause, _NOT_SENT_CAUSES)
+        return False
+
+    def _can_retry(self, method: str, url: str, exc: Exception) -> bool:
+        status = self._get_status(exc)
+        if status is not None:
+            if status not in self._retry_statuses:
+                return False
+            # requests exceeding the pacing limits are not processed
+            return status == 429 or self.is_idempotent(method, url)
+        if self._is_not_sent(exc):
+            return True
+        if isinstance(exc, _TRANSIENT_ERRORS):
+            return self.is_idempotent(method, url)
+        return False
+
+    def _get_expiration(self) -> Optional[float]:
+        expiration = _deadline.get()
+        if self._timeout is not None:
+            timeout_expiration = time.monotonic() + self._timeout
+            if expiration is None or timeout_expiration < expiration:
+                expiration = timeout_expiration
+        return expiration
+
+    def _get_timeout(self, url: str,
+                     expiration: Optional[float]) -> Optional[float]:
+        """Get the time left for an attempt, None if unlimited."""
+        if expiration is None:
+            return None
+        timeout = expiration - time.monotonic()
+        if timeout <= 0.0:
+            with self._lock:
+                self.num_deadlines += 1
+            raise DeadlineExceeded(f"Deadline exceeded for {url}")
+        return timeout
+
+    def _get_retry_delay(self,
+                         method: str,
+                         url: str,
+                         retry: int,
+                         expiration: Optional[float],
+                         content: Optional[bytes] = None,
+                         exc: Optional[Exception] = None) -> Optional[float]:
+        """Get the delay before retrying a request, None to give up."""
+        if isinstance(exc, DeadlineExceeded):
+            with self._lock:
+                self.num_deadlines += 1
+            return None
+        if exc is not None:
+            if retry >= self._max_retries:
+                return None
+            if not self._can_retry(method, url, exc):
+                return None
+            reason = str(exc)
+        else:
+            if (retry >= self._get_empty_retries(url) or
+                    content.strip() not in (b"", b"[]", b"{}")):
+                return None
+            reason = "empty response"
+        delay = self.get_delay(retry)
+        if expiration is not None and time.monotonic() + delay >= expiration:
+            return None
+        with self._lock:
+            if exc is not None:
+                self.num_retries += 1
+            else:
+                self.num_empty_retries += 1
+        self._log.debug(f"Retrying {method.upper()} {url} in {delay:.3f} s "
+                        f"({reason})")
+        return delay
+
+    def call(self, method: str, url: str, send: SendFunc) -> bytes:
+        """Send a request, retrying it according to the policy.
+
+        Args:
+            method: HTTP method.
+            url: URL path relative to the API root.
+            send: Function sending the request, given the time left before
+                the deadline (None if unlimited), returning the content of
+                the response or raising an exception (`DeadlineExceeded` if
+                the request cannot be sent in time, which is not retried).
+
+        Returns:
+            The content of the response.
+        """
+        expiration = self._get_expiration()
+        retry = 0
+        while True:
+            timeout = self._get_timeout(url, expiration)
+            try:
+                content = send(timeout)
+            except Exception as exc:
+                delay = self._get_retry_delay(method,
+                                              url,
+                                              retry,
+                                              expiration,
+                                              exc=exc)
+                if delay is None:
+                    raise
+            else:
+                delay = self._get_retry_delay(method,
+                                              url,
+                                              retry,
+                                              expiration,
+                                              content=content)
+                if delay is None:
+                    return content
+            time.sleep(delay)
+            retry += 1
+
+    async def call_async(self, method: str, url: str,
+                         send: AsyncSendFunc) -> bytes:
+        """Asyncio version of `call()`."""
+        expiration = self._get_expiration()
+        retry = 0
+        while True:
+            timeout = self._get_timeout(url, expiration)
+            try:
+                content = await send(timeout)
+            except Exception as exc:
+                delay = self._get_retry_delay(method,
+                                              url,
+                                              retry,
+                                              expiration,
+                                              exc=exc)
+                if delay is None:
+                    raise
+            else:
+                delay = self._get_retry_delay(method,
+                                              url,
+                                              retry,
+                                              expiration,
+                                              content=content)
+                if delay is None:
+                    return content
+            await asyncio.sleep(delay)
+            retry += 1
+
+    def stats(self) -> dict:
+        """Get counters of retries after errors and empty responses, and of
+        requests not sent because of the deadline."""
+        with self._lock:
+            return {
+                "retries": self.num_retries,
+                "empty_retries": self.num_empty_retries,
+                "deadlines": self.num_deadlines
+            }
@@ -0,0 +1,237 @@
+import threading
+import time
+from collections import deque
+from typing import (Callable, Deque, Dict, Iterable, Iterator, List, Optional,
+                    Set)
+
+from .models import map_market_data_fields
+from .websocket_session import WebSocketSession
+
+MarketDataCallback = Callable[[dict], None]
+
+
+def parse_market_data_tick(msg: dict) -> Optional[dict]:
+    """Decode a websocket market data message into a tick.
+
+    The tick has the same format as a row returned by
+    `IBWebApiClient.get_market_data_snapshot()`, i.e. field numbers are
+    replaced by the names in `market_data_fields_map`. Returns None if the
+    message is not a market data message.
+    """
+    topic = msg.get("topic")
+    if not isinstance(topic, str) or not topic.startswith("smd+"):
+        return None
+    tick = map_market_data_fields({
+        key: val for key, val in msg.items() if key != "topic"
+    })
+    if "conid" not in tick:
+        tick["conid"] = int(topic[4:])
+    return tick
+
+
+class MarketDataHandler:
+    """Websocket message handler forwarding decoded ticks to a callback.
+
+    Optionally, only ticks of the given contract IDs are forwarded.
+    """
+
+    def __init__(self,
+                 callback: MarketDataCallback,
+                 conids: Optional[Iterable[int]] = None):
+        self.callback = callback
+        self.conids: Optional[Set[int]] = (set(conids)
+                                           if conids is not None else None)
+
+    def __call__(self, msg: dict):
+        tick = parse_market_data_tick(msg)
+        if tick is None:
+            return
+        if self.conids is not None and tick["conid"] not in self.conids:
+            return
+        self.callback(tick)
+
+
+class TickBuffer:
+    """Conflating buffer of market data ticks, with bounded memory.
+
+    For each contract ID only the latest merged field state is kept: a tick
+    received while the previous one of the same contract is still waiting to
+    be consumed is merged into it (conflated), so a slow consumer always gets
+    the freshest quote and never processes stale intermediate ones. Memory is
+    bounded by the number of contracts, plus an optional ring of the most
+    recent raw ticks per contract.
+    """
+
+    def __init__(self, history_size: int = 0):
+        """Init tick buffer.
+
+        Args:
+            history_size: Number of recent raw ticks to keep for each contract
+                (0 to disable).
+        """
+        self._history_size = history_size
+        self._cond = threading.Condition()
+        self._state: Dict[int, dict] = {}
+        # contract IDs updated since last read, in order of arrival
+        self._pending: Dict[int, None] = {}
+        self._history: Dict[int, Deque[dict]] = {}
+        self._closed = False
+        self.num_ticks = 0
+        self.num_conflated = 0
+        self.num_dropped = 0
+
+    def put(self, tick: dict):
+        """Merge a tick into the state of its contract."""
+        conid = tick["conid"]
+        with self._cond:
+            self.num_ticks += 1
+            state = self._state.get(conid)
+            if state is None:
+                self._state[conid] = dict(tick)
+            else:
+                state.update(tick)
+            if conid in self._pending:
+                self.num_conflated += 1
+            else:
+                self._pending[conid] = None
+            if self._history_size > 0:
+                history = self._history.get(conid)
+                if history is None:
+                    history = deque(maxlen=self._history_size)
+                    self._history[conid] = history
+                elif len(history) == self._history_size:
+                    self.num_dropped += 1
+                history.append(tick)
+            self._cond.notify()
+
+    def get(self, timeout: Optional[float] = None) -> Optional[dict]:
+        """Get the merged state of the next updated contract.
+
+        Waits up to `timeout` seconds (forever if None) for an update. Returns
+        None on timeout or if the buffer is closed.
+        """
+        with self._cond:
+            if timeout is not None:
+                deadline = time.monotonic() + timeout
+            while len(self._pending) == 0 and not self._closed:
+                if timeout is None:
+                    self._cond.wait()
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0.0:
+                        return None
+                    self._cond.wait(remaining)
+            if len(self._pending) == 0:
+                return None
+            conid = next(iter(self._pending))
+            del self._pending[conid]
+            return dict(self._state[conid])
+
+    def get_all(self) -> List[dict]:
+        """Get the merged state of all the updated contracts, without waiting.
+        """
+        with self._cond:
+            ret = [dict(self._state[conid]) for conid in self._pending]
+            self._pending.clear()
+            return ret
+
+    def latest(self, conid: int) -> Optional[dict]:
+        """Get the latest merged state of a contract, if any."""
+        with self._cond:
+            state = self._state.get(conid)
+            return dict(state) if state is not None else None
+
+    def history(self, conid: int) -> List[dict]:
+        """Get the recent raw ticks of a contract, oldest first."""
+        with self._cond:
+            return list(self._history.get(conid, ()))
+
+    def stats(self) -> dict:
+        """Get counters of received, conflated and dropped ticks."""
+        with self._cond:
+            return {
+                "ticks": self.num_ticks,
+                "conflated": self.num_conflated,
+                "dropped": self.num_dropped,
+                "pending": len(self._pending),
+                "conids": len(self._state)
+            }
+
+    def close(self):
+        """Wake up all waiting readers, which will get None."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class MarketDataStream:
+    """Iterator over realtime market data ticks pushed through websocket.
+
+    Ticks are yielded as soon as they are received, with the same format as the
+    rows returned by `IBWebApiClient.get_market_data_snapshot()`. Ticks go
+    through a `TickBuffer`, so each yielded tick is the latest merged state of
+    its contract and ticks received while the consumer is busy are conflated.
+
+    Example:
+        with ibc.stream_market_data(conid=[265598, 8314]) as stream:
+            for tick in stream:
+                print(tick["conid"], tick.get("last_price"))
+    """
+
+    def __init__(self,
+                 ws_session: Optional[WebSocketSession] = None,
+                 conids: Optional[Iterable[int]] = None,
+                 history_size: int = 0,
+                 on_close: Optional[Callable[[], None]] = None):
+        """Init stream.
+
+        Args:
+            ws_session: Websocket session receiving the ticks. If None, the
+                ticks must be passed to `buffer.put()` by the caller, e.g. with
+                `IBWebApiClient.add_market_data_callback()`, which moves the
+                callback to the next session if the websocket is reopened.
+            conids: Contract IDs of the ticks to yield, None for all (used
+                only with `ws_session`).
+            history_size: Raw ticks to keep for each contract, see
+                `TickBuffer`.
+            on_close: Called once when the stream is closed, e.g. to release
+                the market data subscription.
+        """
+        self._ws_session = ws_session
+        self._on_close = on_close
+        self.buffer = TickBuffer(history_size=history_size)
+        self._closed = False
+        self._handler = MarketDataHandler(self.buffer.put, conids)
+        if self._ws_session is not None:
+            self._ws_session.add_handler(self._handler)
+
+    def __enter__(self) -> "MarketDataStream":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __iter__(self) -> Iterator[dict]:
+        while True:
+            tick = self.get()
+            if tick is None:
+                return
+            yield tick
+
+    def get(self, timeout: Optional[float] = None) -> Optional[dict]:
+        """Get next tick, waiting up to `timeout` seconds.
+
+        Returns None on timeout or if the stream is closed.
+        """
+        return self.buffer.get(timeout=timeout)
+
+    def close(self):
+        """Stop receiving ticks and terminate iteration."""
+        if self._closed:
+            return
+        self._closed = True
+        if self._ws_session is not None:
+            self._ws_session.remove_handler(self._handler)
+        self.buffer.close()
+        if self._on_close is not None:
+            self._on_close()
@@ -0,0 +1,171 @@
+import json
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from .websocket_session import WebSocketSession
+
+FieldsKey = Tuple[str, ...]
+
+
+def build_subscribe_command(conid: int, fields: Iterable[str]) -> str:
+    params = {"fields": list(fields)}
+    return "smd+" + str(conid) + "+" + json.dumps(params).replace(" ", "")
+
+
+def build_unsubscribe_command(conid: int) -> str:
+    return "umd+" + str(conid) + "+{}"
+
+
+class SubscriptionManager:
+    """Registry of market data subscriptions shared by many components.
+
+    Subscriptions of (conid, fields) are reference counted, so each component
+    can subscribe and unsubscribe independently, and only the needed `smd+` and
+    `umd+` commands are sent: a contract is subscribed once with the union of
+    the requested fields and unsubscribed when nobody needs it anymore.
+
+    The gateway limits the number of concurrent market data lines: when the
+    limit is reached, the least recently read contract is unsubscribed from the
+    gateway (but not from the registry) and it is subscribed again the next
+    time it is read, see `touch()`. After a websocket reconnection, all active
+    subscriptions are sent again automatically.
+    """
+    _log: logging.Logger = logging.getLogger("SubscriptionManager")
+
+    def __init__(self, ws_session: WebSocketSession, max_lines: int = 100):
+        """Init subscription manager.
+
+        Args:
+            ws_session: Websocket session used to send commands.
+            max_lines: Maximum number of contracts subscribed at the same time
+                on the gateway.
+        """
+        self._ws_session = ws_session
+        self._max_lines = max_lines
+        self._lock = threading.Lock()
+        # reference count of each set of fields, for each contract
+        self._refs: Dict[int, Dict[FieldsKey, int]] = {}
+        # contracts subscribed on the gateway with their fields, least
+        # recently read first
+        self._active: "OrderedDict[int, FieldsKey]" = OrderedDict()
+        self._ws_session.add_connect_handler(self._resubscribe)
+        self.num_evictions = 0
+
+    def _wanted_fields(self, conid: int) -> FieldsKey:
+        fields: Set[str] = set()
+        for key in self._refs.get(conid, {}):
+            fields.update(key)
+        return tuple(sorted(fields))
+
+    def _activate(self, conid: int, cmds: List[str]):
+        """Subscribe a contract on the gateway, evicting others if needed."""
+        fields = self._wanted_fields(conid)
+        current = self._active.get(conid)
+        if current is not None:
+            self._active.move_to_end(conid)
+            if set(fields) <= set(current):
+                # already subscribed with all the needed fields
+                return
+        else:
+            while len(self._active) >= self._max_lines:
+                evicted, _ = self._active.popitem(last=False)
+                self.num_evictions += 1
+                self._log.debug(f"Line limit reached, evicting {evicted}")
+                cmds.append(build_unsubscribe_command(evicted))
+        self._active[conid] = fields
+        cmds.append(build_subscribe_command(conid, fields))
+
+    def subscribe(self, conids: Iterable[int], fields: Iterable[str]):
+        """Add a reference to the subscription of some contracts."""
+        key = tuple(sorted(set(fields)))
+        cmds: List[str] = []
+        with self._lock:
+            for conid in conids:
+                refs = self._refs.setdefault(conid, {})
+                refs[key] = refs.get(key, 0) + 1
+                self._activate(conid, cmds)
+        self._send(cmds)
+
+    def unsubscribe(self,
+                    conids: Iterable[int],
+                    fields: Optional[Iterable[str]] = None):
+        """Remove a reference to the subscription of some contracts.
+
+        If `fields` is None, all the references of the contracts are removed.
+        """
+        key = tuple(sorted(set(fields))) if fields is not None else None
+        cmds: List[str] = []
+        with self._lock:
+            for conid in conids:
+                refs = self._refs.get(conid)
+                if refs is None:
+                    continue
+                if key is None:
+                    refs.clear()
+                elif key in refs:
+                    refs[key] -= 1
+                    if refs[key] == 0:
+                        del refs[key]
+                if len(refs) == 0:
+                    del self._refs[conid]
+                    if self._active.pop(conid, None) is not None:
+                        cmds.append(build_unsubscribe_command(conid))
+        self._send(cmds)
+
+    def touch(self, conids: Iterable[int]):
+        """Mark contracts as read, subscribing them again if evicted."""
+        cmds: List[str] = []
+        with self._lock:
+            for conid in conids:
+                if conid in self._active:
+                    self._active.move_to_end(conid)
+                elif conid in self._refs:
+                    self._activate(conid, cmds)
+        self._send(cmds)
+
+    def clear(self):
+        """Forget all subscriptions, without sending any command."""
+        with self._lock:
+            self._refs.clear()
+            self._active.clear()
+
+    def is_subscribed(self, conid: int) -> bool:
+        """Is the contract currently subscribed on the gateway?"""
+        return conid in self._active
+
+    def get_active(self) -> List[int]:
+        """Get contracts subscribed on the gateway, least recently read first.
+        """
+        with self._lock:
+            return list(self._active.keys())
+
+    def set_websocket_session(self, ws_session: WebSocketSession):
+        """Use a new websocket session, e.g. after the previous one was closed.
+
+        All the active subscriptions are sent again once it is connected.
+        """
+        with self._lock:
+            if ws_session is self._ws_session:
+                return
+            self._ws_session.remove_connect_handler(self._resubscribe)
+            self._ws_session = ws_session
+        ws_session.add_connect_handler(self._resubscribe)
+        if ws_session.is_ready():
+            self._resubscribe()
+
+    def _send(self, cmds: List[str]):
+        # if not connected, everything is subscribed again once connected
+        if len(cmds) > 0 and self._ws_session.is_ready():
+            self._ws_session.send(cmds)
+
+    def _resubscribe(self):
+        with self._lock:
+            cmds = [
+                build_subscribe_command(conid, fields)
+                for conid, fields in self._active.items()
+            ]
+        if len(cmds) > 0:
+            self._log.debug(f"Subscribing again {len(cmds)} contracts")
+            self._ws_session.send(cmds)
@@ -0,0 +1,144 @@
+import threading
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional
+
+from .models import ContractInfo
+
+
+class SymbolIndex:
+    """In-memory index of contracts, to map symbols to conids locally.
+
+    Contracts are added from the results of `search_security()` and
+    `get_contract_info()`, and they can be found by exact symbol, symbol
+    prefix or local symbol (e.g. 'SPXW  220822C04230000'), optionally filtered
+    by security type, with dict lookups instead of gateway requests.
+
+    Each contract is a dict with keys `conid`, `symbol`, `sec_type`,
+    `local_symbol`, `company_name` and `exchange` (None if unknown).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._contracts: Dict[int, dict] = {}
+        self._by_symbol: Dict[str, List[int]] = {}
+        self._by_local_symbol: Dict[str, List[int]] = {}
+        # sorted symbols for prefix searches, rebuilt lazily
+        self._symbols: Optional[List[str]] = None
+
+    def __len__(self) -> int:
+        return len(self._contracts)
+
+    def __contains__(self, conid: int) -> bool:
+        return conid in self._contracts
+
+    def _add(self, conid: int, **fields):
+        contract = self._contracts.get(conid)
+        if contract is None:
+            contract = {
+                "conid": conid,
+                "symbol": None,
+                "sec_type": None,
+                "local_symbol": None,
+                "company_name": None,
+                "exchange": None
+            }
+            self._contracts[conid] = contract
+        for key, value in fields.items():
+            if value is None or value == contract[key]:
+                continue
+            index = None
+            if key == "symbol":
+                index = self._by_symbol
+                self._symbols = None
+            elif key == "local_symbol":
+                index = self._by_local_symbol
+            if index is not None:
+                if contract[key] is not None:
+                    index[contract[key].upper()].remove(conid)
+                index.setdefault(value.upper(), []).append(conid)
+            contract[key] = value
+
+    def add_search_results(self,
+                           results: Iterable[dict],
+                           sec_type: Optional[str] = None):
+        """Add the results of `search_security()`.
+
+        The security type of each result is taken from its first section,
+        otherwise it is `sec_type`.
+        """
+        with self._lock:
+            for res in results:
+                if res.get("conid") is None:
+                    continue
+                sections = res.get("sections") or []
+                self._add(int(res["conid"]),
+                          symbol=res.get("symbol"),
+                          sec_type=(sections[0].get("secType")
+                                    if len(sections) > 0 else sec_type),
+                          company_name=res.get("companyName"))
+
+    def add_contract_info(self, info: ContractInfo):
+        """Add the result of `get_contract_info()`."""
+        with self._lock:
+            self._add(info.con_id,
+                      symbol=info.symbol,
+                      sec_type=info.instrument_type,
+                      local_symbol=info.local_symbol,
+                      company_name=info.company_name,
+                      exchange=info.exchange)
+
+    def get(self, conid: int) -> Optional[dict]:
+        """Get a contract by conid."""
+        return self._contracts.get(conid)
+
+    def _filter(self, conids: Iterable[int],
+                sec_type: Optional[str]) -> List[dict]:
+        contracts = [self._contracts[conid] for conid in conids]
+        if sec_type is not None:
+            contracts = [c for c in contracts if c["sec_type"] == sec_type]
+        return contracts
+
+    def find(self, symbol: str, sec_type: Optional[str] = None) -> List[dict]:
+        """Find contracts by exact symbol (case insensitive)."""
+        with self._lock:
+            return self._filter(self._by_symbol.get(symbol.upper(), ()),
+                                sec_type)
+
+    def find_prefix(self,
+                    prefix: str,
+                    sec_type: Optional[str] = None,
+                    limit: Optional[int] = None) -> List[dict]:
+        """Find contracts whose symbol starts with `prefix`, sorted by symbol.
+        """
+        prefix = prefix.upper()
+        ret: List[dict] = []
+        with self._lock:
+            if self._symbols is None:
+                self._symbols = sorted(
+                    symbol for symbol, conids in self._by_symbol.items()
+                    if len(conids) > 0)
+            for idx in range(bisect_left(self._symbols, prefix),
+                             len(self._symbols)):
+                symbol = self._symbols[idx]
+                if not symbol.startswith(prefix):
+                    break
+                ret += self._filter(self._by_symbol[symbol], sec_type)
+                if limit is not None and len(ret) >= limit:
+                    break
+        return ret if limit is None else ret[:limit]
+
+    def find_local_symbol(self,
+                          local_symbol: str,
+                          sec_type: Optional[str] = None) -> List[dict]:
+        """Find contracts by exact local symbol (case insensitive)."""
+        with self._lock:
+            return self._filter(
+                self._by_local_symbol.get(local_symbol.upper(), ()), sec_type)
+
+    def clear(self):
+        """Remove all the contracts."""
+        with self._lock:
+            self._contracts.clear()
+            self._by_symbol.clear()
+            self._by_local_symbol.clear()
+            self._symbols = None
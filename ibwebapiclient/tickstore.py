@@ -0,0 +1,225 @@
+import threading
+import time
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from .decoding import decode_market_data
+from .models import MarketDataFields
+from .utils import parse_duration
+
+BAR_COLUMNS = ["o", "h", "l", "c", "v", "t"]
+# market data fields stored by `TickStore.append_tick()`: the volume field
+# (87) is rounded (e.g. "12.3M"), so the exact volume (7762) is used
+TICK_FIELDS = [
+    MarketDataFields.LastPrice.value, MarketDataFields.BidPrice.value,
+    MarketDataFields.AskPrice.value, MarketDataFields.VolumeLong.value
+]
+
+
+def _ffill(values: np.ndarray) -> np.ndarray:
+    """Forward fill NaN values (leading NaN values are kept)."""
+    idx = np.where(np.isnan(values), 0, np.arange(len(values)))
+    np.maximum.accumulate(idx, out=idx)
+    return values[idx]
+
+
+def aggregate_ticks(t: np.ndarray,
+                    price: np.ndarray,
+                    volume: np.ndarray,
+                    bar_ms: int,
+                    start: Optional[int] = None,
+                    end: Optional[int] = None) -> pd.DataFrame:
+    """Aggregate ticks into OHLCV bars.
+
+    Args:
+        t: Time of the ticks (epoch milliseconds), in ascending order.
+        price: Traded price of the ticks (NaN if unknown).
+        volume: Cumulative (daily) volume at each tick (NaN if unknown).
+        bar_ms: Length of the bars, in milliseconds.
+        start: Optional minimum time of the ticks to aggregate.
+        end: Optional maximum time (excluded) of the ticks to aggregate.
+
+    Returns:
+        DataFrame with columns `o`, `h`, `l`, `c`, `v` and `t` (start time of
+        the bar, in epoch milliseconds), as `MarketHistory.data`.
+    """
+    volume = _ffill(volume)
+    mask = ~np.isnan(price)
+    if start is not None:
+        mask &= t >= start
+    if end is not None:
+        mask &= t < end
+    t, price, volume = t[mask], price[mask], volume[mask]
+    if len(t) == 0:
+        return pd.DataFrame({col: [] for col in BAR_COLUMNS})
+
+    bucket = t - t % bar_ms
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(bucket)) + 1))
+    ends = np.append(starts[1:], len(t)) - 1
+
+    # volume of a bar = increase of cumulative volume since previous bar
+    vol_end = volume[ends]
+    vol_prev = np.concatenate((volume[:1], vol_end[:-1]))
+    vol = vol_end - vol_prev
+    # cumulative volume reset (e.g. new day)
+    vol = np.where(vol < 0, vol_end, vol)
+
+    return pd.DataFrame({
+        "o": price[starts],
+        "h": np.maximum.reduceat(price, starts),
+        "l": np.minimum.reduceat(price, starts),
+        "c": price[ends],
+        "v": np.nan_to_num(vol),
+        "t": bucket[starts]
+    })
+
+
+class _TickColumns:
+    """Growable columnar arrays with the ticks of a contract."""
+    names = ("t", "last", "bid", "ask", "volume")
+
+    def __init__(self, capacity: int):
+        self.size = 0
+        self.t = np.empty(capacity, dtype=np.int64)
+        self.last = np.empty(capacity, dtype=np.float64)
+        self.bid = np.empty(capacity, dtype=np.float64)
+        self.ask = np.empty(capacity, dtype=np.float64)
+        self.volume = np.empty(capacity, dtype=np.float64)
+
+    def append(self, t: int, last: float, bid: float, ask: float,
+               volume: float):
+        if self.size == len(self.t):
+            # double capacity
+            for name in self.names:
+                old = getattr(self, name)
+                new = np.empty(max(1, 2 * len(old)), dtype=old.dtype)
+                new[:self.size] = old[:self.size]
+                setattr(self, name, new)
+        idx = self.size
+        self.t[idx] = t
+        self.last[idx] = last
+        self.bid[idx] = bid
+        self.ask[idx] = ask
+        self.volume[idx] = volume
+        self.size += 1
+
+    def view(self) -> Dict[str, np.ndarray]:
+        return {name: getattr(self, name)[:self.size] for name in self.names}
+
+
+class TickStore:
+    """In-process columnar store of market data ticks.
+
+    Ticks of each contract are kept in growable NumPy arrays (time, last, bid,
+    ask, cumulative volume), which can be aggregated into OHLCV bars of any
+    length with vectorized operations. Bars have the same columns as
+    `MarketHistory.data`, so they can be concatenated with the output of
+    `IBWebApiClient.get_market_history_df()`.
+
+    Example:
+        store = TickStore()
+        ibc.add_market_data_callback(store.append_tick)
+        ibc.subscribe_market_data(conid, fields=TICK_FIELDS)
+        ...
+        bars = store.get_bars(conid, "1min")
+    """
+
+    def __init__(self, initial_capacity: int = 1024):
+        self._initial_capacity = initial_capacity
+        self._lock = threading.Lock()
+        self._columns: Dict[int, _TickColumns] = {}
+
+    def __len__(self) -> int:
+        return len(self._columns)
+
+    def conids(self) -> List[int]:
+        return list(self._columns.keys())
+
+    def append(self,
+               conid: int,
+               t: int,
+               last: float = np.nan,
+               bid: float = np.nan,
+               ask: float = np.nan,
+               volume: float = np.nan):
+        """Append a tick of a contract (time in epoch milliseconds)."""
+        with self._lock:
+            columns = self._columns.get(conid)
+            if columns is None:
+                columns = _TickColumns(self._initial_capacity)
+                self._columns[conid] = columns
+            columns.append(t, last, bid, ask, volume)
+
+    def append_tick(self, tick: dict):
+        """Append a market data row, as returned by snapshots and streams.
+
+        Fields missing in the row are stored as NaN. The time is taken from the
+        `_updated` field, if available, otherwise it is the current time. The
+        volume is taken from the `volume_long` field (see `TICK_FIELDS`), or
+        from `volume_raw`, since `volume` is rounded and its differences would
+        give wrong bar volumes.
+        """
+        tick = decode_market_data(tick)
+        volume = tick.get("volume_long")
+        if volume is None:
+            volume = tick.get("volume_raw")
+        values = [
+            tick.get(name)
+            for name in ("_updated", "last_price", "bid_price", "ask_price")
+        ] + [volume]
+        t, last, bid, ask, volume = [
+            np.nan if val is None else val for val in values
+        ]
+        if t != t:
+            t = int(time.time() * 1000)
+        self.append(int(tick["conid"]), int(t), last, bid, ask, volume)
+
+    def get_ticks(self, conid: int) -> Dict[str, np.ndarray]:
+        """Get a copy of the tick columns of a contract."""
+        with self._lock:
+            columns = self._columns.get(conid)
+            if columns is None:
+                columns = _TickColumns(0)
+            return {
+                name: values.copy() for name, values in columns.view().items()
+            }
+
+    def get_ticks_df(self, conid: int) -> pd.DataFrame:
+        """Get the ticks of a contract as a DataFrame."""
+        return pd.DataFrame(self.get_ticks(conid))
+
+    def get_bars(self,
+                 conid: int,
+                 bar: Union[str, int] = "1min",
+                 start: Optional[int] = None,
+                 end: Optional[int] = None) -> pd.DataFrame:
+        """Aggregate the ticks of a contract into OHLCV bars.
+
+        Args:
+            conid: Contract ID.
+            bar: Bar length, as a gateway duration (e.g. "5min") or seconds.
+            start: Optional minimum time of the ticks (epoch milliseconds).
+            end: Optional maximum time (excluded) of the ticks.
+
+        Returns:
+            DataFrame with columns `o`, `h`, `l`, `c`, `v` and `t`.
+        """
+        if isinstance(bar, str):
+            bar = parse_duration(bar)
+        ticks = self.get_ticks(conid)
+        return aggregate_ticks(ticks["t"],
+                               ticks["last"],
+                               ticks["volume"],
+                               bar_ms=bar * 1000,
+                               start=start,
+                               end=end)
+
+    def clear(self, conid: Optional[int] = None):
+        """Remove the ticks of a contract, or all of them if None."""
+        with self._lock:
+            if conid is None:
+                self._columns.clear()
+            else:
+                self._columns.pop(conid, None)
@@ -23,3 +23,29 @@ def init_logging(default_level: str = logging.DEBUG,
     for level, libs in loggers.items():
         for lib in libs:
             logging.getLogger(lib).setLevel(level)
+
+
+# seconds of each duration unit used by the gateway for periods and bars
+# (months and years are approximated)
+_duration_units = {
+    "s": 1,
+    "secs": 1,
+    "min": 60,
+    "mins": 60,
+    "h": 3600,
+    "d": 86400,
+    "w": 7 * 86400,
+    "m": 30 * 86400,
+    "y": 365 * 86400
+}
+
+
+def parse_duration(value: str) -> int:
+    """Convert a gateway duration, like "5min", "1h" or "30d", to seconds."""
+    value = value.strip()
+    idx = 0
+    while idx < len(value) and value[idx].isdigit():
+        idx += 1
+    if idx == 0 or value[idx:] not in _duration_units:
+        raise ValueError(f"Invalid duration '{value}'")
+    return int(value[:idx]) * _duration_units[value[idx:]]
@@ -0,0 +1,203 @@
+import json
+import logging
+import ssl
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, List, Optional, Union
+
+from websocket import (WebSocket, WebSocketException, WebSocketTimeoutException,
+                       create_connection)
+
+
+class WebSocketSession:
+    """Long-lived websocket connection to the IB gateway.
+
+    The connection is opened once by a background reader thread, which keeps
+    draining inbound frames and dispatching them to the registered handlers.
+    If the connection drops, it is reopened automatically with exponential
+    backoff. Outbound commands (e.g. `smd+`/`umd+`) are queued and sent as soon
+    as the connection is ready, so no command is lost while reconnecting.
+    """
+    _log: logging.Logger = logging.getLogger("WebSocketSession")
+    # number of frames sent by the gateway right after connecting, before it
+    # is ready to accept commands
+    _welcome_frames: int = 2
+
+    def __init__(self,
+                 url: str,
+                 reconnect_delay: float = 1.0,
+                 max_reconnect_delay: float = 30.0,
+                 heartbeat_interval: float = 55.0,
+                 recv_timeout: float = 1.0):
+        """Init websocket session, without connecting.
+
+        Args:
+            url: Websocket URL of the gateway.
+            reconnect_delay: Initial delay between reconnection attempts.
+            max_reconnect_delay: Maximum delay between reconnection attempts.
+            heartbeat_interval: Interval between heartbeats sent to keep the
+                session alive (set to 0 to disable).
+            recv_timeout: Maximum time the reader blocks on a frame, which is
+                also the resolution of heartbeats and of stopping.
+        """
+        self._url = url
+        self._reconnect_delay = reconnect_delay
+        self._max_reconnect_delay = max_reconnect_delay
+        self._heartbeat_interval = heartbeat_interval
+        self._recv_timeout = recv_timeout
+        self._ws: Optional[WebSocket] = None
+        self._outbox: Deque[str] = deque()
+        self._send_lock = threading.Lock()
+        self._handlers: List[Callable[[dict], None]] = []
+        self._connect_handlers: List[Callable[[], None]] = []
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._ready = threading.Event()
+        self._last_sent = 0.0
+
+    def start(self):
+        """Start the background reader thread, if not already running."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name="WebSocketSession",
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        """Close the connection and stop the background reader thread."""
+        self._stop.set()
+        ws = self._ws
+        if ws is not None:
+            ws.close()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def is_ready(self) -> bool:
+        """Is the connection open and ready to accept commands?"""
+        return self._ready.is_set()
+
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        """Wait for the connection to be ready, returning False on timeout."""
+        return self._ready.wait(timeout)
+
+    def add_handler(self, handler: Callable[[dict], None]):
+        """Register a callback called with every decoded inbound message."""
+        self._handlers.append(handler)
+
+    def remove_handler(self, handler: Callable[[dict], None]):
+        self._handlers.remove(handler)
+
+    def add_connect_handler(self, handler: Callable[[], None]):
+        """Register a callback called every time the connection is (re)opened.
+
+        It is called as soon as the connection is ready, so it can be used to
+        send commands that must be repeated on each new connection.
+        """
+        self._connect_handlers.append(handler)
+
+    def remove_connect_handler(self, handler: Callable[[], None]):
+        self._connect_handlers.remove(handler)
+
+    def send(self, cmd: Union[List[str], str]):
+        """Queue one or more commands, sending them as soon as possible."""
+        if isinstance(cmd, str):
+            cmd = [cmd]
+        self._outbox.extend(cmd)
+        self._flush()
+
+    def _flush(self):
+        """Send queued commands, keeping them queued if not connected."""
+        with self._send_lock:
+            ws = self._ws
+            if ws is None or not self._ready.is_set():
+                return
+            while len(self._outbox) > 0:
+                cmd = self._outbox[0]
+                try:
+                    ws.send(cmd)
+                except (WebSocketException, OSError) as exc:
+                    # will be sent again after reconnecting
+                    self._log.warning(f"[ws] Cannot send '{cmd}': {exc}")
+                    return
+                self._outbox.popleft()
+                self._last_sent = time.monotonic()
+                self._log.debug(f"[ws] > {cmd}")
+
+    def _run(self):
+        delay = self._reconnect_delay
+        while not self._stop.is_set():
+            try:
+                sslopt = {"cert_reqs": ssl.CERT_NONE}
+                ws = create_connection(self._url,
+                                       sslopt=sslopt,
+                                       timeout=self._recv_timeout)
+            except (WebSocketException, OSError) as exc:
+                self._log.warning(f"[ws] Cannot connect: {exc}, retrying in "
+                                  f"{delay:.1f}s")
+                self._stop.wait(delay)
+                delay = min(delay * 2, self._max_reconnect_delay)
+                continue
+
+            self._log.debug("[ws] Connected")
+            delay = self._reconnect_delay
+            self._ws = ws
+            try:
+                self._read_loop(ws)
+            except (WebSocketException, OSError) as exc:
+                if not self._stop.is_set():
+                    self._log.warning(f"[ws] Connection lost: {exc}")
+            finally:
+                self._ready.clear()
+                self._ws = None
+                ws.close()
+        self._log.debug("[ws] Stopped")
+
+    def _read_loop(self, ws: WebSocket):
+        num_frames = 0
+        while not self._stop.is_set():
+            try:
+                frame = ws.recv()
+            except WebSocketTimeoutException:
+                self._heartbeat()
+                continue
+            if not frame:
+                # connection closed by the gateway
+                raise WebSocketException("closed by remote host")
+            num_frames += 1
+            self._dispatch(frame)
+
+            if num_frames == self._welcome_frames:
+                self._log.debug("[ws] Ready")
+                self._ready.set()
+                for handler in list(self._connect_handlers):
+                    try:
+                        handler()
+                    except Exception:
+                        self._log.exception("[ws] Error in connect handler")
+                self._flush()
+            self._heartbeat()
+
+    def _heartbeat(self):
+        if (self._heartbeat_interval > 0 and self._ready.is_set() and
+                time.monotonic() - self._last_sent > self._heartbeat_interval):
+            self.send("tic")
+
+    def _dispatch(self, frame: Union[str, bytes]):
+        if isinstance(frame, bytes):
+            frame = frame.decode("utf-8", errors="replace")
+        try:
+            msg = json.loads(frame)
+        except ValueError:
+            self._log.debug(f"[ws] < {frame}")
+            return
+        if not isinstance(msg, dict):
+            return
+        for handler in list(self._handlers):
+            try:
+                handler(msg)
+            except Exception:
+                self._log.exception("[ws] Error in message handler")
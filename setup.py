@@ -5,5 +5,7 @@ if __name__ == "__main__":
           version='0.1.0',
           packages=find_packages(include=['ibwebapiclient']),
           install_requires=[
-              "requests", "websocket-client", "coloredlogs", "pydantic"
-          ])
+              "requests", "websocket-client", "coloredlogs", "pydantic",
+              "aiohttp", "pandas", "numpy"
+          ],
+          extras_require={"cache": ["pyarrow"]})
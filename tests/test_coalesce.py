@@ -0,0 +1,55 @@
+import asyncio
+import threading
+
+import pytest
+
+from ibwebapiclient.coalesce import RequestCoalescer
+from ibwebapiclient.retry import DeadlineExceeded, deadline
+
+URL = "portfolio/accounts"
+
+
+def test_follower_wait_is_bounded_by_deadline():
+    coalescer = RequestCoalescer()
+    started = threading.Event()
+    release = threading.Event()
+
+    def fetch():
+        started.set()
+        release.wait(5.0)
+        return b"[]"
+
+    leader = threading.Thread(target=coalescer.do, args=("get", URL, {}, fetch))
+    leader.start()
+    assert started.wait(5.0)
+    try:
+        with deadline(0.05):
+            with pytest.raises(DeadlineExceeded):
+                coalescer.do("get", URL, {}, fetch)
+    finally:
+        release.set()
+        leader.join(5.0)
+    assert coalescer.stats()["coalesced"] == 1
+
+
+def test_async_follower_wait_is_bounded_by_deadline():
+    coalescer = RequestCoalescer()
+
+    async def main():
+        release = asyncio.Event()
+
+        async def fetch():
+            await release.wait()
+            return b"[]"
+
+        leader = asyncio.ensure_future(coalescer.do_async(
+            "get", URL, {}, fetch))
+        await asyncio.sleep(0)
+        with deadline(0.05):
+            with pytest.raises(DeadlineExceeded):
+                await coalescer.do_async("get", URL, {}, fetch)
+        # the shared request is not cancelled
+        release.set()
+        assert await leader == b"[]"
+
+    asyncio.run(main())
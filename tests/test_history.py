@@ -0,0 +1,90 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from ibwebapiclient.history import (HISTORY_COLUMNS, HistoryBackfill,
+                                    _decode_candles_fast, decode_market_history)
+
+REGULAR = (b'{"symbol":"AAPL","data":['
+           b'{"o":1.5,"c":2.5,"h":3.0,"l":1.0,"v":100,"t":1700000000000},'
+           b'{"o":2.5,"c":3.5,"h":4.0,"l":2.0,"v":200,"t":1700000060000}'
+           b'],"points":2}')
+
+
+def test_fast_decoder_parses_regular_candles():
+    data_text = REGULAR[REGULAR.index(b"[") + 1:REGULAR.index(b"]")]
+    columns = _decode_candles_fast(data_text)
+    assert columns is not None
+    np.testing.assert_array_equal(columns["c"], [2.5, 3.5])
+    np.testing.assert_array_equal(columns["v"], [100, 200])
+
+
+def test_fast_decoder_rejects_keys_in_different_order():
+    for swapped in (b'{"o":2.5,"h":4.0,"c":3.5,"l":2.0,"v":200,'
+                    b'"t":1700000060000}',
+                    b'{"o":2.5,"c":3.5,"h":4.0,"l":2.0,"t":1700000060000,'
+                    b'"v":200}'):
+        data_text = (b'{"o":1.5,"c":2.5,"h":3.0,"l":1.0,"v":100,'
+                     b'"t":1700000000000},' + swapped)
+        assert _decode_candles_fast(data_text) is None
+        content = b'{"data":[' + data_text + b']}'
+        df, _ = decode_market_history(content)
+        np.testing.assert_array_equal(df["c"], [2.5, 3.5])
+        np.testing.assert_array_equal(df["h"], [3.0, 4.0])
+        np.testing.assert_array_equal(df["v"], [100, 200])
+
+
+def test_fast_decoder_rejects_missing_values():
+    data_text = (b'{"o":1.5,"c":null,"h":3.0,"l":1.0,"v":100,'
+                 b'"t":1700000000000}')
+    assert _decode_candles_fast(data_text) is None
+    df, _ = decode_market_history(b'{"data":[' + data_text + b']}')
+    assert np.isnan(df["c"].iloc[0])
+
+
+def test_decode_market_history():
+    df, meta = decode_market_history(REGULAR, tz="America/New_York")
+    assert meta == {"symbol": "AAPL", "points": 2}
+    assert str(df.index.tz) == "America/New_York"
+    np.testing.assert_array_equal(df["o"], [1.5, 2.5])
+
+
+class FakeHistoryClient:
+    """Client returning one bar per window, tracking concurrent requests."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+
+    def get_market_history_fast(self, conid, start_time, tz="UTC", **kwargs):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(0.01)
+        with self.lock:
+            self.active -= 1
+        index = pd.DatetimeIndex([start_time], name="t").tz_convert(tz)
+        df = pd.DataFrame({col: [float(conid)] for col in HISTORY_COLUMNS},
+                          index=index)
+        return df, {}
+
+
+def test_concurrent_backfills_share_workers():
+    client = FakeHistoryClient()
+    backfill = HistoryBackfill(client, max_workers=2)
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    end = datetime(2024, 1, 3, tzinfo=timezone.utc)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        frames = list(
+            executor.map(
+                lambda conid: backfill.fetch(conid, start, end=end, bar="1h"),
+                range(4)))
+    assert client.max_active <= 2
+    for conid, df in enumerate(frames):
+        assert len(df) > 0
+        assert (df["c"] == conid).all()
@@ -0,0 +1,116 @@
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ibwebapiclient.history import HISTORY_COLUMNS
+from ibwebapiclient.history_cache import HistoryCache
+
+CONID = 265598
+
+
+def make_bars(start: str, end: str, freq: str) -> pd.DataFrame:
+    index = pd.date_range(start, end, freq=freq, tz="UTC", name="t")
+    values = np.arange(len(index), dtype=np.float64)
+    return pd.DataFrame({col: values for col in HISTORY_COLUMNS}, index=index)
+
+
+class FakeBackfill:
+    """Backfill recording the requested ranges, returning synthetic bars."""
+
+    def __init__(self):
+        self.calls = []
+
+    def fetch(self, conid, start, end=None, bar="1min", **kwargs):
+        self.calls.append((bar, start, end))
+        freq = {"1min": "1min", "1h": "1h", "1d": "1D"}[bar]
+        return make_bars(start, end, freq)
+
+
+def test_derive_from_fine_bars_covering_range():
+    cache = HistoryCache()
+    bars = make_bars("2024-01-01", "2024-01-02", "1min")
+    cache.save(CONID, "1min", True, bars)
+    backfill = FakeBackfill()
+    df = cache.fetch(backfill,
+                     CONID,
+                     datetime(2024, 1, 1, tzinfo=timezone.utc),
+                     end=datetime(2024, 1, 1, 12, tzinfo=timezone.utc),
+                     bar="1h")
+    assert backfill.calls == []
+    assert len(df) == 13
+    assert df["v"].iloc[0] == sum(range(60))
+
+
+def test_fetch_coarse_bars_if_fine_bars_cover_only_start():
+    cache = HistoryCache()
+    bars = make_bars("2024-01-01", "2024-01-02", "1min")
+    cache.save(CONID, "1min", True, bars)
+    backfill = FakeBackfill()
+    cache.fetch(backfill,
+                CONID,
+                datetime(2024, 1, 1, tzinfo=timezone.utc),
+                end=datetime(2024, 10, 1, tzinfo=timezone.utc),
+                bar="1h")
+    assert [call[0] for call in backfill.calls] == ["1h"]
+    assert len(cache.load(CONID, "1min", True)) == 24 * 60 + 1
+
+
+def test_daily_bars_are_not_derived():
+    cache = HistoryCache()
+    bars = make_bars("2024-01-01", "2024-01-03", "1min")
+    cache.save(CONID, "1min", True, bars)
+    backfill = FakeBackfill()
+    cache.fetch(backfill,
+                CONID,
+                datetime(2024, 1, 1, tzinfo=timezone.utc),
+                end=datetime(2024, 1, 3, tzinfo=timezone.utc),
+                bar="1d",
+                tz="America/New_York")
+    assert [call[0] for call in backfill.calls] == ["1d"]
+
+
+def test_memory_cache_evicts_least_recently_used():
+    cache = HistoryCache(max_memory_bars=100)
+    cache.save(1, "1min", True,
+               make_bars("2024-01-01", "2024-01-01 00:59", "1min"))
+    cache.save(2, "1min", True,
+               make_bars("2024-01-01", "2024-01-01 00:29", "1min"))
+    cache.load(1, "1min", True)
+    cache.save(3, "1min", True,
+               make_bars("2024-01-01", "2024-01-01 00:29", "1min"))
+    assert cache.load(2, "1min", True) is None
+    assert cache.load(1, "1min", True) is not None
+    assert cache.load(3, "1min", True) is not None
+    # bars exceeding the whole cache are not kept
+    cache.save(4, "1min", True,
+               make_bars("2024-01-01", "2024-01-01 02:00", "1min"))
+    assert cache.get_bars(4, True) == []
+
+
+def test_bars_are_cached_by_exchange():
+    cache = HistoryCache()
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    end = datetime(2024, 1, 1, 12, tzinfo=timezone.utc)
+    backfill = FakeBackfill()
+    cache.fetch(backfill, CONID, start, end=end, bar="1h")
+    cache.fetch(backfill, CONID, start, end=end, bar="1h", exchange="ISLAND")
+    assert len(backfill.calls) == 2
+    cache.fetch(backfill, CONID, start, end=end, bar="1h", exchange="ISLAND")
+    assert len(backfill.calls) == 2
+    assert cache.get_bars(CONID, True, exchange="ISLAND") == ["1h"]
+
+
+def test_disk_files_by_exchange(tmp_path):
+    pytest.importorskip("pyarrow")
+    cache = HistoryCache(str(tmp_path))
+    bars = make_bars("2024-01-01", "2024-01-01 12:00", "1h")
+    cache.save(CONID, "1h", True, bars)
+    cache.save(CONID, "1h", True, bars.iloc[:2], exchange="ISLAND")
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        f"{CONID}_1h_ext.feather", f"{CONID}_1h_ext_ISLAND.feather"
+    ]
+    assert cache.get_bars(CONID, True) == ["1h"]
+    assert len(cache.load(CONID, "1h", True)) == 13
+    assert len(cache.load(CONID, "1h", True, exchange="ISLAND")) == 2
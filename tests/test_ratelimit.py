@@ -0,0 +1,159 @@
+import threading
+
+import pytest
+
+from ibwebapiclient.ratelimit import PriorityScheduler, RateLimiter
+from ibwebapiclient.retry import DeadlineExceeded
+
+BULK_URL = "iserver/marketdata/history"
+ORDER_URL = "iserver/account/U1234567/orders"
+SNAPSHOT_URL = "iserver/marketdata/snapshot"
+
+
+class FakeClock:
+    """Simulated clock: sleeping threads block until the test advances the
+    clock past their wake-up time."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.num_sleepers = 0
+        self._cond = threading.Condition()
+
+    def __call__(self) -> float:
+        with self._cond:
+            return self.now
+
+    def advance(self, seconds: float):
+        with self._cond:
+            self.now += seconds
+            self._cond.notify_all()
+
+    def sleep(self, seconds: float):
+        with self._cond:
+            wake = self.now + seconds
+            self.num_sleepers += 1
+            self._cond.notify_all()
+            while self.now < wake:
+                self._cond.wait()
+            self.num_sleepers -= 1
+            self._cond.notify_all()
+
+    def wait_for(self, predicate):
+        """Wait, in real time, until a condition on the clock holds."""
+        with self._cond:
+            assert self._cond.wait_for(lambda: predicate(self), timeout=5.0)
+
+
+def make_limiter(clock: FakeClock, **kwargs) -> RateLimiter:
+    # a single-threaded test can sleep by advancing the clock
+    kwargs.setdefault("sleep", clock.advance)
+    return RateLimiter(clock=clock, **kwargs)
+
+
+def test_small_burst_does_not_block_reserved_lanes():
+    for burst in (1, 2, 3):
+        clock = FakeClock()
+        limiter = make_limiter(clock,
+                               rules=[],
+                               global_rate=100.0,
+                               global_burst=burst)
+        assert limiter.acquire(BULK_URL) == 0.0
+        assert limiter.acquire(SNAPSHOT_URL) <= 0.01
+        assert clock.now <= 0.01
+
+
+def test_invalid_burst():
+    with pytest.raises(ValueError):
+        PriorityScheduler(10.0, burst=0)
+
+
+def test_endpoint_pacing_limit():
+    clock = FakeClock()
+    limiter = make_limiter(clock,
+                           rules=[(r"iserver/account/orders", 0.2, 1)],
+                           global_rate=None)
+    assert limiter.acquire("iserver/account/orders") == 0.0
+    assert limiter.acquire("iserver/account/orders") == pytest.approx(5.0)
+    assert clock.now == pytest.approx(5.0)
+    # other endpoints are not paced
+    assert limiter.acquire("iserver/accounts") == 0.0
+
+
+def test_timeout_does_not_wait():
+    clock = FakeClock()
+    limiter = make_limiter(clock,
+                           rules=[(r"iserver/account/orders", 0.2, 1)],
+                           global_rate=1.0,
+                           global_burst=1,
+                           lane_reserves={})
+    limiter.acquire("iserver/account/orders")
+    with pytest.raises(DeadlineExceeded):
+        limiter.acquire("iserver/account/orders", timeout=4.0)
+    # the global limit is exhausted too
+    with pytest.raises(DeadlineExceeded):
+        limiter.acquire(BULK_URL, timeout=0.5)
+    assert clock.now == 0.0
+    # the requests gave up their turns
+    assert limiter.acquire(BULK_URL) == pytest.approx(1.0)
+
+
+def test_orders_overtake_queued_bulk_requests():
+    clock = FakeClock()
+    limiter = RateLimiter(rules=[],
+                          global_rate=1.0,
+                          global_burst=1,
+                          lane_reserves={},
+                          clock=clock,
+                          sleep=clock.sleep)
+    # drain the bucket
+    limiter.acquire(BULK_URL)
+    order = []
+    order_lock = threading.Lock()
+
+    def acquire(url):
+        limiter.acquire(url)
+        with order_lock:
+            order.append(url)
+
+    threads = []
+    for url in [BULK_URL] * 5 + [ORDER_URL]:
+        thread = threading.Thread(target=acquire, args=(url,))
+        thread.start()
+        threads.append(thread)
+        # queue the requests in this order
+        num_queued = len(threads)
+        clock.wait_for(lambda clock: clock.num_sleepers == num_queued)
+
+    # one token per step: wait until its request is done and the other ones
+    # are sleeping again before the next step
+    for step in range(1, 7):
+        clock.advance(1.0)
+        clock.wait_for(
+            lambda clock: len(order) == step and clock.num_sleepers == 6 - step)
+    for thread in threads:
+        thread.join(timeout=5.0)
+    assert order == [ORDER_URL] + [BULK_URL] * 5
+    stats = limiter.stats()["*"]
+    assert stats["orders"]["requests"] == 1
+    assert stats["orders"]["max_wait"] == 1.0
+    assert stats["bulk"]["requests"] == 6
+
+
+def test_bulk_leaves_reserve_to_orders():
+    clock = FakeClock()
+    limiter = make_limiter(clock,
+                           rules=[],
+                           global_rate=1.0,
+                           global_burst=4,
+                           lane_reserves={"bulk": 2.0})
+    assert limiter.acquire(BULK_URL) == 0.0
+    assert limiter.acquire(BULK_URL) == 0.0
+    # the bulk lane would now wait, orders still find tokens
+    assert limiter.acquire(ORDER_URL) == 0.0
+    assert limiter.acquire(ORDER_URL) == 0.0
+    # bulk requests wait for the bucket to refill above the reserve
+    assert limiter.acquire(BULK_URL) == pytest.approx(3.0)
+    stats = limiter.stats()["*"]
+    assert stats["bulk"]["requests"] == 3
+    assert stats["bulk"]["waits"] == 1
+    assert stats["orders"]["waits"] == 0
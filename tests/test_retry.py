@@ -0,0 +1,43 @@
+import time
+
+import pytest
+
+from ibwebapiclient.ratelimit import RateLimiter
+from ibwebapiclient.retry import DeadlineExceeded, RetryPolicy, deadline
+
+ORDERS_URL = "iserver/account/orders"
+
+
+def test_deadline_bounds_rate_limited_retry():
+    limiter = RateLimiter(rules=[(ORDERS_URL, 0.2, 1)], global_rate=None)
+    policy = RetryPolicy()
+    num_calls = []
+
+    def send(timeout):
+        limiter.acquire(ORDERS_URL, timeout=timeout)
+        num_calls.append(timeout)
+        return b"[]"
+
+    start = time.monotonic()
+    with deadline(2.0):
+        with pytest.raises(DeadlineExceeded):
+            policy.call("get", ORDERS_URL, send)
+    # the retry of the empty response gives up instead of waiting 5 seconds
+    assert time.monotonic() - start < 1.0
+    assert len(num_calls) == 1
+    assert policy.stats()["deadlines"] == 1
+    # the token was not reserved
+    assert limiter.stats()[ORDERS_URL]["requests"] == 1
+
+
+def test_rate_limited_retry_without_deadline():
+    limiter = RateLimiter(rules=[(ORDERS_URL, 100.0, 1)], global_rate=None)
+    policy = RetryPolicy()
+    responses = [b"[]", b'[{"orderId": 1}]']
+
+    def send(timeout):
+        limiter.acquire(ORDERS_URL, timeout=timeout)
+        return responses.pop(0)
+
+    assert policy.call("get", ORDERS_URL, send) == b'[{"orderId": 1}]'
+    assert policy.stats()["empty_retries"] == 1
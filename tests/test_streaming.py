@@ -0,0 +1,43 @@
+from ibwebapiclient.streaming import MarketDataHandler, MarketDataStream
+
+
+class FakeSession:
+
+    def __init__(self):
+        self.handlers = []
+
+    def add_handler(self, handler):
+        self.handlers.append(handler)
+
+    def remove_handler(self, handler):
+        self.handlers.remove(handler)
+
+
+def test_stream_on_session():
+    session = FakeSession()
+    closed = []
+    stream = MarketDataStream(session,
+                              conids=[1],
+                              on_close=lambda: closed.append(True))
+    for handler in session.handlers:
+        handler({"topic": "smd+2", "31": "2.0"})
+        handler({"topic": "smd+1", "31": "1.5"})
+    tick = stream.get(timeout=0)
+    assert tick["conid"] == 1
+    assert tick["last_price"] == "1.5"
+    assert stream.get(timeout=0) is None
+    stream.close()
+    stream.close()
+    assert session.handlers == []
+    assert closed == [True]
+
+
+def test_stream_fed_by_caller():
+    # e.g. registered with IBWebApiClient.add_market_data_callback(), which
+    # moves it to the next websocket session
+    stream = MarketDataStream()
+    handler = MarketDataHandler(stream.buffer.put, conids=[1])
+    handler({"topic": "smd+1", "31": "1.5"})
+    assert stream.get(timeout=0)["last_price"] == "1.5"
+    stream.close()
+    assert stream.get(timeout=0) is None
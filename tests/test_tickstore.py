@@ -0,0 +1,60 @@
+import numpy as np
+
+from ibwebapiclient.tickstore import TickStore, aggregate_ticks
+
+CONID = 265598
+T0 = 1700000040000
+
+
+def make_tick(t, last, volume, volume_long=None):
+    tick = {"conid": CONID, "_updated": t, "last_price": last, "volume": volume}
+    if volume_long is not None:
+        tick["volume_long"] = volume_long
+    return tick
+
+
+def test_bar_volume_from_exact_volume():
+    store = TickStore()
+    volumes = [12300000, 12310000, 12325000, 12340000, 12345000]
+    for idx, volume in enumerate(volumes):
+        # the rounded volume is the same for all the ticks but one
+        store.append_tick(
+            make_tick(T0 + idx * 60000, str(100.0 + idx),
+                      "12.3M" if idx != 2 else "12.4M", str(volume)))
+    bars = store.get_bars(CONID, "1min")
+    np.testing.assert_array_equal(bars["v"], [0, 10000, 15000, 15000, 5000])
+    np.testing.assert_array_equal(bars["c"], [100, 101, 102, 103, 104])
+
+
+def test_bar_volume_from_raw_volume():
+    store = TickStore()
+    store.append_tick({
+        "conid": CONID,
+        "_updated": T0,
+        "last_price": "100",
+        "volume": "1.2K",
+        "volume_raw": 1200.0
+    })
+    store.append_tick({
+        "conid": CONID,
+        "_updated": T0 + 60000,
+        "last_price": "101",
+        "volume": "1.2K",
+        "volume_raw": 1250.0
+    })
+    ticks = store.get_ticks(CONID)
+    np.testing.assert_array_equal(ticks["volume"], [1200, 1250])
+    bars = store.get_bars(CONID, "1min")
+    np.testing.assert_array_equal(bars["v"], [0, 50])
+
+
+def test_aggregate_ticks():
+    t = np.array([0, 1000, 59000, 60000, 61000], dtype=np.int64)
+    price = np.array([1.0, 3.0, 2.0, np.nan, 5.0])
+    volume = np.array([10.0, 12.0, np.nan, 20.0, 25.0])
+    bars = aggregate_ticks(t, price, volume, bar_ms=60000)
+    np.testing.assert_array_equal(bars["o"], [1.0, 5.0])
+    np.testing.assert_array_equal(bars["h"], [3.0, 5.0])
+    np.testing.assert_array_equal(bars["c"], [2.0, 5.0])
+    np.testing.assert_array_equal(bars["v"], [2.0, 13.0])
+    np.testing.assert_array_equal(bars["t"], [0, 60000])